@@ -1,17 +1,73 @@
-from app.splitwise import SplitwiseApp
-from database.model_types import User
+import argparse
+import sys
+
+from app import ledger
+from app.splitwise import IMPORT_CHUNK_SIZE, SplitwiseApp
+
+
+def import_ledger(args: argparse.Namespace):
+    ledger_format = args.format or ledger.detect_format(args.path)
+    splitwise = SplitwiseApp(db_name=args.db_name)
+    with ledger.open_ledger(args.path) as stream:
+        report = splitwise.import_ledger(
+            ledger.read_ledger(stream, ledger_format),
+            chunk_size=args.chunk_size,
+            max_errors=args.max_errors,
+        )
+    for error in report.errors:
+        print(f'{args.path}:{error.line}: {error.message}', file=sys.stderr)
+    if report.failed > len(report.errors):
+        print(f'... {report.failed - len(report.errors)} more errors', file=sys.stderr)
+    print(f'Imported {report.expenses} expenses and {report.debts} debts, {report.failed} rows failed')
+    if report.failed:
+        sys.exit(1)
+
+
+def export_ledger(args: argparse.Namespace):
+    splitwise = SplitwiseApp(db_name=args.db_name)
+    try:
+        splitwise.get_event_info(args.event_token)
+    except KeyError as e:
+        sys.exit(e.args[0])
+    if args.output == '-':
+        ledger_format = args.format or ledger.CSV
+        rows = ledger.write_ledger(
+            splitwise.iter_event_ledger(args.event_token), sys.stdout.buffer, ledger_format, compress=args.gzip,
+        )
+    else:
+        ledger_format = args.format or ledger.detect_format(args.output)
+        with open(args.output, 'wb') as file:
+            rows = ledger.write_ledger(
+                splitwise.iter_event_ledger(args.event_token),
+                file,
+                ledger_format,
+                compress=args.gzip or args.output.endswith('.gz'),
+            )
+    print(f'Exported {rows} rows', file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m app', description='Application commands')
+    parser.add_argument('--db-name', default='database.sqlite')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help='import expenses and debts from a CSV or JSONL ledger')
+    import_parser.add_argument('path', help='ledger file, may be gzipped, see app/ledger.py for its format')
+    import_parser.add_argument('--format', choices=ledger.LEDGER_FORMATS, help='detected by file name by default')
+    import_parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help='rows per transaction')
+    import_parser.add_argument('--max-errors', type=int, default=100, help='errors listed at most')
+    import_parser.set_defaults(handler=import_ledger)
+
+    export_parser = subparsers.add_parser('export', help='write expenses and debts of an event as a ledger')
+    export_parser.add_argument('event_token')
+    export_parser.add_argument('-o', '--output', default='-', help='file name or - for stdout')
+    export_parser.add_argument('--format', choices=ledger.LEDGER_FORMATS, help='detected by file name by default')
+    export_parser.add_argument('--gzip', action='store_true', help='implied by .gz file name')
+    export_parser.set_defaults(handler=export_ledger)
+
+    args = parser.parse_args()
+    args.handler(args)
 
 
 if __name__ == '__main__':
-    splitwise = SplitwiseApp(db_name='testdb.sqlite')
-    users = [
-        (123, 'Ivan'),
-        (456, 'Maria'),
-        (789, 'San44ez'),
-    ]
-
-    for id_, name in users:
-        splitwise.add_new_user(User(id=id_, name=name))
-
-    for id_, _ in users:
-        print(splitwise.get_user_info(id_))
+    main()
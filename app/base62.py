@@ -0,0 +1,45 @@
+"""
+Base62 of integers and random codes made of the same alphabet:
+event join codes and ids in callback data of inline buttons
+"""
+import secrets
+
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+_DIGITS = {char: value for value, char in enumerate(ALPHABET)}
+
+
+def encode(number: int) -> str:
+    """
+    encode(0) == '0', negative numbers get a '-' prefix
+    """
+    if number < 0:
+        return '-' + encode(-number)
+    digits = []
+    while True:
+        number, digit = divmod(number, 62)
+        digits.append(ALPHABET[digit])
+        if not number:
+            return ''.join(reversed(digits))
+
+
+def decode(code: str) -> int:
+    """
+    @raise ValueError: code is empty or has characters out of the alphabet
+    """
+    sign, digits = (-1, code[1:]) if code.startswith('-') else (1, code)
+    if not digits:
+        raise ValueError(f'Invalid base62 code: {code!r}')
+    number = 0
+    for char in digits:
+        digit = _DIGITS.get(char)
+        if digit is None:
+            raise ValueError(f'Invalid base62 code: {code!r}')
+        number = number * 62 + digit
+    return sign * number
+
+
+def random_code(length: int) -> str:
+    """
+    Code from a cryptographically strong generator, a code of length 12 has 71 bits of entropy
+    """
+    return ''.join(secrets.choice(ALPHABET) for _ in range(length))
@@ -0,0 +1,209 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, NoReturn, Optional, Tuple
+
+from database.connector import Connector
+from database.model_types import User, Event
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe dict with bounded size, least recently used entries are evicted first
+    If ttl is set, entries older than ttl seconds are treated as missing
+    """
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: Optional[float] = None,
+    ):
+        if maxsize < 1:
+            raise ValueError(f'Cache size must be positive, got {maxsize}')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(
+        self,
+        key: Hashable,
+        default: Any = None,
+    ) -> Any:
+        with self._lock:
+            value, expires_at = self._data.get(key, (_MISSING, None))
+            if value is not _MISSING and expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                value = _MISSING
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(
+        self,
+        key: Hashable,
+        value: Any,
+    ) -> NoReturn:
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(
+        self,
+        key: Hashable,
+    ) -> NoReturn:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """
+        Snapshot of cached entries from least to most recently used, ignoring ttl
+        """
+        with self._lock:
+            return [(key, value) for key, (value, _) in self._data.items()]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class CachedConnector:
+    """
+    Read-through cache in front of Connector for rarely changing rows:
+    users, events by token and by id and memberships (user_id, event_token).
+    Writes made through this object invalidate affected entries,
+    other methods are passed to the connector as is.
+    Negative results (no such user, no membership) are not cached:
+    rows may be added by another connection, e.g. the import CLI or another bot process
+    """
+    def __init__(
+        self,
+        connector: Connector,
+        maxsize: int = 1024,
+        ttl: Optional[float] = 300.0,
+    ):
+        self.connector = connector
+        self._users = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._events = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._events_by_id = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._memberships = LRUCache(maxsize=maxsize, ttl=ttl)
+        # bumped on every invalidation, a value loaded while an invalidation
+        # was in progress may be stale and is not stored
+        self._invalidations = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.connector, name)
+
+    def _get_or_load(
+        self,
+        cache: LRUCache,
+        key: Hashable,
+        loader: Callable[[], Any],
+    ) -> Any:
+        value = cache.get(key, _MISSING)
+        if value is _MISSING:
+            invalidations = self._invalidations
+            value = loader()
+            # None and False are negative results
+            if value is None or value is False:
+                return value
+            with self._lock:
+                if invalidations == self._invalidations:
+                    cache.put(key, value)
+        return value
+
+    def _invalidate(
+        self,
+        entries: List[Tuple[LRUCache, Hashable]],
+    ) -> NoReturn:
+        with self._lock:
+            self._invalidations += 1
+            for cache, key in entries:
+                cache.invalidate(key)
+
+    def get_user_info_or_none(
+        self,
+        user_id: int,
+    ) -> Optional[User]:
+        return self._get_or_load(self._users, user_id, lambda: self.connector.get_user_info_or_none(user_id))
+
+    def get_event_info(
+        self,
+        event_token: str,
+    ) -> Event:
+        # KeyError for unknown token is raised by loader and not cached
+        return self._get_or_load(self._events, event_token, lambda: self.connector.get_event_info(event_token))
+
+    def get_event_by_id(
+        self,
+        event_id: int,
+    ) -> Event:
+        # events are never modified or deleted, an id is unknown until the event is created
+        return self._get_or_load(self._events_by_id, event_id, lambda: self.connector.get_event_by_id(event_id))
+
+    def user_participates_in_event(
+        self,
+        user_id: int,
+        event_token: str,
+    ) -> bool:
+        return self._get_or_load(
+            self._memberships,
+            (user_id, event_token),
+            lambda: self.connector.user_participates_in_event(user_id, event_token),
+        )
+
+    def save_user_info(
+        self,
+        user: User,
+    ) -> NoReturn:
+        try:
+            self.connector.save_user_info(user)
+        finally:
+            self._invalidate([(self._users, user.id)])
+
+    def create_event(
+        self,
+        event: Event,
+        user_id: int,
+    ) -> Event:
+        try:
+            return self.connector.create_event(event, user_id)
+        finally:
+            self._invalidate([(self._events, event.token), (self._memberships, (user_id, event.token))])
+
+    def add_user_to_event(
+        self,
+        user_id: int,
+        event_token: str,
+    ) -> NoReturn:
+        try:
+            self.connector.add_user_to_event(user_id, event_token)
+        finally:
+            self._invalidate([(self._memberships, (user_id, event_token))])
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            'users': self._users.stats(),
+            'events': self._events.stats(),
+            'events_by_id': self._events_by_id.stats(),
+            'memberships': self._memberships.stats(),
+        }
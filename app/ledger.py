@@ -0,0 +1,243 @@
+"""
+Reading and writing ledgers of expenses and debts,
+see SplitwiseApp.import_ledger and Connector.iter_event_ledger
+
+A ledger is a CSV file with a header line or a JSONL file with one object per line,
+optionally gzipped. Every row has a kind, the other fields depend on it:
+    expense: event_token, lender_id, name, sum, datetime (ISO 8601, optional)
+    debt:    debtor_id, sum, lender_id (optional)
+A debt belongs to the closest expense above it and is owed to the lender of that expense
+"""
+import csv
+import datetime as dt
+import gzip
+import io
+import json
+from dataclasses import dataclass, field, fields
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, NoReturn, TextIO, Tuple, Union
+
+from database.model_types import Expense, Debt
+
+CSV = 'csv'
+JSONL = 'jsonl'
+LEDGER_FORMATS = (CSV, JSONL)
+EXPENSE = 'expense'
+DEBT = 'debt'
+# columns of a CSV ledger, in the order they are written
+LEDGER_FIELDS = ('kind', 'event_token', 'lender_id', 'debtor_id', 'name', 'sum', 'datetime')
+
+_REQUIRED_FIELDS = {
+    Expense: ('event_token', 'lender_id', 'name', 'sum'),
+    Debt: ('debtor_id', 'sum'),
+}
+
+
+class LedgerError(ValueError):
+    """
+    Row of a ledger that can not be imported
+    """
+
+
+@dataclass
+class RowError:
+    line: int
+    message: str
+
+
+@dataclass
+class ImportReport:
+    """
+    Only the first max_errors errors are kept, failed counts all of them
+    """
+    expenses: int = 0
+    debts: int = 0
+    failed: int = 0
+    errors: List[RowError] = field(default_factory=list)
+    max_errors: int = 100
+
+    def add_error(
+        self,
+        line: int,
+        message: str,
+    ) -> NoReturn:
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(RowError(line, message))
+
+
+def detect_format(file_name: str) -> str:
+    """
+    @return: format of a ledger by its file name, .gz suffix is ignored
+    """
+    name = file_name.lower()
+    if name.endswith('.gz'):
+        name = name[:-len('.gz')]
+    for ledger_format in LEDGER_FORMATS:
+        if name.endswith('.' + ledger_format):
+            return ledger_format
+    raise LedgerError(f'Unknown ledger format of {file_name}, expected one of {", ".join(LEDGER_FORMATS)}')
+
+
+def text_stream(
+    binary: BinaryIO,
+    file_name: str,
+) -> TextIO:
+    """
+    Decodes a ledger read from binary, gunzipping it if file_name ends with .gz
+    """
+    if file_name.lower().endswith('.gz'):
+        binary = gzip.GzipFile(fileobj=binary, mode='rb')
+    # newline='' lets csv handle line breaks inside quoted fields
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+
+
+def open_ledger(path: str) -> TextIO:
+    return text_stream(open(path, 'rb'), path)
+
+
+def read_ledger(
+    stream: TextIO,
+    ledger_format: str,
+) -> Iterator[Tuple[int, Union[Dict[str, Any], LedgerError]]]:
+    """
+    Reads rows one at a time
+    @return: (line number, row), row is a LedgerError if the line can not be parsed
+    """
+    if ledger_format == CSV:
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif ledger_format == JSONL:
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, LedgerError(f'invalid JSON: {e}')
+                continue
+            if not isinstance(row, dict):
+                yield line_number, LedgerError('row must be a JSON object')
+                continue
+            yield line_number, row
+    else:
+        raise LedgerError(f'Unknown ledger format {ledger_format}')
+
+
+def _convert(
+    name: str,
+    value: Any,
+    type_: type,
+) -> Any:
+    if type_ is int:
+        if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+            raise LedgerError(f'{name} must be an integer, got {value!r}')
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise LedgerError(f'{name} must be an integer, got {value!r}') from None
+    if type_ is dt.datetime:
+        if isinstance(value, dt.datetime):
+            return value
+        try:
+            return dt.datetime.fromisoformat(str(value))
+        except ValueError:
+            raise LedgerError(f'{name} must be an ISO 8601 date and time, got {value!r}') from None
+    return str(value)
+
+
+def _parse_model(
+    model: type,
+    row: Dict[str, Any],
+) -> Union[Expense, Debt]:
+    """
+    Builds the model from fields of the row, converting values to the types declared by the model
+    """
+    values = {}
+    for model_field in fields(model):
+        value = row.get(model_field.name)
+        if value is None or value == '':
+            continue
+        values[model_field.name] = _convert(model_field.name, value, model_field.type)
+    missing = [name for name in _REQUIRED_FIELDS[model] if name not in values]
+    if missing:
+        raise LedgerError(f'{model.__name__.lower()} requires {", ".join(missing)}')
+    if values['sum'] <= 0:
+        raise LedgerError(f'sum must be positive, got {values["sum"]}')
+    return model(**values)
+
+
+def parse_row(row: Dict[str, Any]) -> Union[Expense, Debt]:
+    """
+    @return: Expense or Debt described by the row, without ids
+    """
+    kind = row.get('kind')
+    if kind == EXPENSE:
+        expense = _parse_model(Expense, row)
+        expense.id = None
+        if not expense.name.strip():
+            raise LedgerError('name of an expense must not be empty')
+        return expense
+    if kind == DEBT:
+        debt = _parse_model(Debt, row)
+        debt.expense_id = None
+        return debt
+    raise LedgerError(f'kind must be {EXPENSE} or {DEBT}, got {kind!r}')
+
+
+def entry_to_row(entry: Union[Expense, Debt]) -> Dict[str, Any]:
+    """
+    Row of a ledger describing the entry, parse_row(entry_to_row(entry)) gives it back without ids
+    """
+    if isinstance(entry, Expense):
+        datetime = entry.datetime
+        return {
+            'kind': EXPENSE,
+            'event_token': entry.event_token,
+            'lender_id': entry.lender_id,
+            'name': entry.name,
+            'sum': entry.sum,
+            'datetime': datetime.isoformat(sep=' ') if isinstance(datetime, dt.datetime) else datetime,
+        }
+    return {
+        'kind': DEBT,
+        'lender_id': entry.lender_id,
+        'debtor_id': entry.debtor_id,
+        'sum': entry.sum,
+    }
+
+
+def write_ledger(
+    entries: Iterable[Union[Expense, Debt]],
+    binary: BinaryIO,
+    ledger_format: str,
+    compress: bool = False,
+) -> int:
+    """
+    Writes entries one row at a time, gzipping them on the fly if compress is set.
+    binary is left open
+    @return: number of rows written
+    """
+    if ledger_format not in LEDGER_FORMATS:
+        raise LedgerError(f'Unknown ledger format {ledger_format}')
+    compressed = gzip.GzipFile(fileobj=binary, mode='wb') if compress else None
+    stream = io.TextIOWrapper(compressed or binary, encoding='utf-8', newline='')
+    rows = 0
+    try:
+        if ledger_format == CSV:
+            writer = csv.DictWriter(stream, fieldnames=LEDGER_FIELDS)
+            writer.writeheader()
+            for entry in entries:
+                writer.writerow(entry_to_row(entry))
+                rows += 1
+        else:
+            for entry in entries:
+                stream.write(json.dumps(entry_to_row(entry), ensure_ascii=False))
+                stream.write('\n')
+                rows += 1
+    finally:
+        stream.flush()
+        stream.detach()
+        if compressed is not None:
+            compressed.close()
+    return rows
@@ -0,0 +1,296 @@
+import heapq
+import time
+from collections import deque, defaultdict
+from typing import Dict, List, NoReturn, Optional, Tuple
+
+# (debtor_id, lender_id, sum)
+Transfer = Tuple[int, int, int]
+
+
+class SettlementTimeout(Exception):
+    pass
+
+
+class SettlementEngine:
+    """
+    Turns net balances of an event into a list of transfers settling them
+    Balances map user_id to lent - owed and must sum up to zero
+    """
+    name = 'base'
+
+    def settle(
+        self,
+        balances: Dict[int, int],
+    ) -> List[Transfer]:
+        raise NotImplementedError
+
+    @staticmethod
+    def _split(
+        balances: Dict[int, int],
+    ) -> Tuple[List[Tuple[int, int]], List[Tuple[int, int]]]:
+        """
+        @return: (lenders, debtors) as lists of (positive sum, user_id), largest sums first
+        """
+        if sum(balances.values()) != 0:
+            raise ValueError('Balances must sum up to zero')
+        lenders = sorted(((balance, user_id) for user_id, balance in balances.items() if balance > 0), reverse=True)
+        debtors = sorted(((-balance, user_id) for user_id, balance in balances.items() if balance < 0), reverse=True)
+        return lenders, debtors
+
+
+class GreedySettlement(SettlementEngine):
+    """
+    Matches lenders and debtors in order of decreasing sums
+    At most (number of participants - 1) transfers
+    """
+    name = 'greedy'
+
+    def settle(
+        self,
+        balances: Dict[int, int],
+    ) -> List[Transfer]:
+        lenders, debtors = self._split(balances)
+        if not lenders and not debtors:
+            return []
+
+        lenders_deque = deque(lenders)
+        debtors_deque = deque(debtors)
+
+        transfers = []
+        lender_sum, lender_id = lenders_deque.popleft()
+        debtor_sum, debtor_id = debtors_deque.popleft()
+        while True:
+            payment_sum = min(lender_sum, debtor_sum)
+            transfers.append((debtor_id, lender_id, payment_sum))
+
+            lender_sum -= payment_sum
+            if lender_sum == 0:
+                if not lenders_deque:
+                    break
+                else:
+                    lender_sum, lender_id = lenders_deque.popleft()
+
+            debtor_sum -= payment_sum
+            if debtor_sum == 0:
+                if not debtors_deque:
+                    break
+                else:
+                    debtor_sum, debtor_id = debtors_deque.popleft()
+
+        if lenders_deque or debtors_deque:
+            raise RuntimeError('Something went wrong while calculating final transactions')
+        return transfers
+
+
+class HeapSettlement(SettlementEngine):
+    """
+    Fast heuristic for large events: first pays off lenders and debtors with equal sums
+    directly, then repeatedly matches the largest lender with the largest debtor
+    """
+    name = 'heap'
+
+    def settle(
+        self,
+        balances: Dict[int, int],
+    ) -> List[Transfer]:
+        lenders, debtors = self._split(balances)
+        transfers = []
+
+        lenders_by_sum = defaultdict(list)
+        for lender_sum, lender_id in lenders:
+            lenders_by_sum[lender_sum].append(lender_id)
+        debtors_heap = []
+        for debtor_sum, debtor_id in debtors:
+            if lenders_by_sum[debtor_sum]:
+                transfers.append((debtor_id, lenders_by_sum[debtor_sum].pop(), debtor_sum))
+            else:
+                debtors_heap.append((-debtor_sum, debtor_id))
+        lenders_heap = [
+            (-lender_sum, lender_id)
+            for lender_sum, lender_ids in lenders_by_sum.items()
+            for lender_id in lender_ids
+        ]
+        heapq.heapify(lenders_heap)
+        heapq.heapify(debtors_heap)
+
+        while lenders_heap and debtors_heap:
+            lender_sum, lender_id = heapq.heappop(lenders_heap)
+            debtor_sum, debtor_id = heapq.heappop(debtors_heap)
+            payment_sum = min(-lender_sum, -debtor_sum)
+            transfers.append((debtor_id, lender_id, payment_sum))
+            if -lender_sum > payment_sum:
+                heapq.heappush(lenders_heap, (lender_sum + payment_sum, lender_id))
+            if -debtor_sum > payment_sum:
+                heapq.heappush(debtors_heap, (debtor_sum + payment_sum, debtor_id))
+
+        if lenders_heap or debtors_heap:
+            raise RuntimeError('Something went wrong while calculating final transactions')
+        return transfers
+
+
+class ExactSettlement(SettlementEngine):
+    """
+    Minimum number of transfers.
+    A group of k participants whose balances sum up to zero needs k - 1 transfers,
+    so the answer is n - (max number of disjoint zero-sum groups), found with
+    dynamic programming over subsets kept as bitsets: O(2^n * n * groups) bit operations,
+    O(2^n) bits of memory. 20 participants take a few tens of milliseconds
+    """
+    name = 'exact'
+
+    def __init__(
+        self,
+        max_size: int = 20,
+        time_budget: Optional[float] = None,
+    ):
+        """
+        @param max_size: max number of participants with non-zero balance
+        @param time_budget: seconds, SettlementTimeout is raised when exceeded
+        """
+        self.max_size = max_size
+        self.time_budget = time_budget
+
+    def settle(
+        self,
+        balances: Dict[int, int],
+    ) -> List[Transfer]:
+        self._split(balances)
+        users = [user_id for user_id, balance in balances.items() if balance != 0]
+        if len(users) > self.max_size:
+            raise ValueError(f'Exact settlement supports up to {self.max_size} participants, got {len(users)}')
+        transfers = []
+        for group in self._zero_sum_groups([balances[user_id] for user_id in users]):
+            transfers += GreedySettlement().settle({users[i]: balances[users[i]] for i in group})
+        return transfers
+
+    def _zero_sum_groups(
+        self,
+        values: List[int],
+    ) -> List[List[int]]:
+        """
+        Sets of subsets are kept as bitsets, big ints with bit mask set for every subset mask,
+        so every step below is a handful of big int operations instead of a loop over subsets.
+        Level k holds zero-sum subsets that split into k zero-sum groups:
+        a subset of level k + 1 is a zero-sum one with a proper subset of level k,
+        the answer is the last level containing the full set
+        @return: partition of value indices into max number of zero-sum groups
+        """
+        deadline = None if self.time_budget is None else time.monotonic() + self.time_budget
+        n = len(values)
+        size = 1 << n
+        full = size - 1
+
+        def check_deadline() -> NoReturn:
+            if deadline is not None and time.monotonic() > deadline:
+                raise SettlementTimeout(f'Exact settlement of {n} participants exceeded {self.time_budget}s')
+
+        zero_sum = self._zero_sum_masks(values)
+        check_deadline()
+
+        # without_bit[i]: every mask without bit i
+        without_bit = []
+        for i in range(n):
+            bitset, length = (1 << (1 << i)) - 1, 2 << i
+            while length < size:
+                bitset |= bitset << length
+                length <<= 1
+            without_bit.append(bitset)
+
+        def with_proper_subset(bitset: int) -> int:
+            """
+            @return: masks having a proper subset in bitset
+            """
+            # supersets of every mask in bitset
+            for i in range(n):
+                bitset |= (bitset & without_bit[i]) << (1 << i)
+            # a mask is a proper superset if it is a superset after removing some bit
+            result = 0
+            for i in range(n):
+                result |= (bitset & without_bit[i]) << (1 << i)
+            return result
+
+        # the empty set is the only subset of level 0
+        levels = [1]
+        while True:
+            check_deadline()
+            level = zero_sum & with_proper_subset(levels[-1])
+            if not (level >> full) & 1:
+                break
+            levels.append(level)
+
+        # walk back from the full set, each step removes a zero-sum group
+        partition = []
+        mask = full
+        for level in reversed(levels[:-1]):
+            subsets = level
+            for i in range(n):
+                if not (mask >> i) & 1:
+                    subsets &= without_bit[i]
+            subsets &= ~(1 << mask)
+            subset = (subsets & -subsets).bit_length() - 1
+            group = mask ^ subset
+            partition.append([i for i in range(n) if (group >> i) & 1])
+            mask = subset
+        return partition
+
+    @staticmethod
+    def _zero_sum_masks(
+        values: List[int],
+    ) -> int:
+        """
+        Meet in the middle: a mask is split into its low and high bits,
+        the low bits of zero-sum masks with the given high bits are the low subsets
+        with the opposite sum, so the bitset is joined from rows of 2^low bits
+        @return: bitset of zero-sum masks
+        """
+        n = len(values)
+        # a row must take whole bytes unless it is the only one
+        low = n if n <= 3 else max(3, n // 2)
+        low_sums = [0]
+        for value in values[:low]:
+            low_sums += [subset_sum + value for subset_sum in low_sums]
+        high_sums = [0]
+        for value in values[low:]:
+            high_sums += [subset_sum + value for subset_sum in high_sums]
+
+        # sum -> bitset of low subsets having it
+        low_subsets: Dict[int, int] = defaultdict(int)
+        for mask, subset_sum in enumerate(low_sums):
+            low_subsets[subset_sum] |= 1 << mask
+        row_size = max(1, (1 << low) // 8)
+        rows = {
+            subset_sum: bitset.to_bytes(row_size, 'little')
+            for subset_sum, bitset in low_subsets.items()
+        }
+        empty_row = bytes(row_size)
+        return int.from_bytes(
+            b''.join(rows.get(-subset_sum, empty_row) for subset_sum in high_sums),
+            'little',
+        )
+
+
+class AutoSettlement(SettlementEngine):
+    """
+    Exact solver for groups of up to 20 participants, heap heuristic when the group
+    is too large or the exact solver does not fit into the time budget
+    """
+    name = 'auto'
+
+    def __init__(
+        self,
+        exact_max_size: int = 20,
+        time_budget: float = 0.2,
+    ):
+        self.exact = ExactSettlement(max_size=exact_max_size, time_budget=time_budget)
+        self.fallback = HeapSettlement()
+
+    def settle(
+        self,
+        balances: Dict[int, int],
+    ) -> List[Transfer]:
+        if sum(1 for balance in balances.values() if balance != 0) <= self.exact.max_size:
+            try:
+                return self.exact.settle(balances)
+            except SettlementTimeout:
+                pass
+        return self.fallback.settle(balances)
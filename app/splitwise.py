@@ -1,10 +1,15 @@
 import logging
-import uuid
-from collections import deque, defaultdict
+from collections import defaultdict
 from datetime import datetime
-from typing import NoReturn, List, Dict, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, NoReturn, Optional, Set, Tuple, Union
 
+from app import base62
+from app.cache import CachedConnector, LRUCache
+from app.ledger import ImportReport, LedgerError, parse_row
+from app.settlement import AutoSettlement, SettlementEngine
+from database.config import StorageConfig
 from database.connector import Connector
+from database.instrumentation import QueryMetrics
 from database.model_types import (
     User,
     Event,
@@ -15,16 +20,54 @@ from database.model_types import (
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
+# events or users shown on one page of a picker
+PAGE_SIZE = 10
+# rows of an imported ledger written in one transaction
+IMPORT_CHUNK_SIZE = 5000
+# base62 characters of an event token, the code users share to join the event
+JOIN_CODE_LENGTH = 12
+
 
 class SplitwiseApp:
     def __init__(
         self,
         db_name: str = 'database.sqlite',
+        storage_config: Optional[StorageConfig] = None,
+        settlement_engine: Optional[SettlementEngine] = None,
+        settlement_cache_size: int = 1024,
+        entity_cache_size: int = 1024,
+        entity_cache_ttl: Optional[float] = 300.0,
+        query_metrics: Optional[QueryMetrics] = None,
     ):
         """
         Creates database connector etc.
+        Settlement engine defaults to AutoSettlement, see app/settlement.py
+        Results of get_final_transactions are cached per (event token, event version),
+        versions are kept by the database, so writes of other processes are seen as well
+        Users, events and memberships are cached for entity_cache_ttl seconds,
+        entity_cache_size = 0 disables this cache
+        query_metrics records statements of the database connections, see database/instrumentation.py
         """
-        self.conn = Connector(db_name=db_name)
+        self.conn = Connector(db_name=db_name, config=storage_config, query_metrics=query_metrics)
+        if entity_cache_size:
+            self.conn = CachedConnector(self.conn, maxsize=entity_cache_size, ttl=entity_cache_ttl)
+        self.settlement_engine = settlement_engine or AutoSettlement()
+        self._settlement_cache = LRUCache(maxsize=settlement_cache_size)
+
+    def get_event_version(
+        self,
+        event_token: str,
+    ) -> int:
+        return self.conn.get_event_version(event_token)
+
+    def get_roster_version(
+        self,
+        event_token: str,
+    ) -> int:
+        """
+        Changes whenever the set of users of the event changes
+        """
+        return self.conn.get_roster_version(event_token)
 
     def add_new_user(
         self,
@@ -50,12 +93,31 @@ class SplitwiseApp:
             raise KeyError(f'There are no users in event with id = {event_token}')
         return users
 
+    def get_users_of_event_page(
+        self,
+        event_token: str,
+        after: Optional[int] = None,
+        page_size: int = PAGE_SIZE,
+    ) -> Tuple[List[User], bool]:
+        """
+        @param after: id of the last user of the previous page, None for the first page
+        @return: users of the page ordered by id and whether there is a next page
+        """
+        users = self.conn.get_users_of_event_page(event_token, after=after, limit=page_size + 1)
+        return users[:page_size], len(users) > page_size
+
     def get_event_info(
         self,
         event_token: str,
     ) -> Event:
         return self.conn.get_event_info(event_token)
 
+    def get_event_by_id(
+        self,
+        event_id: int,
+    ) -> Event:
+        return self.conn.get_event_by_id(event_id)
+
     def user_exists(
         self,
         user_id: int,
@@ -66,12 +128,15 @@ class SplitwiseApp:
         self,
         user_id: int,
         event_name: str,
-        event_token: str = str(uuid.uuid4()),
+        event_token: Optional[str] = None,
     ) -> str:
         """
-        Token may be provided (for testing purposes mainly). If not, it will be set to uuid4()
+        Token may be provided (for testing purposes mainly). If not, it will be set to
+        a random base62 join code of JOIN_CODE_LENGTH characters
         @return: token of the created event
         """
+        if event_token is None:
+            event_token = base62.random_code(JOIN_CODE_LENGTH)
         self.conn.create_event(
             event=Event(event_token, event_name),
             user_id=user_id,
@@ -86,12 +151,15 @@ class SplitwiseApp:
         """
         Adds expense to database
         Fields 'name', 'sum', 'lender_id', 'event_token' are required
-        Fields 'id', 'datetime' will be ignored
+        Fields 'id', 'datetime' will be ignored,
+        the given expense gets them as they are stored, so it does not have to be read back
         @return: expense_id
         """
         expense.id = None  # will be filled after expense being added to db
         expense.datetime = datetime.now()
-        return self.conn.save_expense_info(expense)
+        stored = self.conn.save_expense_info(expense)
+        expense.id, expense.datetime = stored.id, stored.datetime
+        return expense.id
 
     def add_user_to_event(
         self,
@@ -119,70 +187,120 @@ class SplitwiseApp:
     ) -> int:
         return self.conn.save_debt_info(debt)
 
+    def import_ledger(
+        self,
+        rows: Iterable[Tuple[int, Union[Dict[str, Any], LedgerError]]],
+        uploader_id: Optional[int] = None,
+        chunk_size: int = IMPORT_CHUNK_SIZE,
+        max_errors: int = 100,
+    ) -> ImportReport:
+        """
+        Imports expenses and debts read by app.ledger.read_ledger, chunk_size rows per transaction.
+        Rows are validated against the models and the database: lenders and debtors must participate
+        in the event, and so must the uploader if given. Invalid rows are skipped and reported,
+        so are the debts of a skipped expense. Memory used does not depend on the size of the ledger
+        @param rows: (line number, row or error reading it)
+        """
+        report = ImportReport(max_errors=max_errors)
+        participants: Dict[str, Set[int]] = {}
+        chunk: List[Tuple[int, Union[Expense, Debt]]] = []
+        # the expense following debts belong to, None if it was skipped, and its line
+        expense: Optional[Expense] = None
+        expense_line = 0
+
+        def check_participant(user_id: int, event_token: str, role: str) -> NoReturn:
+            if event_token not in participants:
+                participants[event_token] = {user.id for user in self.conn.get_users_of_event(event_token)}
+            if user_id not in participants[event_token]:
+                raise LedgerError(f'{role} {user_id} does not participate in event {event_token}')
+
+        def flush() -> NoReturn:
+            nonlocal expense
+            failures = dict(self.conn.insert_ledger_entries([entry for _, entry in chunk]))
+            for index, (line, entry) in enumerate(chunk):
+                if index in failures:
+                    report.add_error(line, failures[index])
+                    if entry is expense:
+                        expense = None
+                elif isinstance(entry, Expense):
+                    report.expenses += 1
+                else:
+                    report.debts += 1
+            chunk.clear()
+
+        for line, row in rows:
+            try:
+                if isinstance(row, LedgerError):
+                    raise row
+                entry = parse_row(row)
+                if isinstance(entry, Expense):
+                    expense, expense_line = None, line
+                    if entry.datetime is None:
+                        entry.datetime = datetime.now()
+                    check_participant(entry.lender_id, entry.event_token, 'lender')
+                    if uploader_id is not None:
+                        check_participant(uploader_id, entry.event_token, 'uploader')
+                    expense = entry
+                else:
+                    if expense is None:
+                        raise LedgerError(
+                            f'expense on line {expense_line} was not imported' if expense_line
+                            else 'debt must follow an expense'
+                        )
+                    if entry.lender_id is not None and entry.lender_id != expense.lender_id:
+                        raise LedgerError(f'lender of a debt must be the lender of its expense {expense.lender_id}')
+                    entry.lender_id = expense.lender_id
+                    check_participant(entry.debtor_id, expense.event_token, 'debtor')
+                    # expense of a previous chunk already has its id
+                    entry.expense_id = expense.id
+            except LedgerError as e:
+                report.add_error(line, str(e))
+                continue
+            chunk.append((line, entry))
+            if len(chunk) >= chunk_size:
+                flush()
+        if chunk:
+            flush()
+        log.info(f'Imported {report.expenses} expenses and {report.debts} debts, {report.failed} rows failed')
+        return report
+
+    def iter_event_ledger(
+        self,
+        event_token: str,
+    ) -> Iterator[Union[Expense, Debt]]:
+        """
+        Expenses of the event, each one followed by its debts, read as a stream,
+        see app.ledger.write_ledger
+        """
+        return self.conn.iter_event_ledger(event_token)
+
     def get_final_transactions(
         self,
         event_token: str,
     ) -> Tuple[Dict, Dict]:
         """
         @param event_token: event token
-        @return: tuple (lenders_info, debtors_info)
+        @return: tuple (lenders_info, debtors_info), may be shared with other callers, do not modify it
         """
+        cache_key = (event_token, self.get_event_version(event_token))
+        result = self._settlement_cache.get(cache_key)
+        if result is None:
+            result = self._calculate_final_transactions(event_token)
+            self._settlement_cache.put(cache_key, result)
+        return result
+
+    def _calculate_final_transactions(
+        self,
+        event_token: str,
+    ) -> Tuple[Dict, Dict]:
         users = self.get_users_of_event(event_token)
         usernames = {user.id: user.name for user in users}
-        users_balance = defaultdict(lambda: {
-            'lent': 0,
-            'owed': 0,
-        })
-
-        event_expenses = self.conn.get_event_expenses(event_token)
-        event_debts = self.conn.get_debts_by_expenses([expense.id for expense in event_expenses])
-        for debt in event_debts:
-            users_balance[debt.lender_id]['lent'] += debt.sum
-            users_balance[debt.debtor_id]['owed'] += debt.sum
-        lenders = [
-            (user_balance['lent'] - user_balance['owed'], user_id)
-            for user_id, user_balance in users_balance.items()
-            if user_balance['lent'] > user_balance['owed']
-        ]
-        debtors = [
-            (user_balance['owed'] - user_balance['lent'], user_id)
-            for user_id, user_balance in users_balance.items()
-            if user_balance['lent'] < user_balance['owed']
-        ]
-        lenders.sort(reverse=True)
-        debtors.sort(reverse=True)
-
-        if not lenders and not debtors:
-            return {}, {}
-
-        lenders_deque = deque(lenders)
-        debtors_deque = deque(debtors)
-
+        balances = dict(self.conn.get_event_net_balances(event_token))
         lenders_info = defaultdict(list)
         debtors_info = defaultdict(list)
-        lender_sum, lender_id = lenders_deque.popleft()
-        debtor_sum, debtor_id = debtors_deque.popleft()
-        while True:
-            payment_sum = min(lender_sum, debtor_sum)
+        for debtor_id, lender_id, payment_sum in self.settlement_engine.settle(balances):
             lenders_info[lender_id].append((usernames[debtor_id], payment_sum))
             debtors_info[debtor_id].append((usernames[lender_id], payment_sum))
-
-            lender_sum -= payment_sum
-            if lender_sum == 0:
-                if not lenders_deque:
-                    break
-                else:
-                    lender_sum, lender_id = lenders_deque.popleft()
-
-            debtor_sum -= payment_sum
-            if debtor_sum == 0:
-                if not debtors_deque:
-                    break
-                else:
-                    debtor_sum, debtor_id = debtors_deque.popleft()
-
-        if lenders_deque or debtors_deque:
-            raise RuntimeError('Something went wrong while calculating final transactions')
         return dict(lenders_info), dict(debtors_info)
 
     def get_user_events(
@@ -191,6 +309,27 @@ class SplitwiseApp:
     ) -> List[Event]:
         return self.conn.get_user_events(user_id)
 
+    def get_user_events_page(
+        self,
+        user_id: int,
+        after: Optional[int] = None,
+        page_size: int = PAGE_SIZE,
+    ) -> Tuple[List[Event], bool]:
+        """
+        @param after: id of the last event of the previous page, None for the first page
+        @return: events of the page ordered by id and whether there is a next page
+        """
+        events = self.conn.get_user_events_page(user_id, after=after, limit=page_size + 1)
+        return events[:page_size], len(events) > page_size
+
+    def get_cache_stats(self) -> Dict[str, Dict[str, int]]:
+        stats = {
+            'settlement': self._settlement_cache.stats(),
+        }
+        if isinstance(self.conn, CachedConnector):
+            stats.update(self.conn.stats())
+        return stats
+
     # following methods are for testing purposes only
     # please do not use them in production
     def get_all_users(self) -> List[User]:
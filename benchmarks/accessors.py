@@ -0,0 +1,113 @@
+"""
+Rows per second of every read accessor of the Connector on a seeded synthetic database:
+how fast rows turn into models, from point lookups to scans of a whole event
+
+    python -m benchmarks.accessors --scale small --seconds 1
+"""
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from app.splitwise import SplitwiseApp
+from benchmarks.workload import SCALES, Workload, populate
+from database.connector import Connector
+
+
+def _rows(result: Any) -> int:
+    if result is None or isinstance(result, bool):
+        return 1
+    if hasattr(result, '__len__'):
+        return len(result)
+    if hasattr(result, '__next__'):
+        return sum(1 for _ in result)
+    return 1
+
+
+def accessors(
+    connector: Connector,
+    workload: Workload,
+) -> Dict[str, Callable[[int], Any]]:
+    tokens = workload.event_tokens
+    users = workload.user_ids
+
+    def token(i):
+        return tokens[i % len(tokens)]
+
+    def member(i):
+        event_members = workload.members[token(i)]
+        return event_members[i % len(event_members)]
+
+    def expense_id(i):
+        expenses = workload.expenses[token(i)]
+        return expenses[i % len(expenses)]
+
+    return {
+        'get_user_info_or_none': lambda i: connector.get_user_info_or_none(users[i % len(users)]),
+        'get_event_info': lambda i: connector.get_event_info(token(i)),
+        'user_participates_in_event': lambda i: connector.user_participates_in_event(member(i), token(i)),
+        'get_expense_info': lambda i: connector.get_expense_info(expense_id(i)),
+        'get_users_of_event': lambda i: connector.get_users_of_event(token(i)),
+        'get_users_of_event_page': lambda i: connector.get_users_of_event_page(token(i)),
+        'get_user_events': lambda i: connector.get_user_events(member(i)),
+        'get_user_events_page': lambda i: connector.get_user_events_page(member(i)),
+        'get_event_expenses': lambda i: connector.get_event_expenses(token(i)),
+        'get_debts_by_expenses': lambda i: connector.get_debts_by_expenses(workload.expenses[token(i)]),
+        'iter_event_debts': lambda i: connector.iter_event_debts(token(i)),
+        'iter_event_ledger': lambda i: connector.iter_event_ledger(token(i)),
+        'get_event_balances': lambda i: connector.get_event_balances(token(i)),
+        'get_all_users': lambda i: connector.get_all_users(),
+        'get_all_events': lambda i: connector.get_all_events(),
+    }
+
+
+def measure(
+    name: str,
+    call: Callable[[int], Any],
+    min_seconds: float,
+) -> Dict[str, Any]:
+    """
+    Calls call(0), call(1), ... for at least min_seconds
+    """
+    calls = rows = 0
+    start = time.perf_counter()
+    while True:
+        rows += _rows(call(calls))
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            break
+    return {
+        'accessor': name,
+        'calls': calls,
+        'rows_per_call': rows / calls,
+        'rows_per_second': rows / elapsed,
+        'us_per_call': elapsed / calls * 1e6,
+    }
+
+
+def run(
+    db_name: str,
+    scale: str = 'small',
+    min_seconds: float = 1.0,
+) -> List[Dict[str, Any]]:
+    splitwise = SplitwiseApp(db_name=db_name, entity_cache_size=0)
+    workload = populate(splitwise, SCALES[scale])
+    return [measure(name, call, min_seconds) for name, call in accessors(splitwise.conn, workload).items()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', choices=list(SCALES), default='small')
+    parser.add_argument('--seconds', type=float, default=1.0, help='time spent on every accessor')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for result in run(str(Path(tmpdir).joinpath('accessors.sqlite')), args.scale, args.seconds):
+            print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Bot API requests per user action, with every message sent separately and with coalescing.
+Updates go straight to the dispatcher of TelegramBot backed by the fake Bot API
+
+    python -m benchmarks.api_calls_per_action
+"""
+import itertools
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from telegram import Update
+
+from benchmarks.fake_bot_api import FakeBotApiServer, make_callback_update, make_message_update
+from benchmarks.startup import FAKE_TOKEN
+from bot import callback_data, menu_items
+from bot.container import AppContainer
+from bot.outbox import MessageSender
+from bot.tgbot import TelegramBot
+
+LENDER = 1
+DEBTOR = 2
+RATE_LIMIT_OFF = 10 ** 6
+
+
+def run(
+    db_name: str,
+    coalesce: bool,
+) -> Dict[str, int]:
+    with FakeBotApiServer() as server:
+        # rate limits only slow the benchmark down, the number of requests is the same
+        sender = MessageSender(chat_rate=RATE_LIMIT_OFF, chat_burst=RATE_LIMIT_OFF, coalesce=coalesce)
+        container = AppContainer(db_name=db_name, sender=sender)
+        bot = TelegramBot(FAKE_TOKEN, container=container, base_url=server.base_url)
+        dispatcher = bot.updater.dispatcher
+        update_ids = itertools.count(1)
+
+        def post(data: Dict[str, Any]) -> None:
+            dispatcher.process_update(Update.de_json(dict(data, update_id=next(update_ids)), dispatcher.bot))
+
+        def message(user_id: int, text: str) -> Callable[[], None]:
+            return lambda: post(make_message_update(user_id, text))
+
+        def callback(user_id: int, data: Callable[[], str]) -> Callable[[], None]:
+            return lambda: post(make_callback_update(user_id, data()))
+
+        def event_token() -> str:
+            return container.splitwise.get_user_events(LENDER)[0].token
+
+        def event_button() -> str:
+            return callback_data.pack(callback_data.EVENT, container.splitwise.get_user_events(LENDER)[0].id)
+
+        actions: Dict[str, List[Callable[[], None]]] = {
+            'start': [message(LENDER, '/start')],
+            'create_event': [
+                callback(LENDER, lambda: menu_items.CREATE_EVENT),
+                message(LENDER, 'Pilsener'),
+            ],
+            'join_event': [
+                message(DEBTOR, '/start'),
+                callback(DEBTOR, lambda: menu_items.JOIN_EVENT),
+                lambda: message(DEBTOR, event_token())(),
+            ],
+            'select_event': [
+                callback(LENDER, lambda: menu_items.SELECT_EVENT),
+                callback(LENDER, event_button),
+            ],
+            'add_expense_with_debt': [
+                callback(LENDER, lambda: menu_items.ADD_EXPENSE),
+                message(LENDER, 'dinner'),
+                message(LENDER, '300'),
+                callback(LENDER, lambda: str(DEBTOR)),
+                message(LENDER, '150'),
+                callback(LENDER, lambda: menu_items.CANCEL),
+            ],
+            'show_debts': [callback(LENDER, lambda: menu_items.SHOW_DEBTS)],
+        }
+        result = {}
+        for name, steps in actions.items():
+            before = len(server.api.calls)
+            for step in steps:
+                step()
+            # getMe is made once, to check commands are addressed to this bot
+            result[name] = sum(1 for call in server.api.calls[before:] if call.method != 'getMe')
+        result['total'] = sum(result.values())
+    return result
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        before = run(str(Path(tmpdir).joinpath('separate.sqlite')), coalesce=False)
+        after = run(str(Path(tmpdir).joinpath('coalesced.sqlite')), coalesce=True)
+    for name in before:
+        print({'action': name, 'api_calls_separate': before[name], 'api_calls_coalesced': after[name]})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Balance aggregation benchmark over one synthetic event:
+Python aggregation over Expense/Debt objects (the old settlement path),
+GROUP BY over debts and materialized balances table
+
+    python -m benchmarks.balances --debts 100000
+"""
+import argparse
+import random
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+from database.connector import Connector
+from database.model_types import User, Event
+
+
+def populate(
+    connector: Connector,
+    users: int,
+    debts: int,
+    debts_per_expense: int,
+    seed: int = 0,
+) -> str:
+    rnd = random.Random(seed)
+    for user_id in range(1, users + 1):
+        connector.save_user_info(User(id=user_id, name=f'user #{user_id}'))
+    event = connector.create_event(Event(token='event', name='bench'), user_id=1)
+
+    cursor = connector.conn.cursor()
+    expenses = debts // debts_per_expense
+    cursor.executemany(
+        'INSERT INTO expenses (id, name, sum, lender_id, event_id, datetime) VALUES(?, ?, ?, ?, ?, ?)',
+        (
+            (expense_id, 'expense', 1000, rnd.randint(1, users), event.id, datetime.now())
+            for expense_id in range(1, expenses + 1)
+        ),
+    )
+    lenders = dict(cursor.execute('SELECT id, lender_id FROM expenses'))
+    cursor.executemany(
+        'INSERT INTO debts (expense_id, lender_id, debtor_id, sum) VALUES(?, ?, ?, ?)',
+        (
+            (expense_id, lenders[expense_id], rnd.randint(1, users), rnd.randint(1, 100))
+            for expense_id in range(1, expenses + 1)
+            for _ in range(debts_per_expense)
+        ),
+    )
+    connector.conn.commit()
+    return event.token
+
+
+def python_aggregation(connector: Connector, event_token: str) -> dict:
+    users_balance = defaultdict(int)
+    expenses = connector.get_event_expenses(event_token)
+    for debt in connector.get_debts_by_expenses([expense.id for expense in expenses]):
+        users_balance[debt.lender_id] += debt.sum
+        users_balance[debt.debtor_id] -= debt.sum
+    return {user_id: balance for user_id, balance in users_balance.items() if balance}
+
+
+def group_by_aggregation(connector: Connector, event_token: str) -> dict:
+    return {user_id: balance for user_id, balance in connector.compute_event_net_balances(event_token) if balance}
+
+
+def materialized_balances(connector: Connector, event_token: str) -> dict:
+    return dict(connector.get_event_net_balances(event_token))
+
+
+def measure(function, *args) -> dict:
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'latency_ms': elapsed * 1000, 'peak_memory_kb': peak / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--debts', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--debts-per-expense', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        connector = Connector(str(Path(tmpdir).joinpath('bench.sqlite')))
+        event_token = populate(connector, args.users, args.debts, args.debts_per_expense)
+
+        expected = python_aggregation(connector, event_token)
+        for function in (python_aggregation, group_by_aggregation, materialized_balances):
+            assert function(connector, event_token) == expected
+            print({'method': function.__name__, 'debts': args.debts, **measure(function, connector, event_token)})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Bulk import benchmark: a synthetic CSV ledger with one event imported by SplitwiseApp.import_ledger,
+compared to saving the same rows one by one through add_expense and add_debt
+
+    python -m benchmarks.bulk_import --debts 1000000
+"""
+import argparse
+import csv
+import random
+import resource
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+from app import ledger
+from app.splitwise import IMPORT_CHUNK_SIZE, SplitwiseApp
+from database.model_types import User, Expense, Debt
+
+EVENT_TOKEN = 'event'
+
+
+def write_ledger(
+    path: str,
+    users: int,
+    debts: int,
+    debts_per_expense: int,
+    seed: int = 0,
+) -> int:
+    """
+    @return: number of rows written
+    """
+    rnd = random.Random(seed)
+    rows = 0
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(ledger.LEDGER_FIELDS)
+        for expense in range(-(-debts // debts_per_expense)):
+            lender_id = rnd.randint(1, users)
+            writer.writerow((ledger.EXPENSE, EVENT_TOKEN, lender_id, '', f'expense #{expense}', 1000, ''))
+            rows += 1
+            for _ in range(min(debts_per_expense, debts - expense * debts_per_expense)):
+                writer.writerow((ledger.DEBT, '', '', rnd.randint(1, users), '', rnd.randint(1, 100), ''))
+                rows += 1
+    return rows
+
+
+def create_app(
+    db_name: str,
+    users: int,
+) -> SplitwiseApp:
+    splitwise = SplitwiseApp(db_name=db_name)
+    for user_id in range(1, users + 1):
+        splitwise.add_new_user(User(id=user_id, name=f'user #{user_id}'))
+    splitwise.create_event(1, 'bench', event_token=EVENT_TOKEN)
+    for user_id in range(2, users + 1):
+        splitwise.add_user_to_event(user_id, EVENT_TOKEN)
+    return splitwise
+
+
+def bulk_import(
+    splitwise: SplitwiseApp,
+    path: str,
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+) -> Dict[str, Any]:
+    start = time.perf_counter()
+    with ledger.open_ledger(path) as stream:
+        report = splitwise.import_ledger(ledger.read_ledger(stream, ledger.CSV), chunk_size=chunk_size)
+    elapsed = time.perf_counter() - start
+    rows = report.expenses + report.debts
+    return {
+        'method': 'import_ledger',
+        'rows': rows,
+        'failed': report.failed,
+        'seconds': elapsed,
+        'rows_per_second': rows / elapsed,
+    }
+
+
+def one_by_one(
+    splitwise: SplitwiseApp,
+    path: str,
+    limit: int,
+) -> Dict[str, Any]:
+    """
+    Saves the first limit rows of the ledger with a transaction per row
+    """
+    rows = 0
+    expense_id = None
+    start = time.perf_counter()
+    with ledger.open_ledger(path) as stream:
+        for _, row in ledger.read_ledger(stream, ledger.CSV):
+            if rows == limit:
+                break
+            entry = ledger.parse_row(row)
+            if isinstance(entry, Expense):
+                expense_id = splitwise.add_expense(entry)
+                lender_id = entry.lender_id
+            else:
+                splitwise.add_debt(Debt(expense_id, lender_id, entry.debtor_id, entry.sum))
+            rows += 1
+    elapsed = time.perf_counter() - start
+    return {'method': 'one_by_one', 'rows': rows, 'seconds': elapsed, 'rows_per_second': rows / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--debts', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--debts-per-expense', type=int, default=4)
+    parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+    parser.add_argument('--one-by-one-rows', type=int, default=10000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = str(Path(tmpdir).joinpath('ledger.csv'))
+        write_ledger(path, args.users, args.debts, args.debts_per_expense)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result = bulk_import(create_app(str(Path(tmpdir).joinpath('bulk.sqlite')), args.users), path, args.chunk_size)
+        # ru_maxrss is in kilobytes on Linux
+        result['peak_rss_growth_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+        print(result)
+        if args.one_by_one_rows:
+            print(one_by_one(create_app(str(Path(tmpdir).joinpath('rows.sqlite')), args.users), path, args.one_by_one_rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Concurrency benchmark: reads from several threads while another thread keeps inserting expenses
+
+    python -m benchmarks.concurrent_reads --seconds 3 --readers 4
+"""
+import argparse
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from database.config import StorageConfig
+from database.connector import Connector
+from database.model_types import User, Event, Expense
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def run(
+    db_name: str,
+    config: StorageConfig,
+    readers: int,
+    seconds: float,
+) -> dict:
+    connector = Connector(db_name, config=config)
+    connector.save_user_info(User(id=1, name='lender'))
+    connector.create_event(Event(token='event', name='bench'), user_id=1)
+
+    stop = threading.Event()
+    inserts = [0]
+    latencies = [[] for _ in range(readers)]
+
+    def writer():
+        while not stop.is_set():
+            connector.save_expense_info(Expense(
+                name='dinner', sum=100, lender_id=1, event_token='event', datetime=datetime.now(),
+            ))
+            inserts[0] += 1
+
+    def reader(index):
+        while not stop.is_set():
+            start = time.perf_counter()
+            connector.get_event_info('event')
+            connector.user_participates_in_event(1, 'event')
+            latencies[index].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=writer)]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    all_latencies = [value for per_reader in latencies for value in per_reader]
+    return {
+        'journal_mode': config.journal_mode,
+        'read_pool_size': config.read_pool_size,
+        'inserts_per_second': inserts[0] / seconds,
+        'reads_per_second': len(all_latencies) / seconds,
+        'read_p50_ms': statistics.median(all_latencies) * 1000 if all_latencies else 0.0,
+        'read_p99_ms': _percentile(all_latencies, 0.99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--readers', type=int, default=4)
+    args = parser.parse_args()
+
+    configs = [StorageConfig(), StorageConfig.wal(read_pool_size=args.readers)]
+    for i, config in enumerate(configs):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            print(run(str(Path(tmpdir).joinpath(f'bench{i}.sqlite')), config, args.readers, args.seconds))
+
+
+if __name__ == '__main__':
+    main()
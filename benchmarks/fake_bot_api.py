@@ -0,0 +1,477 @@
+"""
+Local stand-in for Telegram Bot API, for tests and load tests without real Telegram.
+Serves http://127.0.0.1:<port>/bot<token>/<method>, keeps a queue of updates
+returned by getUpdates and records every call made by the bot.
+Files added with FakeBotApi.add_file are served at http://127.0.0.1:<port>/file/bot<token>/<file_path>
+"""
+import itertools
+import json
+from email import policy
+from email.parser import BytesParser
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, NoReturn, Optional
+from urllib.parse import parse_qsl
+
+BOT_INFO = {
+    'id': 1,
+    'is_bot': True,
+    'first_name': 'Fake',
+    'username': 'fake_bot',
+}
+# upper bound for getUpdates long polling, keeps shutdown fast
+MAX_POLL_TIMEOUT = 1.0
+
+
+class FloodWait(Exception):
+    """
+    Answers a request with 429 Too Many Requests
+    """
+    def __init__(self, retry_after: float):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+def _chat_of(params: Dict[str, Any]) -> Optional[int]:
+    """
+    Chat a call is made for, answerCallbackQuery is attributed through
+    the id of the query built by make_callback_update
+    """
+    chat_id = params.get('chat_id')
+    if chat_id is None and 'callback_query_id' in params:
+        chat_id = str(params['callback_query_id']).partition('-')[0]
+    try:
+        return int(chat_id)
+    except (TypeError, ValueError):
+        return None
+
+
+class ApiCall:
+    def __init__(
+        self,
+        method: str,
+        params: Dict[str, Any],
+    ):
+        self.method = method
+        self.params = params
+        self.time = time.monotonic()
+        self.chat_id = _chat_of(params)
+
+    def __repr__(self) -> str:
+        return f'ApiCall({self.method!r}, {self.params!r})'
+
+
+class FakeBotApi:
+    """
+    State of the fake server: pending updates and recorded calls
+    Every call but getUpdates takes latency seconds, like a request to the real server would
+    """
+    def __init__(
+        self,
+        latency: float = 0.0,
+    ):
+        self.latency = latency
+        self._updates: List[Dict[str, Any]] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000)
+        self._condition = threading.Condition()
+        self.calls: List[ApiCall] = []
+        self.webhook_url = ''
+        # method -> number of next calls answered with 429
+        self._floods: Dict[str, int] = {}
+        self._retry_after = 1
+        # file_id -> content
+        self.files: Dict[str, bytes] = {}
+
+    # building updates
+    def push_update(
+        self,
+        update: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        """
+        update_id is assigned by the server
+        """
+        with self._condition:
+            update = dict(update, update_id=next(self._update_ids))
+            self._updates.append(update)
+            self._condition.notify_all()
+        return update
+
+    def push_message(
+        self,
+        user_id: int,
+        text: str,
+        username: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        return self.push_update(make_message_update(user_id, text, username, next(self._message_ids)))
+
+    def push_callback(
+        self,
+        user_id: int,
+        data: str,
+        message_id: int = 1,
+        username: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        return self.push_update(make_callback_update(user_id, data, message_id, username))
+
+    def push_document(
+        self,
+        user_id: int,
+        file_name: str,
+        content: bytes,
+    ) -> Dict[str, Any]:
+        """
+        Message with a document, its content can be downloaded by the bot
+        """
+        file_id = self.add_file(content)
+        return self.push_update(make_document_update(user_id, file_id, file_name, len(content)))
+
+    def add_file(
+        self,
+        content: bytes,
+    ) -> str:
+        """
+        @return: file_id
+        """
+        with self._condition:
+            file_id = f'file{len(self.files) + 1}'
+            self.files[file_id] = content
+        return file_id
+
+    # inspecting calls
+    def calls_of(
+        self,
+        method: str,
+    ) -> List[ApiCall]:
+        return [call for call in self.calls if call.method == method]
+
+    def wait_for(
+        self,
+        predicate: Callable[[List[ApiCall]], bool],
+        timeout: float = 5.0,
+    ) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while not predicate(self.calls):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def wait_for_calls(
+        self,
+        count: int,
+        method: Optional[str] = None,
+        timeout: float = 5.0,
+    ) -> bool:
+        return self.wait_for(
+            lambda calls: sum(1 for call in calls if method is None or call.method == method) >= count,
+            timeout=timeout,
+        )
+
+    def flood(
+        self,
+        method: str,
+        times: int = 1,
+        retry_after: float = 1,
+    ) -> NoReturn:
+        """
+        The next times calls of method fail with 429 and retry_after
+        """
+        with self._condition:
+            self._floods[method] = times
+            self._retry_after = retry_after
+
+    # handling requests
+    def handle(
+        self,
+        method: str,
+        params: Dict[str, Any],
+    ) -> Any:
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if self.latency:
+            time.sleep(self.latency)
+        with self._condition:
+            self.calls.append(ApiCall(method, params))
+            self._condition.notify_all()
+            if self._floods.get(method):
+                self._floods[method] -= 1
+                raise FloodWait(self._retry_after)
+        if method == 'getMe':
+            return BOT_INFO
+        if method in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'sendDocument'):
+            return self._message(method, params)
+        if method == 'setWebhook':
+            self.webhook_url = params.get('url', '')
+            return True
+        if method == 'deleteWebhook':
+            self.webhook_url = ''
+            return True
+        if method == 'getWebhookInfo':
+            return {'url': self.webhook_url, 'has_custom_certificate': False, 'pending_update_count': 0}
+        if method == 'answerCallbackQuery':
+            return True
+        if method == 'getFile':
+            file_id = params['file_id']
+            return {
+                'file_id': file_id,
+                'file_unique_id': file_id,
+                'file_size': len(self.files[file_id]),
+                'file_path': f'documents/{file_id}',
+            }
+        raise KeyError(method)
+
+    def _get_updates(
+        self,
+        params: Dict[str, Any],
+    ) -> List[Dict[str, Any]]:
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = min(float(params.get('timeout') or 0), MAX_POLL_TIMEOUT)
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            # updates below offset are confirmed and are never returned again
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return self._updates[:limit]
+
+    def _message(
+        self,
+        method: str,
+        params: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        chat_id = int(params.get('chat_id', 0))
+        message_id = int(params['message_id']) if 'message_id' in params else next(self._message_ids)
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_INFO,
+        }
+        if 'text' in params:
+            message['text'] = params['text']
+        if method == 'sendDocument':
+            message['document'] = {'file_id': f'file{message_id}', 'file_unique_id': f'file{message_id}'}
+        return message
+
+
+def make_user(
+    user_id: int,
+    username: Optional[str] = None,
+) -> Dict[str, Any]:
+    return {
+        'id': user_id,
+        'is_bot': False,
+        'first_name': username or f'user{user_id}',
+        'username': username or f'user{user_id}',
+    }
+
+
+def make_message_update(
+    user_id: int,
+    text: str,
+    username: Optional[str] = None,
+    message_id: int = 1,
+) -> Dict[str, Any]:
+    message = {
+        'message_id': message_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': make_user(user_id, username),
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'message': message}
+
+
+def make_callback_update(
+    user_id: int,
+    data: str,
+    message_id: int = 1,
+    username: Optional[str] = None,
+) -> Dict[str, Any]:
+    return {
+        'callback_query': {
+            'id': f'{user_id}-{time.monotonic_ns()}',
+            'from': make_user(user_id, username),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': BOT_INFO,
+                'text': '',
+            },
+        },
+    }
+
+
+def make_document_update(
+    user_id: int,
+    file_id: str,
+    file_name: str,
+    file_size: int,
+    message_id: int = 1,
+) -> Dict[str, Any]:
+    return {
+        'message': {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': make_user(user_id),
+            'document': {
+                'file_id': file_id,
+                'file_unique_id': file_id,
+                'file_name': file_name,
+                'file_size': file_size,
+            },
+        },
+    }
+
+
+def _parse_multipart(
+    content_type: str,
+    body: bytes,
+) -> Dict[str, Any]:
+    """
+    Fields of a multipart upload, an uploaded file becomes {'filename': ..., 'content': bytes}
+    """
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        f'Content-Type: {content_type}\r\n\r\n'.encode() + body,
+    )
+    params = {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        content = part.get_payload(decode=True)
+        if part.get_filename() is None:
+            params[name] = content.decode()
+        else:
+            params[name] = {'filename': part.get_filename(), 'content': content}
+    return params
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    api: FakeBotApi
+
+    def do_POST(self):
+        self._respond(self._read_params())
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        if path.startswith('/file/'):
+            self._send_file(path.rsplit('/', 1)[-1])
+            return
+        self._respond(dict(parse_qsl(query)))
+
+    def _send_file(
+        self,
+        file_id: str,
+    ):
+        content = self.api.files.get(file_id)
+        if content is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _read_params(self) -> Dict[str, Any]:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        content_type = self.headers.get('Content-Type', '')
+        if not body:
+            return {}
+        if content_type.startswith('application/json'):
+            return json.loads(body)
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            return dict(parse_qsl(body.decode()))
+        if content_type.startswith('multipart/form-data'):
+            return _parse_multipart(content_type, body)
+        return {'content_type': content_type, 'size': len(body)}
+
+    def _respond(
+        self,
+        params: Dict[str, Any],
+    ):
+        method = self.path.partition('?')[0].rstrip('/').rsplit('/', 1)[-1]
+        for key in ('reply_markup',):
+            if isinstance(params.get(key), str):
+                params[key] = json.loads(params[key])
+        try:
+            payload = {'ok': True, 'result': self.api.handle(method, params)}
+            status = 200
+        except KeyError:
+            payload = {'ok': False, 'error_code': 404, 'description': f'Not Found: method {method}'}
+            status = 404
+        except FloodWait as e:
+            payload = {
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {e.retry_after}',
+                'parameters': {'retry_after': e.retry_after},
+            }
+            status = 429
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeBotApiServer:
+    """
+    Runs FakeBotApi on a local port in a background thread
+
+        with FakeBotApiServer() as server:
+            bot = TelegramBot(TOKEN, base_url=server.base_url, base_file_url=server.base_file_url)
+    """
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        latency: float = 0.0,
+    ):
+        self.api = FakeBotApi(latency=latency)
+        handler = type('RequestHandler', (_RequestHandler,), {'api': self.api})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-bot-api', daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/bot'
+
+    @property
+    def base_file_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/file/bot'
+
+    def start(self) -> 'FakeBotApiServer':
+        self._thread.start()
+        return self
+
+    def stop(self) -> NoReturn:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'FakeBotApiServer':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,74 @@
+"""
+Write throughput benchmark: per-call commits against group commit,
+several threads inserting debts at the same time
+
+    python -m benchmarks.group_commit --threads 8 --inserts 500
+"""
+import argparse
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from database.config import StorageConfig
+from database.connector import Connector
+from database.model_types import User, Event, Expense, Debt
+
+
+def run(
+    db_name: str,
+    config: StorageConfig,
+    threads: int,
+    inserts: int,
+) -> dict:
+    connector = Connector(db_name, config=config)
+    connector.save_user_info(User(id=1, name='lender'))
+    connector.save_user_info(User(id=2, name='debtor'))
+    connector.create_event(Event(token='event', name='bench'), user_id=1)
+    expense_id = connector.save_expense_info(Expense(
+        name='dinner', sum=100, lender_id=1, event_token='event', datetime=datetime.now(),
+    )).id
+
+    def worker():
+        for _ in range(inserts):
+            connector.save_debt_info(Debt(expense_id=expense_id, lender_id=1, debtor_id=2, sum=1))
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    result = {
+        'journal_mode': config.journal_mode,
+        'synchronous': config.synchronous,
+        'group_commit': config.group_commit,
+        'inserts_per_second': threads * inserts / elapsed,
+    }
+    if connector._writer is not None:
+        result['mean_batch_size'] = connector._writer.operations / max(connector._writer.batches, 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--inserts', type=int, default=200, help='inserts per thread')
+    args = parser.parse_args()
+
+    configs = [
+        StorageConfig(),
+        StorageConfig(group_commit=True),
+        StorageConfig.wal(),
+        StorageConfig.wal(group_commit=True),
+    ]
+    for i, config in enumerate(configs):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            print(run(str(Path(tmpdir).joinpath(f'bench{i}.sqlite')), config, args.threads, args.inserts))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Keyboard construction and serialization cost per update:
+keyboards built on every call versus shared static keyboards and memoized participant keyboards
+
+    python -m benchmarks.keyboards --users 10
+"""
+import argparse
+import timeit
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from bot import buttons, callback_data, menu_items
+from database.model_types import User
+
+
+def build_menu_keyboard() -> InlineKeyboardMarkup:
+    """
+    The menu keyboard as it was built before keyboards were shared
+    """
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton('Выбрать мероприятие', callback_data=menu_items.SELECT_EVENT)],
+        [InlineKeyboardButton('Присоединиться к меропиятию', callback_data=menu_items.JOIN_EVENT)],
+        [InlineKeyboardButton('Создать мероприятие', callback_data=menu_items.CREATE_EVENT)],
+    ])
+
+
+def build_user_keyboard(users) -> InlineKeyboardMarkup:
+    keyboard = [
+        [InlineKeyboardButton(user.name, callback_data=callback_data.pack(callback_data.USER, user.id))]
+        for user in users
+    ]
+    keyboard.append([InlineKeyboardButton('Закончить', callback_data=menu_items.CANCEL)])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def run(
+    users: int,
+    number: int,
+) -> dict:
+    roster = [User(id=i, name=f'user #{i}') for i in range(1, users + 1)]
+    keyboards = buttons.UserKeyboards()
+    keyboards.put('event', 0, roster)
+
+    def seconds_per_call(statement) -> float:
+        return min(timeit.repeat(statement, number=number, repeat=3)) / number
+
+    return {
+        'menu_rebuilt_us': 1e6 * seconds_per_call(lambda: build_menu_keyboard().to_json()),
+        'menu_shared_us': 1e6 * seconds_per_call(lambda: buttons.get_menu_keyboard().to_json()),
+        'users_rebuilt_us': 1e6 * seconds_per_call(lambda: build_user_keyboard(roster).to_json()),
+        'users_memoized_us': 1e6 * seconds_per_call(lambda: keyboards.get('event', 0).to_json()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=10, help='participants of the event')
+    parser.add_argument('--number', type=int, default=10000, help='calls per measurement')
+    args = parser.parse_args()
+    print(run(args.users, args.number))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Memory held by the debts and expenses of one synthetic event in three representations:
+dataclasses with a per-instance __dict__ (the old models), slotted models
+and the columnar batches returned by the Connector, see database/batches.py
+
+    python -m benchmarks.model_memory --debts 100000
+"""
+import argparse
+import gc
+import tempfile
+import time
+import tracemalloc
+from dataclasses import fields, make_dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+from benchmarks.balances import populate
+from database.connector import Connector
+from database.model_types import Expense, Debt
+from database.queries import EXPENSE_COLUMNS, EXPENSES, DEBT_COLUMNS, model_row
+
+
+def dict_model(model: type) -> type:
+    """
+    Same fields as model, but a plain dataclass with __dict__
+    """
+    return make_dataclass(model.__name__, [(field.name, field.type, None) for field in fields(model)])
+
+
+def select(
+    connector: Connector,
+    sql: str,
+    model: type,
+) -> list:
+    cursor = connector.conn.cursor()
+    cursor.row_factory = model_row(model)
+    return cursor.execute(sql, ('event',)).fetchall()
+
+
+def measure(load: Callable[[], Any]) -> dict:
+    """
+    Memory still allocated while the result of load is alive
+    """
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - start
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'rows': len(result),
+        'retained_kb': (after - before) / 1024,
+        'peak_kb': (peak - before) / 1024,
+        'bytes_per_row': (after - before) / len(result),
+        # timed under tracemalloc, compare between representations only
+        'load_ms': elapsed * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--debts', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--debts-per-expense', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        connector = Connector(str(Path(tmpdir).joinpath('bench.sqlite')))
+        event_token = populate(connector, args.users, args.debts, args.debts_per_expense)
+        expense_ids = connector.get_event_expenses(event_token).ids
+        expenses_sql = f'SELECT {EXPENSE_COLUMNS} FROM {EXPENSES} WHERE ev.token = ?'
+        debts_sql = f'SELECT {DEBT_COLUMNS} FROM debts WHERE expense_id IN (SELECT x.id FROM {EXPENSES} WHERE ev.token = ?)'
+        loads = {
+            'expenses': {
+                'dict_models': lambda: select(connector, expenses_sql, dict_model(Expense)),
+                'slotted_models': lambda: select(connector, expenses_sql, Expense),
+                'batch': lambda: connector.get_event_expenses(event_token),
+            },
+            'debts': {
+                'dict_models': lambda: select(connector, debts_sql, dict_model(Debt)),
+                'slotted_models': lambda: select(connector, debts_sql, Debt),
+                'batch': lambda: connector.get_debts_by_expenses(expense_ids),
+            },
+        }
+        for table, representations in loads.items():
+            for representation, load in representations.items():
+                print({'table': table, 'representation': representation, **measure(load)})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Number of SQL statements per bot interaction, with and without the entity cache.
+Every interaction makes the same SplitwiseApp calls as the corresponding handler
+
+    python -m benchmarks.queries_per_interaction
+"""
+import tempfile
+from pathlib import Path
+
+from app.splitwise import SplitwiseApp
+from database.model_types import User, Expense, Debt
+
+USERS = [User(id=i, name=f'user #{i}') for i in range(1, 5)]
+
+
+def _interactions(app: SplitwiseApp, event_token: str) -> dict:
+    def start():
+        if app.user_exists(USERS[0].id):
+            app.get_user_info(USERS[0].id)
+
+    def select_event():
+        app.get_user_events(USERS[0].id)
+        app.get_event_info(event_token)
+
+    def show_debts():
+        app.get_event_info(event_token)
+        app.get_final_transactions(event_token)
+
+    def add_expense():
+        app.get_event_info(event_token)
+        app.get_event_info(event_token)
+        expense_id = app.add_expense(Expense(name='dinner', sum=300, lender_id=USERS[0].id, event_token=event_token))
+        # the participant keyboard is memoized per roster version, users are queried after a join only
+        for user in USERS[1:]:
+            app.get_user_info(user.id)
+            app.add_debt(Debt(expense_id=expense_id, lender_id=USERS[0].id, debtor_id=user.id, sum=100))
+        app.get_event_info(event_token)
+
+    return {
+        'start': start,
+        'select_event': select_event,
+        'show_debts': show_debts,
+        'add_expense_with_3_debts': add_expense,
+    }
+
+
+def run(db_name: str, entity_cache_size: int) -> dict:
+    app = SplitwiseApp(db_name, entity_cache_size=entity_cache_size)
+    for user in USERS:
+        app.add_new_user(user)
+    event_token = app.create_event(user_id=USERS[0].id, event_name='bench')
+    for user in USERS[1:]:
+        app.add_user_to_event(user.id, event_token)
+
+    statements = []
+    connection = app.conn.connector.conn if entity_cache_size else app.conn.conn
+    connection.set_trace_callback(lambda sql: sql.startswith('--') or statements.append(sql))
+
+    result = {}
+    for name, interaction in _interactions(app, event_token).items():
+        interaction()  # warm up
+        statements.clear()
+        interaction()
+        result[name] = len(statements)
+    connection.set_trace_callback(None)
+    return result
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        before = run(str(Path(tmpdir).joinpath('nocache.sqlite')), entity_cache_size=0)
+        after = run(str(Path(tmpdir).joinpath('cache.sqlite')), entity_cache_size=1024)
+    for name in before:
+        print({'interaction': name, 'statements_without_cache': before[name], 'statements_with_cache': after[name]})
+
+
+if __name__ == '__main__':
+    main()
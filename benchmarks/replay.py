@@ -0,0 +1,361 @@
+"""
+End-to-end load test: multi-user sessions replayed into a polling TelegramBot backed by the fake Bot API.
+Reports latency of every step, Bot API calls per user action and sustained sessions per second
+
+A script is a list of steps of one session, kept as JSONL to be edited or recorded:
+    {"user": 0, "action": "create_event", "text": "Pilsener #{session}", "capture": {"event_token": "..."}}
+user is the index of a user in the session, text is a message and data is a callback query.
+Both are formatted with the session context: {session}, {user0}, {user1}, ... are known in advance,
+capture adds values found by regex in what the bot sent to the user in reply to the step:
+texts of messages and callback data of their inline buttons
+
+    python -m benchmarks.replay --sessions 200 --concurrency 16 --members 3
+    python -m benchmarks.replay --save-script session.jsonl
+    python -m benchmarks.replay --script session.jsonl
+"""
+import argparse
+import json
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NoReturn, Optional
+
+from telegram import Update
+from telegram.ext import CallbackContext, TypeHandler
+
+from benchmarks.fake_bot_api import FakeBotApiServer, make_callback_update, make_message_update
+from benchmarks.startup import FAKE_TOKEN
+from benchmarks.webhook import percentile
+from bot import callback_data, menu_items
+from bot.container import AppContainer
+from bot.outbox import MessageSender
+from bot.tgbot import TelegramBot
+
+# first user id of replayed sessions, far from ids of real users
+USER_ID_BASE = 10 ** 9
+# handlers group running after all handlers of the bot, marks an update as handled
+HANDLED_GROUP = 1000
+RATE_LIMIT_OFF = 10 ** 6
+EVENT_TOKEN_PATTERN = 'Токен: `([^`]+)`'
+# a new user takes part in the only event of the session
+EVENT_BUTTON_PATTERN = f'^({re.escape(callback_data.PREFIX + callback_data.EVENT)}[0-9A-Za-z]+)$'
+
+
+@dataclass
+class Step:
+    user: int
+    action: str
+    text: Optional[str] = None
+    data: Optional[str] = None
+    capture: Optional[Dict[str, str]] = None
+
+
+def group_session_script(members: int = 3) -> List[Step]:
+    """
+    The first user creates an event, the others join it, the first user adds an expense
+    with a debt of every other user and everybody looks at their debts
+    """
+    steps = [Step(user, 'start', text='/start') for user in range(members)]
+    steps += [
+        Step(0, 'create_event', data=menu_items.CREATE_EVENT),
+        Step(0, 'create_event', text='Pilsener #{session}', capture={'event_token': EVENT_TOKEN_PATTERN}),
+    ]
+    for user in range(1, members):
+        steps += [
+            Step(user, 'join_event', data=menu_items.JOIN_EVENT),
+            Step(user, 'join_event', text='{event_token}'),
+        ]
+    steps += [
+        Step(0, 'select_event', data=menu_items.SELECT_EVENT, capture={'event_button': EVENT_BUTTON_PATTERN}),
+        Step(0, 'select_event', data='{event_button}'),
+        Step(0, 'add_expense_with_debts', data=menu_items.ADD_EXPENSE),
+        Step(0, 'add_expense_with_debts', text='dinner'),
+        Step(0, 'add_expense_with_debts', text=str(100 * members)),
+    ]
+    for user in range(1, members):
+        steps += [
+            Step(0, 'add_expense_with_debts', data=f'{{debtor{user}}}'),
+            Step(0, 'add_expense_with_debts', text='100'),
+        ]
+    steps += [
+        Step(0, 'add_expense_with_debts', data=menu_items.CANCEL),
+        Step(0, 'show_debts', data=menu_items.SHOW_DEBTS),
+    ]
+    for user in range(1, members):
+        steps += [
+            Step(user, 'select_event', data=menu_items.SELECT_EVENT, capture={'event_button': EVENT_BUTTON_PATTERN}),
+            Step(user, 'select_event', data='{event_button}'),
+            Step(user, 'show_debts', data=menu_items.SHOW_DEBTS),
+        ]
+    return steps
+
+
+def save_script(
+    steps: List[Step],
+    path: str,
+) -> NoReturn:
+    with open(path, 'w') as file:
+        for step in steps:
+            file.write(json.dumps({key: value for key, value in asdict(step).items() if value is not None},
+                                  ensure_ascii=False))
+            file.write('\n')
+
+
+def load_script(path: str) -> List[Step]:
+    with open(path) as file:
+        return [Step(**json.loads(line)) for line in file if line.strip()]
+
+
+@dataclass
+class StepResult:
+    step: int
+    action: str
+    latency: float
+    api_calls: int
+
+
+class ReplayError(Exception):
+    pass
+
+
+class ReplayDriver:
+    """
+    Pushes updates of sessions to the fake Bot API and waits until the bot has handled each of them:
+    a handler in the last group of the dispatcher marks updates as handled,
+    so a step is over once every reply of the bot has been sent
+    """
+    def __init__(
+        self,
+        server: FakeBotApiServer,
+        bot: TelegramBot,
+        members: int,
+        timeout: float = 10.0,
+    ):
+        self.server = server
+        self.bot = bot
+        self.members = members
+        self.timeout = timeout
+        self._handled = set()
+        self._condition = threading.Condition()
+        bot.updater.dispatcher.add_handler(TypeHandler(Update, self._mark_handled), group=HANDLED_GROUP)
+
+    def _mark_handled(
+        self,
+        update: Update,
+        _: CallbackContext,
+    ) -> NoReturn:
+        with self._condition:
+            self._handled.add(update.update_id)
+            self._condition.notify_all()
+
+    def _wait_handled(
+        self,
+        update_id: int,
+    ) -> NoReturn:
+        deadline = time.monotonic() + self.timeout
+        with self._condition:
+            while update_id not in self._handled:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ReplayError(f'Update {update_id} was not handled in {self.timeout} seconds')
+                self._condition.wait(remaining)
+            self._handled.remove(update_id)
+
+    def user_id(
+        self,
+        session: int,
+        user: int,
+    ) -> int:
+        return USER_ID_BASE + session * self.members + user
+
+    def run_session(
+        self,
+        session: int,
+        steps: List[Step],
+    ) -> List[StepResult]:
+        api = self.server.api
+        context: Dict[str, Any] = {'session': session}
+        context.update({f'user{user}': self.user_id(session, user) for user in range(self.members)})
+        context.update({
+            f'debtor{user}': callback_data.pack(callback_data.USER, self.user_id(session, user))
+            for user in range(self.members)
+        })
+        results = []
+        for index, step in enumerate(steps):
+            user_id = self.user_id(session, step.user)
+            if step.text is not None:
+                update = make_message_update(user_id, step.text.format(**context))
+            else:
+                update = make_callback_update(user_id, step.data.format(**context))
+            first_call = len(api.calls)
+            start = time.perf_counter()
+            update_id = api.push_update(update)['update_id']
+            self._wait_handled(update_id)
+            latency = time.perf_counter() - start
+            replies = [call for call in api.calls[first_call:] if call.chat_id == user_id]
+            for name, pattern in (step.capture or {}).items():
+                for value in reply_values(replies):
+                    match = re.search(pattern, value)
+                    if match:
+                        context[name] = match.group(1)
+                        break
+                else:
+                    raise ReplayError(f'Step {index} of session {session}: no reply matches {pattern}')
+            results.append(StepResult(index, step.action, latency, len(replies)))
+        return results
+
+    def run(
+        self,
+        steps: List[Step],
+        sessions: int,
+        concurrency: int,
+    ) -> Dict[str, Any]:
+        results: List[List[StepResult]] = []
+        failures = []
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(self.run_session, session, steps) for session in range(sessions)]
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except ReplayError as e:
+                    failures.append(str(e))
+        elapsed = time.perf_counter() - start
+        return report(steps, results, failures, elapsed, concurrency)
+
+
+def reply_values(replies: list) -> Iterator[str]:
+    """
+    Texts of replies and callback data of their inline buttons
+    """
+    for call in replies:
+        yield str(call.params.get('text', ''))
+        reply_markup = call.params.get('reply_markup') or {}
+        for row in reply_markup.get('inline_keyboard', ()):
+            for button in row:
+                if 'callback_data' in button:
+                    yield button['callback_data']
+
+
+def report(
+    steps: List[Step],
+    results: List[List[StepResult]],
+    failures: List[str],
+    elapsed: float,
+    concurrency: int,
+) -> Dict[str, Any]:
+    by_step = defaultdict(list)
+    actions = defaultdict(lambda: {'latencies': [], 'api_calls': 0})
+    for session in results:
+        per_action = defaultdict(float)
+        for result in session:
+            by_step[result.step].append(result)
+            per_action[result.action] += result.latency
+            actions[result.action]['api_calls'] += result.api_calls
+        for action, latency in per_action.items():
+            actions[action]['latencies'].append(latency)
+    completed = len(results)
+    return {
+        'sessions': completed,
+        'failed_sessions': len(failures),
+        'failures': failures[:10],
+        'concurrency': concurrency,
+        'steps_per_session': len(steps),
+        'seconds': elapsed,
+        'sessions_per_second': completed / elapsed if elapsed else 0.0,
+        'updates_per_second': completed * len(steps) / elapsed if elapsed else 0.0,
+        'steps': [
+            {
+                'step': index,
+                'action': step.action,
+                'update': step.text if step.text is not None else f'callback {step.data}',
+                'p50_ms': percentile([result.latency for result in by_step[index]], 0.5) * 1000,
+                'p99_ms': percentile([result.latency for result in by_step[index]], 0.99) * 1000,
+                'api_calls': sum(result.api_calls for result in by_step[index]) / completed,
+            }
+            for index, step in enumerate(steps) if by_step[index]
+        ],
+        'actions': {
+            action: {
+                'api_calls': values['api_calls'] / completed,
+                'p50_ms': percentile(values['latencies'], 0.5) * 1000,
+                'p99_ms': percentile(values['latencies'], 0.99) * 1000,
+            }
+            for action, values in actions.items()
+        },
+    }
+
+
+def run(
+    db_name: str,
+    steps: List[Step],
+    sessions: int,
+    concurrency: int = 8,
+    members: int = 3,
+    chat_workers: int = 0,
+    api_latency: float = 0.0,
+    rate_limits: bool = False,
+) -> Dict[str, Any]:
+    """
+    @param members: users of a session, steps may refer to users 0 .. members - 1
+    @param rate_limits: keep Telegram rate limits of MessageSender, they dominate latency when kept
+    """
+    with FakeBotApiServer(latency=api_latency) as server:
+        sender = MessageSender() if rate_limits else MessageSender(chat_rate=RATE_LIMIT_OFF, chat_burst=RATE_LIMIT_OFF,
+                                                                   global_rate=RATE_LIMIT_OFF)
+        container = AppContainer(db_name=db_name, sender=sender)
+        bot = TelegramBot(
+            FAKE_TOKEN,
+            container=container,
+            base_url=server.base_url,
+            chat_workers=chat_workers,
+            chat_queue_size=len(steps),
+        )
+        driver = ReplayDriver(server, bot, members)
+        bot.updater.start_polling(poll_interval=0.0, timeout=1)
+        try:
+            result = driver.run(steps, sessions, concurrency)
+        finally:
+            bot.updater.stop()
+    result['members'] = members
+    result['chat_workers'] = chat_workers
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8, help='sessions replayed at the same time')
+    parser.add_argument('--members', type=int, default=3, help='users of a session')
+    parser.add_argument('--chat-workers', type=int, default=0)
+    parser.add_argument('--api-latency', type=float, default=0.0, help='seconds every Bot API call takes')
+    parser.add_argument('--rate-limits', action='store_true', help='keep Telegram rate limits')
+    parser.add_argument('--script', help='JSONL script of a session, the built-in group session by default')
+    parser.add_argument('--save-script', help='write the built-in script to this file and exit')
+    args = parser.parse_args()
+
+    steps = load_script(args.script) if args.script else group_session_script(args.members)
+    if args.save_script:
+        save_script(steps, args.save_script)
+        return
+    with tempfile.TemporaryDirectory() as tmpdir:
+        result = run(
+            str(Path(tmpdir).joinpath('replay.sqlite')),
+            steps,
+            sessions=args.sessions,
+            concurrency=args.concurrency,
+            members=args.members,
+            chat_workers=args.chat_workers,
+            api_latency=args.api_latency,
+            rate_limits=args.rate_limits,
+        )
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
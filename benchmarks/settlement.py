@@ -0,0 +1,54 @@
+"""
+Settlement benchmark: number of transfers and solve time against group size
+
+    python -m benchmarks.settlement --sizes 4 8 12 16 20 50 200 --rounds 5
+"""
+import argparse
+import random
+import time
+
+from app.settlement import (
+    AutoSettlement,
+    ExactSettlement,
+    GreedySettlement,
+    HeapSettlement,
+)
+
+
+def random_balances(rnd: random.Random, size: int, max_abs: int) -> dict:
+    balances = {user_id: rnd.randint(-max_abs, max_abs) for user_id in range(1, size)}
+    balances[size] = -sum(balances.values())
+    return balances
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[4, 8, 12, 16, 20, 50, 200])
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--max-abs', type=int, default=20, help='max absolute balance, small values give more zero-sum subsets')
+    parser.add_argument('--exact-max-size', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    engines = [GreedySettlement(), HeapSettlement(), AutoSettlement(), ExactSettlement(max_size=args.exact_max_size)]
+    for size in args.sizes:
+        samples = [random_balances(rnd, size, args.max_abs) for _ in range(args.rounds)]
+        for engine in engines:
+            if isinstance(engine, ExactSettlement) and size > engine.max_size:
+                continue
+            transfers = 0
+            start = time.perf_counter()
+            for balances in samples:
+                transfers += len(engine.settle(balances))
+            elapsed = time.perf_counter() - start
+            print({
+                'engine': engine.name,
+                'group_size': size,
+                'mean_transfers': transfers / args.rounds,
+                'mean_solve_ms': elapsed / args.rounds * 1000,
+            })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Startup benchmark: number of sqlite connections opened and time
+until TelegramBot has a fully configured dispatcher
+
+    python -m benchmarks.startup
+"""
+import argparse
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+from bot.tgbot import TelegramBot
+
+FAKE_TOKEN = '123456:' + 'A' * 35
+
+
+def run(db_name: str) -> dict:
+    connect = sqlite3.connect
+    opened = []
+
+    def counting_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        opened.append(conn)
+        return conn
+
+    with mock.patch('sqlite3.connect', counting_connect):
+        start = time.perf_counter()
+        bot = TelegramBot(FAKE_TOKEN, db_name=db_name)
+        elapsed = time.perf_counter() - start
+
+    return {
+        'connections': len(opened),
+        'handlers': sum(len(group) for group in bot.updater.dispatcher.handlers.values()),
+        'seconds_to_ready_dispatcher': elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for i in range(args.repeat):
+            # the first run creates the database, the next ones open an existing one
+            result = run(str(Path(tmpdir).joinpath('bench.sqlite')))
+            print(f'run #{i + 1}: {result}')
+
+
+if __name__ == '__main__':
+    main()
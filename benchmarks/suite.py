@@ -0,0 +1,424 @@
+"""
+Benchmark suite of the storage and settlement layers on a seeded synthetic database:
+every Connector and SplitwiseApp method, settlement across group sizes and a mixed read/write workload.
+Results are JSON, --compare prints the change of every benchmark against an earlier run
+
+    python -m benchmarks --scale small --output before.json
+    python -m benchmarks --scale small --compare before.json
+    python -m benchmarks --scale small --query-metrics --compare before.json
+"""
+import argparse
+import collections
+import itertools
+import json
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, NoReturn
+
+from app.settlement import AutoSettlement, GreedySettlement
+from app.splitwise import SplitwiseApp
+from benchmarks.settlement import random_balances
+from benchmarks.workload import SCALES, Workload, WorkloadConfig, populate
+from database.config import StorageConfig
+from database.instrumentation import QueryMetrics
+from database.model_types import User, Event, Expense, Debt
+from metrics.registry import Registry
+
+STORAGE_CONFIGS = {
+    'default': StorageConfig,
+    'wal': StorageConfig.wal,
+    'wal_group_commit': lambda: StorageConfig.wal(group_commit=True),
+}
+SETTLEMENT_SIZES = (4, 8, 16, 50, 200)
+# a benchmark this much slower than in the compared run is reported as a regression
+REGRESSION_RATIO = 1.2
+
+
+def _percentile(
+    values: List[float],
+    fraction: float,
+) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def _summary(
+    group: str,
+    name: str,
+    durations: List[float],
+    elapsed: float,
+) -> Dict[str, Any]:
+    durations = sorted(durations)
+    return {
+        'group': group,
+        'name': name,
+        'calls': len(durations),
+        'mean_us': sum(durations) / len(durations) * 1e6,
+        'p50_us': _percentile(durations, 0.5) * 1e6,
+        'p99_us': _percentile(durations, 0.99) * 1e6,
+        'ops_per_second': len(durations) / elapsed if elapsed else 0.0,
+    }
+
+
+def measure(
+    group: str,
+    name: str,
+    call: Callable[[int], Any],
+    number: int,
+) -> Dict[str, Any]:
+    """
+    Times call(0), ..., call(number - 1), the index lets a call pick its arguments
+    """
+    durations = []
+    start = time.perf_counter()
+    for i in range(number):
+        call_start = time.perf_counter()
+        call(i)
+        durations.append(time.perf_counter() - call_start)
+    return _summary(group, name, durations, time.perf_counter() - start)
+
+
+def consume(iterable: Iterable[Any]) -> NoReturn:
+    collections.deque(iterable, maxlen=0)
+
+
+def connector_cases(
+    splitwise: SplitwiseApp,
+    workload: Workload,
+    number: int,
+) -> List[Dict[str, Any]]:
+    # the connector without the entity cache of SplitwiseApp
+    connector = getattr(splitwise.conn, 'connector', splitwise.conn)
+    tokens = workload.event_tokens
+    event_ids = workload.event_ids
+    users = workload.user_ids
+    members = workload.members
+    new_ids = itertools.count(workload.config.users + 1)
+
+    def token(i):
+        return tokens[i % len(tokens)]
+
+    def member(i, shift=0):
+        # members of the event of call i
+        event_members = members[token(i)]
+        return event_members[(i + shift) % len(event_members)]
+
+    def expense_id(i):
+        expenses = workload.expenses[token(i)]
+        return expenses[i % len(expenses)]
+
+    def new_user(_):
+        user_id = next(new_ids)
+        connector.save_user_info(User(id=user_id, name=f'user #{user_id}'))
+        return user_id
+
+    def new_expense(i):
+        return Expense(name='dinner', sum=100, lender_id=member(i), event_token=token(i), datetime=datetime.now())
+
+    def new_debt(i):
+        return Debt(expense_id=expense_id(i), lender_id=member(i), debtor_id=member(i, 1), sum=10)
+
+    scans = max(1, number // 10)
+    cases = [
+        ('get_event_info', lambda i: connector.get_event_info(token(i)), number),
+        ('get_event_by_id', lambda i: connector.get_event_by_id(event_ids[token(i)]), number),
+        ('get_event_version', lambda i: connector.get_event_version(token(i)), number),
+        ('get_roster_version', lambda i: connector.get_roster_version(token(i)), number),
+        ('get_user_info_or_none', lambda i: connector.get_user_info_or_none(users[i % len(users)]), number),
+        ('user_participates_in_event', lambda i: connector.user_participates_in_event(member(i), token(i)), number),
+        ('get_users_of_event', lambda i: connector.get_users_of_event(token(i)), number),
+        ('get_users_of_event_page', lambda i: connector.get_users_of_event_page(token(i)), number),
+        ('get_user_events', lambda i: connector.get_user_events(member(i)), number),
+        ('get_user_events_page', lambda i: connector.get_user_events_page(member(i)), number),
+        ('get_expense_info', lambda i: connector.get_expense_info(expense_id(i)), number),
+        ('get_event_expenses', lambda i: connector.get_event_expenses(token(i)), scans),
+        (
+            'get_debts_by_expenses',
+            lambda i: connector.get_debts_by_expenses(workload.expenses[token(i)]),
+            scans,
+        ),
+        ('iter_event_debts', lambda i: consume(connector.iter_event_debts(token(i))), scans),
+        ('iter_event_ledger', lambda i: consume(connector.iter_event_ledger(token(i))), scans),
+        ('get_event_balances', lambda i: connector.get_event_balances(token(i)), number),
+        ('get_event_net_balances', lambda i: connector.get_event_net_balances(token(i)), number),
+        ('compute_event_net_balances', lambda i: connector.compute_event_net_balances(token(i)), scans),
+        ('save_user_info', new_user, number),
+        (
+            'create_event',
+            lambda i: connector.create_event(Event(f'bench{i}', f'bench #{i}'), new_user(i)),
+            number,
+        ),
+        ('add_user_to_event', lambda i: connector.add_user_to_event(new_user(i), token(i)), number),
+        ('save_expense_info', lambda i: connector.save_expense_info(new_expense(i)), number),
+        ('submit_expense_info', lambda i: connector.submit_expense_info(new_expense(i)).result(), number),
+        ('save_debt_info', lambda i: connector.save_debt_info(new_debt(i)), number),
+        ('submit_debt_info', lambda i: connector.submit_debt_info(new_debt(i)).result(), number),
+        (
+            'insert_ledger_entries',
+            lambda i: connector.insert_ledger_entries([new_expense(i)] + [Debt(None, member(i), member(i, j), 10)
+                                                                          for j in range(10)]),
+            scans,
+        ),
+        ('rebuild_balances', lambda i: connector.rebuild_balances(), 1),
+    ]
+    return [measure('connector', name, call, calls) for name, call, calls in cases]
+
+
+def splitwise_cases(
+    splitwise: SplitwiseApp,
+    workload: Workload,
+    number: int,
+) -> List[Dict[str, Any]]:
+    tokens = workload.event_tokens
+    event_ids = workload.event_ids
+    users = workload.user_ids
+    members = workload.members
+    new_ids = itertools.count(workload.config.users + 10 ** 6)
+
+    def token(i):
+        return tokens[i % len(tokens)]
+
+    def member(i, shift=0):
+        # members of the event of call i
+        event_members = members[token(i)]
+        return event_members[(i + shift) % len(event_members)]
+
+    def expense_id(i):
+        expenses = workload.expenses[token(i)]
+        return expenses[i % len(expenses)]
+
+    def new_user(_):
+        user_id = next(new_ids)
+        splitwise.add_new_user(User(id=user_id, name=f'user #{user_id}'))
+        return user_id
+
+    def ledger_rows(i):
+        yield 1, {'kind': 'expense', 'event_token': token(i), 'lender_id': member(i), 'name': 'beer', 'sum': 100}
+        for j in range(10):
+            yield 2 + j, {'kind': 'debt', 'debtor_id': member(i, j), 'sum': 10}
+
+    def uncached_final_transactions(i):
+        # computed as after any write to the event
+        splitwise._settlement_cache.invalidate((token(i), splitwise.get_event_version(token(i))))
+        return splitwise.get_final_transactions(token(i))
+
+    scans = max(1, number // 10)
+    cases = [
+        ('get_event_version', lambda i: splitwise.get_event_version(token(i)), number),
+        ('get_roster_version', lambda i: splitwise.get_roster_version(token(i)), number),
+        ('get_user_info', lambda i: splitwise.get_user_info(users[i % len(users)]), number),
+        ('user_exists', lambda i: splitwise.user_exists(users[i % len(users)]), number),
+        ('get_users_of_event', lambda i: splitwise.get_users_of_event(token(i)), number),
+        ('get_users_of_event_page', lambda i: splitwise.get_users_of_event_page(token(i)), number),
+        ('get_event_info', lambda i: splitwise.get_event_info(token(i)), number),
+        ('get_event_by_id', lambda i: splitwise.get_event_by_id(event_ids[token(i)]), number),
+        ('user_participates_in_event', lambda i: splitwise.user_participates_in_event(member(i), token(i)), number),
+        ('get_expense', lambda i: splitwise.get_expense(expense_id(i)), number),
+        ('get_user_events', lambda i: splitwise.get_user_events(member(i)), number),
+        ('get_user_events_page', lambda i: splitwise.get_user_events_page(member(i)), number),
+        ('iter_event_ledger', lambda i: consume(splitwise.iter_event_ledger(token(i))), scans),
+        ('get_final_transactions', lambda i: splitwise.get_final_transactions(token(i)), number),
+        ('get_final_transactions_uncached', uncached_final_transactions, number),
+        ('get_cache_stats', lambda i: splitwise.get_cache_stats(), number),
+        ('add_new_user', new_user, number),
+        ('create_event', lambda i: splitwise.create_event(new_user(i), f'app bench #{i}', f'app{i}'), number),
+        ('add_user_to_event', lambda i: splitwise.add_user_to_event(new_user(i), token(i)), number),
+        (
+            'add_expense',
+            lambda i: splitwise.add_expense(Expense(name='dinner', sum=100, lender_id=member(i), event_token=token(i))),
+            number,
+        ),
+        (
+            'add_debt',
+            lambda i: splitwise.add_debt(Debt(expense_id(i), member(i), member(i, 1), 10)),
+            number,
+        ),
+        ('import_ledger', lambda i: splitwise.import_ledger(ledger_rows(i)), scans),
+    ]
+    return [measure('splitwise', name, call, calls) for name, call, calls in cases]
+
+
+def settlement_cases(
+    number: int,
+    seed: int,
+) -> List[Dict[str, Any]]:
+    rnd = random.Random(seed)
+    results = []
+    for size in SETTLEMENT_SIZES:
+        samples = [random_balances(rnd, size, max_abs=20) for _ in range(max(1, number // 10))]
+        for engine in (GreedySettlement(), AutoSettlement()):
+            result = measure('settlement', f'{engine.name}[{size}]', lambda i: engine.settle(samples[i]), len(samples))
+            result['mean_transfers'] = sum(len(engine.settle(balances)) for balances in samples) / len(samples)
+            results.append(result)
+    return results
+
+
+def mixed_case(
+    splitwise: SplitwiseApp,
+    workload: Workload,
+    threads: int,
+    operations: int,
+    write_fraction: float,
+) -> List[Dict[str, Any]]:
+    """
+    threads threads doing operations operations in total, write_fraction of them
+    add an expense with a debt, the rest are reads of a user looking at an event
+    """
+    durations = {'read': [], 'write': []}
+    lock = threading.Lock()
+
+    def worker(index):
+        rnd = random.Random(workload.config.seed + index)
+        local = {'read': [], 'write': []}
+        for _ in range(operations // threads):
+            token = rnd.choice(workload.event_tokens)
+            user_id = rnd.choice(workload.members[token])
+            start = time.perf_counter()
+            if rnd.random() < write_fraction:
+                kind = 'write'
+                expense_id = splitwise.add_expense(Expense(name='dinner', sum=100, lender_id=user_id, event_token=token))
+                splitwise.add_debt(Debt(expense_id, user_id, rnd.choice(workload.members[token]), 50))
+            else:
+                kind = 'read'
+                splitwise.user_participates_in_event(user_id, token)
+                splitwise.get_final_transactions(token)
+                splitwise.get_user_events_page(user_id)
+            local[kind].append(time.perf_counter() - start)
+        with lock:
+            for kind, values in local.items():
+                durations[kind].extend(values)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    results = []
+    for kind, values in durations.items():
+        if values:
+            result = _summary('mixed', f'{kind}[threads={threads},writes={write_fraction}]', values, elapsed)
+            results.append(result)
+    return results
+
+
+def run(
+    db_name: str,
+    config: WorkloadConfig,
+    storage: str = 'default',
+    number: int = 200,
+    threads: int = 4,
+    write_fraction: float = 0.1,
+    query_metrics: bool = False,
+) -> Dict[str, Any]:
+    """
+    @param query_metrics: record statement metrics, compared to a run without them gives their overhead
+    """
+    splitwise = SplitwiseApp(
+        db_name=db_name,
+        storage_config=STORAGE_CONFIGS[storage](),
+        query_metrics=QueryMetrics(Registry()) if query_metrics else None,
+    )
+    start = time.perf_counter()
+    workload = populate(splitwise, config)
+    populate_seconds = time.perf_counter() - start
+
+    results = connector_cases(splitwise, workload, number)
+    results += splitwise_cases(splitwise, workload, number)
+    results += settlement_cases(number, config.seed)
+    results += mixed_case(splitwise, workload, threads, number * threads, write_fraction)
+    return {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'storage': storage,
+            'query_metrics': query_metrics,
+            'number': number,
+            'workload': config.as_dict(),
+            'debts': workload.debts,
+            'populate_seconds': populate_seconds,
+        },
+        'results': results,
+    }
+
+
+def compare(
+    before: Dict[str, Any],
+    after: Dict[str, Any],
+) -> List[Dict[str, Any]]:
+    """
+    @return: change of mean time of every benchmark present in both runs
+    """
+    old = {(result['group'], result['name']): result for result in before['results']}
+    changes = []
+    for result in after['results']:
+        previous = old.get((result['group'], result['name']))
+        if previous is None or not previous['mean_us']:
+            continue
+        ratio = result['mean_us'] / previous['mean_us']
+        changes.append({
+            'group': result['group'],
+            'name': result['name'],
+            'before_us': previous['mean_us'],
+            'after_us': result['mean_us'],
+            'ratio': ratio,
+            'regression': ratio > REGRESSION_RATIO,
+        })
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', choices=list(SCALES), default='small')
+    parser.add_argument('--seed', type=int, default=None, help='overrides the seed of the scale')
+    parser.add_argument('--storage', choices=list(STORAGE_CONFIGS), default='default')
+    parser.add_argument('--number', type=int, default=200, help='calls of every cheap method, scans get a tenth')
+    parser.add_argument('--threads', type=int, default=4, help='threads of the mixed workload')
+    parser.add_argument('--write-fraction', type=float, default=0.1)
+    parser.add_argument('--query-metrics', action='store_true', help='record statement metrics')
+    parser.add_argument('--output', help='file for the JSON results, stdout by default')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    args = parser.parse_args()
+
+    config = SCALES[args.scale]
+    if args.seed is not None:
+        config = WorkloadConfig(**dict(config.as_dict(), seed=args.seed))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        report = run(
+            str(Path(tmpdir).joinpath('bench.sqlite')),
+            config,
+            storage=args.storage,
+            number=args.number,
+            threads=args.threads,
+            write_fraction=args.write_fraction,
+            query_metrics=args.query_metrics,
+        )
+    if args.compare:
+        with open(args.compare) as file:
+            report['comparison'] = compare(json.load(file), report)
+        for change in report['comparison']:
+            mark = '  REGRESSION' if change['regression'] else ''
+            print(
+                f'{change["group"]:<11} {change["name"]:<45} '
+                f'{change["before_us"]:>11.1f}us -> {change["after_us"]:>11.1f}us  x{change["ratio"]:.2f}{mark}',
+                file=sys.stderr,
+            )
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
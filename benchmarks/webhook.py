@@ -0,0 +1,123 @@
+"""
+Webhook benchmark: posts /start updates of distinct users to the webhook server
+of TelegramBot backed by the fake Bot API, reports updates/s and handler latency
+
+    python -m benchmarks.webhook --updates 1000 --senders 16
+"""
+import argparse
+import json
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List
+
+from benchmarks.fake_bot_api import FakeBotApiServer, make_message_update
+from benchmarks.startup import FAKE_TOKEN
+from bot.tgbot import TelegramBot
+from bot.webhook import SECRET_TOKEN_HEADER
+
+SECRET = 'benchmark-secret'
+# /start of a new user is answered with a greeting and the menu in one message
+MESSAGES_PER_START = 1
+
+
+def post_update(
+    url: str,
+    update: Dict[str, Any],
+    secret_token: str = SECRET,
+) -> int:
+    """
+    Posts an update the way Telegram does, returns the http status
+    """
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode(),
+        headers={'Content-Type': 'application/json', SECRET_TOKEN_HEADER: secret_token},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def percentile(
+    values: List[float],
+    q: float,
+) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run(
+    db_name: str,
+    updates: int,
+    senders: int = 8,
+    workers: int = 4,
+    chat_workers: int = 0,
+) -> dict:
+    with FakeBotApiServer() as server:
+        bot = TelegramBot(
+            FAKE_TOKEN,
+            db_name=db_name,
+            base_url=server.base_url,
+            workers=workers,
+            chat_workers=chat_workers,
+        )
+        webhook = bot.start_webhook('https://example.com/webhook', SECRET, listen='127.0.0.1', port=0)
+        host, port = webhook.server_address
+        url = f'http://{host}:{port}{webhook.path}'
+        posted_at = {}
+
+        def send(user_id: int) -> int:
+            update = dict(make_message_update(user_id, '/start'), update_id=user_id)
+            posted_at[user_id] = time.monotonic()
+            return post_update(url, update)
+
+        try:
+            start = time.monotonic()
+            with ThreadPoolExecutor(max_workers=senders) as executor:
+                statuses = list(executor.map(send, range(1, updates + 1)))
+            handled = server.api.wait_for_calls(MESSAGES_PER_START * updates, 'sendMessage', timeout=60)
+            elapsed = time.monotonic() - start
+        finally:
+            bot.stop_webhook()
+
+    answered_at = {}
+    for call in server.api.calls_of('sendMessage'):
+        answered_at[int(call.params['chat_id'])] = call.time
+    latencies = [answered_at[user_id] - posted_at[user_id] for user_id in answered_at]
+    return {
+        'accepted': statuses.count(200),
+        'handled': len(answered_at),
+        'all_handled': handled,
+        'updates_per_second': len(answered_at) / elapsed,
+        'p50_latency': percentile(latencies, 0.5),
+        'p99_latency': percentile(latencies, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--senders', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--chat-workers', type=int, default=0, help='0 handles all chats in one thread')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        result = run(
+            str(Path(tmpdir).joinpath('bench.sqlite')),
+            updates=args.updates,
+            senders=args.senders,
+            workers=args.workers,
+            chat_workers=args.chat_workers,
+        )
+        print(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Seeded synthetic workload: users, events, members per event, expenses per event and debts per expense.
+The same config and seed always give the same database, so benchmark runs can be compared
+"""
+import random
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Union
+
+from app.splitwise import SplitwiseApp
+from database.model_types import User, Expense, Debt
+
+START = datetime(2021, 1, 1)
+
+
+@dataclass
+class WorkloadConfig:
+    users: int = 200
+    events: int = 20
+    members_per_event: int = 8
+    expenses_per_event: int = 200
+    debts_per_expense: int = 4
+    max_expense_sum: int = 10000
+    seed: int = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+# presets of python -m benchmarks --scale
+SCALES = {
+    'tiny': WorkloadConfig(users=20, events=3, members_per_event=4, expenses_per_event=10, debts_per_expense=2),
+    'small': WorkloadConfig(),
+    'large': WorkloadConfig(users=5000, events=500, members_per_event=12, expenses_per_event=400, debts_per_expense=6),
+}
+
+
+@dataclass
+class Workload:
+    """
+    What populate has written: ids are known without querying the database
+    """
+    config: WorkloadConfig
+    user_ids: List[int] = field(default_factory=list)
+    event_tokens: List[str] = field(default_factory=list)
+    # event token -> integer id of the event
+    event_ids: Dict[str, int] = field(default_factory=dict)
+    # event token -> ids of its members, the first one created the event
+    members: Dict[str, List[int]] = field(default_factory=dict)
+    # event token -> ids of its expenses
+    expenses: Dict[str, List[int]] = field(default_factory=dict)
+
+    @property
+    def debts(self) -> int:
+        return sum(len(ids) for ids in self.expenses.values()) * self.config.debts_per_expense
+
+
+def event_token(index: int) -> str:
+    return f'event{index:06}'
+
+
+def populate(
+    splitwise: SplitwiseApp,
+    config: WorkloadConfig,
+) -> Workload:
+    """
+    Writes the workload to an empty database: users, events and memberships one by one
+    through SplitwiseApp, expenses and debts in one ledger chunk per event
+    """
+    rnd = random.Random(config.seed)
+    workload = Workload(config)
+    for user_id in range(1, config.users + 1):
+        splitwise.add_new_user(User(id=user_id, name=f'user #{user_id}'))
+        workload.user_ids.append(user_id)
+
+    members_per_event = min(config.members_per_event, config.users)
+    for index in range(config.events):
+        token = event_token(index)
+        members = rnd.sample(workload.user_ids, members_per_event)
+        splitwise.create_event(members[0], f'event #{index}', event_token=token)
+        for user_id in members[1:]:
+            splitwise.add_user_to_event(user_id, token)
+        workload.event_tokens.append(token)
+        workload.event_ids[token] = splitwise.get_event_info(token).id
+        workload.members[token] = members
+
+        entries: List[Union[Expense, Debt]] = []
+        for number in range(config.expenses_per_event):
+            lender_id = rnd.choice(members)
+            entries.append(Expense(
+                name=f'expense #{number}',
+                sum=rnd.randint(1, config.max_expense_sum),
+                lender_id=lender_id,
+                event_token=token,
+                datetime=START + timedelta(minutes=number),
+            ))
+            for _ in range(config.debts_per_expense):
+                entries.append(Debt(
+                    lender_id=lender_id,
+                    debtor_id=rnd.choice(members),
+                    sum=rnd.randint(1, config.max_expense_sum // max(config.debts_per_expense, 1) or 1),
+                ))
+        splitwise.conn.insert_ledger_entries(entries)
+        workload.expenses[token] = [entry.id for entry in entries if isinstance(entry, Expense)]
+    return workload
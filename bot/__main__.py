@@ -1,8 +1,62 @@
 import os
 
+from bot.async_bot import AsyncTelegramBot
+from bot.container import AppContainer
 from bot.tgbot import TelegramBot
+from database.config import StorageConfig
+from metrics.registry import REGISTRY
+from metrics.server import MetricsServer
 
 
 if __name__ == '__main__':
-    bot = TelegramBot(os.getenv('TOKEN'))
-    bot.run()
+    # DB_STORAGE_MODE=wal enables WAL journal and separate read-only connections
+    # DB_GROUP_COMMIT=1 moves all writes to a single writer thread with group commit
+    if os.getenv('DB_STORAGE_MODE', 'default') == 'wal':
+        storage_config = StorageConfig.wal(read_pool_size=int(os.getenv('DB_READ_POOL_SIZE', '4')))
+    else:
+        storage_config = StorageConfig()
+    storage_config.group_commit = os.getenv('DB_GROUP_COMMIT', '0') == '1'
+    # DB_SLOW_QUERY_LOG=path logs statements slower than DB_SLOW_QUERY_MS milliseconds as JSONL
+    storage_config.slow_query_log = os.getenv('DB_SLOW_QUERY_LOG') or None
+    storage_config.slow_query_threshold = float(os.getenv('DB_SLOW_QUERY_MS', '100')) / 1000
+    # METRICS_PORT=N times handlers and database statements and serves them
+    # in Prometheus format on METRICS_LISTEN:N/metrics
+    metrics_port = int(os.getenv('METRICS_PORT', '0'))
+    container = AppContainer(
+        db_name=os.getenv('DB_NAME', 'database.sqlite'),
+        storage_config=storage_config,
+        registry=REGISTRY if metrics_port else None,
+    )
+    if metrics_port:
+        MetricsServer(REGISTRY, listen=os.getenv('METRICS_LISTEN', '127.0.0.1'), port=metrics_port).start()
+    # BOT_RUNTIME=asyncio receives updates on one event loop and runs the handlers
+    # on BOT_ASYNC_WORKERS threads, accepting at most BOT_ASYNC_PENDING_UPDATES updates ahead
+    if os.getenv('BOT_RUNTIME', 'threads') == 'asyncio':
+        bot = AsyncTelegramBot(
+            os.getenv('TOKEN'),
+            container=container,
+            workers=int(os.getenv('BOT_ASYNC_WORKERS', '4')),
+            max_pending_updates=int(os.getenv('BOT_ASYNC_PENDING_UPDATES', '100')),
+        )
+        bot.run()
+    else:
+        bot = TelegramBot(
+            os.getenv('TOKEN'),
+            container=container,
+            update_queue_size=int(os.getenv('BOT_UPDATE_QUEUE_SIZE', '0')),
+            # BOT_CHAT_WORKERS=N handles different chats in parallel, each chat in order
+            chat_workers=int(os.getenv('BOT_CHAT_WORKERS', '0')),
+            chat_queue_size=int(os.getenv('BOT_CHAT_QUEUE_SIZE', '100')),
+        )
+        # BOT_UPDATES=webhook receives updates on WEBHOOK_LISTEN:WEBHOOK_PORT/WEBHOOK_PATH,
+        # WEBHOOK_URL is the public address Telegram posts to
+        if os.getenv('BOT_UPDATES', 'polling') == 'webhook':
+            bot.run_webhook(
+                os.getenv('WEBHOOK_URL'),
+                os.getenv('WEBHOOK_SECRET'),
+                listen=os.getenv('WEBHOOK_LISTEN', '0.0.0.0'),
+                port=int(os.getenv('WEBHOOK_PORT', '8443')),
+                path=os.getenv('WEBHOOK_PATH', '/webhook'),
+            )
+        else:
+            bot.run()
@@ -0,0 +1,78 @@
+import json
+from typing import Any, Dict, List, Optional
+
+from tornado.httpclient import AsyncHTTPClient
+
+TELEGRAM_BASE_URL = 'https://api.telegram.org/bot'
+
+
+class BotApiError(Exception):
+    def __init__(
+        self,
+        method: str,
+        error_code: int,
+        description: str,
+        retry_after: Optional[int] = None,
+    ):
+        super().__init__(f'{method} failed with {error_code}: {description}')
+        self.error_code = error_code
+        self.description = description
+        self.retry_after = retry_after
+
+
+class AsyncBotApi:
+    """
+    Minimal non-blocking Bot API client receiving updates for the asyncio runtime,
+    replies are sent by the handlers through MessageSender
+    """
+    def __init__(
+        self,
+        token: str,
+        base_url: str = TELEGRAM_BASE_URL,
+        max_connections: int = 100,
+        request_timeout: float = 30.0,
+    ):
+        self._url = f'{base_url}{token}/'
+        self._request_timeout = request_timeout
+        self._client = AsyncHTTPClient(force_instance=True, max_clients=max_connections)
+
+    async def call(
+        self,
+        method: str,
+        request_timeout: Optional[float] = None,
+        **params,
+    ) -> Any:
+        """
+        Parameters equal to None are not sent
+        """
+        params = {key: value for key, value in params.items() if value is not None}
+        response = await self._client.fetch(
+            self._url + method,
+            method='POST',
+            headers={'Content-Type': 'application/json'},
+            body=json.dumps(params),
+            request_timeout=request_timeout or self._request_timeout,
+            raise_error=False,
+        )
+        if response.body is None:
+            raise BotApiError(method, response.code, str(response.error))
+        data = json.loads(response.body)
+        if not data.get('ok'):
+            raise BotApiError(
+                method,
+                data.get('error_code', response.code),
+                data.get('description', ''),
+                data.get('parameters', {}).get('retry_after'),
+            )
+        return data['result']
+
+    async def get_updates(
+        self,
+        offset: Optional[int] = None,
+        timeout: int = 10,
+    ) -> List[Dict[str, Any]]:
+        return await self.call('getUpdates', request_timeout=timeout + self._request_timeout,
+                               offset=offset, timeout=timeout)
+
+    def close(self):
+        self._client.close()
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from typing import Any, Dict, Hashable, NoReturn, Optional
+
+from telegram import Bot, Update
+from telegram.ext import Dispatcher
+from telegram.utils.request import Request
+
+from bot.api import AsyncBotApi, BotApiError, TELEGRAM_BASE_URL
+from bot.container import AppContainer
+from bot.tgbot import add_handlers
+
+log = logging.getLogger(__name__)
+
+
+class AsyncTelegramBot:
+    """
+    Asyncio runtime: one event loop receives updates and keeps the order of every chat.
+    Updates of the same chat are handled strictly one after another,
+    updates of different chats concurrently.
+    Updates are handled by the same synchronous handlers as in TelegramBot,
+    see tgbot.add_handlers, on a pool of workers threads. A handler blocks its thread
+    on database access, Bot API requests and rate limiting of MessageSender,
+    so at most workers updates are handled at a time, as with the threaded Updater.
+    At most max_pending_updates updates are accepted and not yet handled,
+    polling waits for one of them to finish before accepting more
+    """
+    def __init__(
+        self,
+        token: str,
+        db_name: str = 'database.sqlite',
+        container: Optional[AppContainer] = None,
+        base_url: str = TELEGRAM_BASE_URL,
+        base_file_url: Optional[str] = None,
+        workers: int = 4,
+        max_pending_updates: int = 100,
+        poll_timeout: int = 10,
+    ):
+        self.container = container or AppContainer(db_name=db_name)
+        self.splitwise = self.container.splitwise
+        self.api = AsyncBotApi(token, base_url=base_url)
+        bot = Bot(token, base_url=base_url, base_file_url=base_file_url, request=Request(con_pool_size=workers + 4))
+        # the dispatcher is never started, its handlers are called by _handle_in_order
+        self.dispatcher = Dispatcher(bot, Queue(), workers=1)
+        add_handlers(self.dispatcher, self.container)
+        self.poll_timeout = poll_timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='handlers')
+        self._max_pending_updates = max_pending_updates
+        self._pending: Optional[asyncio.Semaphore] = None
+        # chat key -> tail of the chain of tasks handling updates of this chat
+        self._chat_tails: Dict[Hashable, asyncio.Task] = {}
+        self._running = False
+
+    @staticmethod
+    def _get_chat_key(update: Update) -> Hashable:
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return 'user', update.effective_user.id
+        # nothing to be ordered with
+        return 'update', update.update_id
+
+    async def _handle_in_order(
+        self,
+        update: Update,
+        previous: Optional[asyncio.Task],
+    ) -> NoReturn:
+        if previous is not None:
+            await asyncio.wait([previous])
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self.dispatcher.process_update, update)
+        except Exception:
+            log.exception('Error while handling update %s', update.update_id)
+
+    async def dispatch(
+        self,
+        data: Dict[str, Any],
+    ) -> asyncio.Task:
+        """
+        Schedules handling of a raw update,
+        waits while max_pending_updates updates are not handled yet
+        """
+        if self._pending is None:
+            self._pending = asyncio.Semaphore(self._max_pending_updates)
+        await self._pending.acquire()
+        update = Update.de_json(data, self.dispatcher.bot)
+        chat_key = self._get_chat_key(update)
+        previous = self._chat_tails.get(chat_key)
+        task = asyncio.ensure_future(self._handle_in_order(update, previous))
+        self._chat_tails[chat_key] = task
+        task.add_done_callback(lambda done: self._forget_chat(chat_key, done))
+        return task
+
+    def _forget_chat(
+        self,
+        chat_key: Hashable,
+        task: asyncio.Task,
+    ) -> NoReturn:
+        self._pending.release()
+        if self._chat_tails.get(chat_key) is task:
+            del self._chat_tails[chat_key]
+
+    async def run_polling(self) -> NoReturn:
+        self._running = True
+        await self.api.call('deleteWebhook')
+        offset = None
+        while self._running:
+            try:
+                updates = await self.api.get_updates(offset=offset, timeout=self.poll_timeout)
+            except (BotApiError, OSError) as e:
+                log.warning('getUpdates failed: %s', e)
+                await asyncio.sleep(1)
+                continue
+            for data in updates:
+                offset = data['update_id'] + 1
+                await self.dispatch(data)
+
+    async def join(self) -> NoReturn:
+        """
+        Waits until all dispatched updates are handled
+        """
+        while self._chat_tails:
+            await asyncio.wait(list(self._chat_tails.values()))
+
+    def stop(self) -> NoReturn:
+        """
+        Stops polling after the current getUpdates request
+        """
+        self._running = False
+
+    def close(self) -> NoReturn:
+        self.api.close()
+        self._executor.shutdown(wait=True)
+
+    def run(self) -> NoReturn:
+        """
+        Starts main cycle
+        """
+        try:
+            asyncio.run(self.run_polling())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
@@ -1,54 +1,189 @@
-from typing import List
+import json
+from typing import Any, Dict, List, Optional, Tuple
 
 from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
 )
 
-from bot import menu_items
+from app.cache import LRUCache
+from bot import callback_data, menu_items
 from database.model_types import User, Event
 
 
-def get_user_buttons(users: List[User]) -> InlineKeyboardMarkup:
+class SharedKeyboard(InlineKeyboardMarkup):
+    """
+    Keyboard built once and sent many times: its dict and json forms are computed on creation,
+    to_dict returns the same dict every time. Neither the keyboard nor the dict may be modified
+    """
+    def __init__(
+        self,
+        inline_keyboard: List[List[InlineKeyboardButton]],
+        **kwargs,
+    ):
+        super().__init__(inline_keyboard, **kwargs)
+        self._dict = super().to_dict()
+        self._json = json.dumps(self._dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self._dict
+
+    def to_json(self) -> str:
+        return self._json
+
+
+def _navigation_row(
+    has_prev: bool,
+    next_cursor: Optional[int],
+) -> List[InlineKeyboardButton]:
+    row = []
+    if has_prev:
+        row.append(InlineKeyboardButton('⬅️', callback_data=menu_items.PREV_PAGE))
+    if next_cursor is not None:
+        # the next page starts after the last item of this one, the cursor travels in the button
+        row.append(InlineKeyboardButton('➡️', callback_data=callback_data.pack(callback_data.NEXT_PAGE, next_cursor)))
+    return row
+
+
+def turn_page(
+    cursors: List[Optional[int]],
+    data: str,
+) -> bool:
+    """
+    Handles a press of a page button of a picker
+    @param cursors: 'after' cursors of the pages from the first one to the current one,
+        kept in conversation state, [None] for the first page
+    @return: False if data is not a page button
+    """
+    if data == menu_items.PREV_PAGE:
+        if len(cursors) > 1:
+            cursors.pop()
+        return True
+    cursor = callback_data.unpack_id(data, callback_data.NEXT_PAGE)
+    if cursor is not None:
+        cursors.append(cursor)
+        return True
+    return False
+
+
+def _build_user_buttons(
+    users: List[User],
+    has_prev: bool = False,
+    has_next: bool = False,
+) -> SharedKeyboard:
     keyboard = [
-        [InlineKeyboardButton(user.name, callback_data=str(user.id))]
+        [InlineKeyboardButton(user.name, callback_data=callback_data.pack(callback_data.USER, user.id))]
         for user in users
     ]
+    navigation = _navigation_row(has_prev, users[-1].id if has_next and users else None)
+    if navigation:
+        keyboard.append(navigation)
     keyboard.append([InlineKeyboardButton('Закончить', callback_data=menu_items.CANCEL)])
-    return InlineKeyboardMarkup(keyboard)
+    return SharedKeyboard(keyboard)
+
+
+def get_user_buttons(
+    users: List[User],
+    has_prev: bool = False,
+    has_next: bool = False,
+) -> InlineKeyboardMarkup:
+    return _build_user_buttons(users, has_prev, has_next)
+
+
+class UserKeyboards:
+    """
+    Pages of participant keyboards of events, memoized per (event token, page, roster version).
+    The roster version changes when somebody joins the event, see SplitwiseApp.get_roster_version,
+    so a cached keyboard is never shown after the roster has changed
+
+        keyboard = keyboards.get(token, version, after)
+        if keyboard is None:
+            users, has_next = splitwise.get_users_of_event_page(token, after)
+            keyboard = keyboards.put(token, version, users, after, has_next)
+    """
+    def __init__(
+        self,
+        maxsize: int = 1024,
+    ):
+        self._cache = LRUCache(maxsize=maxsize)
+
+    def get(
+        self,
+        event_token: str,
+        roster_version: int,
+        after: Optional[int] = None,
+    ) -> Optional[InlineKeyboardMarkup]:
+        cached = self._cache.get((event_token, after))
+        if cached is None or cached[0] != roster_version:
+            return None
+        return cached[1]
+
+    def put(
+        self,
+        event_token: str,
+        roster_version: int,
+        users: List[User],
+        after: Optional[int] = None,
+        has_next: bool = False,
+    ) -> InlineKeyboardMarkup:
+        keyboard = _build_user_buttons(users, has_prev=after is not None, has_next=has_next)
+        # only the latest roster version of a page is kept
+        self._cache.put((event_token, after), (roster_version, keyboard))
+        return keyboard
+
+    def stats(self) -> Dict[str, int]:
+        return self._cache.stats()
+
+
+_event_buttons = LRUCache(maxsize=1024)
+
+
+def get_event_buttons(
+    events: List[Event],
+    has_prev: bool = False,
+    has_next: bool = False,
+) -> InlineKeyboardMarkup:
+    key: Tuple[Any, ...] = (has_prev, has_next) + tuple((event.id, event.name) for event in events)
+    keyboard = _event_buttons.get(key)
+    if keyboard is None:
+        rows = [
+            [InlineKeyboardButton(event.name, callback_data=callback_data.pack(callback_data.EVENT, event.id))]
+            for event in events
+        ]
+        navigation = _navigation_row(has_prev, events[-1].id if has_next and events else None)
+        if navigation:
+            rows.append(navigation)
+        rows.append([InlineKeyboardButton('Назад', callback_data=menu_items.CANCEL)])
+        keyboard = SharedKeyboard(rows)
+        _event_buttons.put(key, keyboard)
+    return keyboard
 
 
-def get_event_buttons(events: List[Event]) -> InlineKeyboardMarkup:
-    keyboard = [
-        [InlineKeyboardButton(event.name, callback_data=event.token)]
-        for event in events
-    ]
-    keyboard.append([InlineKeyboardButton('Назад', callback_data=menu_items.CANCEL)])
-    return InlineKeyboardMarkup(keyboard)
+CANCEL_BUTTON = SharedKeyboard([[InlineKeyboardButton('Назад', callback_data=menu_items.CANCEL)]])
+MENU_KEYBOARD = SharedKeyboard([
+    [InlineKeyboardButton('Выбрать мероприятие', callback_data=menu_items.SELECT_EVENT)],
+    [InlineKeyboardButton('Присоединиться к меропиятию', callback_data=menu_items.JOIN_EVENT)],
+    [InlineKeyboardButton('Создать мероприятие', callback_data=menu_items.CREATE_EVENT)],
+])
+EMPTY_KEYBOARD = SharedKeyboard([])
+EVENT_COMMANDS_KEYBOARD = SharedKeyboard([
+    [InlineKeyboardButton('Добавить трату', callback_data=menu_items.ADD_EXPENSE)],
+    [InlineKeyboardButton('Показать мои долги', callback_data=menu_items.SHOW_DEBTS)],
+    [InlineKeyboardButton('Назад', callback_data=menu_items.CANCEL)],
+])
 
 
 def get_cancel_button() -> InlineKeyboardMarkup:
-    keyboard = [[InlineKeyboardButton('Назад', callback_data=menu_items.CANCEL)]]
-    return InlineKeyboardMarkup(keyboard)
+    return CANCEL_BUTTON
 
 
 def get_menu_keyboard() -> InlineKeyboardMarkup:
-    select_event = InlineKeyboardButton('Выбрать мероприятие', callback_data=menu_items.SELECT_EVENT)
-    join_event = InlineKeyboardButton('Присоединиться к меропиятию', callback_data=menu_items.JOIN_EVENT)
-    create_event = InlineKeyboardButton('Создать мероприятие', callback_data=menu_items.CREATE_EVENT)
-
-    keyboard = InlineKeyboardMarkup([[select_event], [join_event], [create_event]])
-    return keyboard
+    return MENU_KEYBOARD
 
 
 def get_empty_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([])
+    return EMPTY_KEYBOARD
 
 
 def get_event_commands_keyboard() -> InlineKeyboardMarkup:
-    add_expense = InlineKeyboardButton('Добавить трату', callback_data=menu_items.ADD_EXPENSE)
-    show_debts = InlineKeyboardButton('Показать мои долги', callback_data=menu_items.SHOW_DEBTS)
-    cancel = InlineKeyboardButton('Назад', callback_data=menu_items.CANCEL)
-
-    keyboard = InlineKeyboardMarkup([[add_expense], [show_debts], [cancel]])
-    return keyboard
+    return EVENT_COMMANDS_KEYBOARD
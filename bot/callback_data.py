@@ -0,0 +1,56 @@
+"""
+Compact callback data of inline buttons that carry ids.
+Telegram limits callback data to 64 bytes, so an action is a single character
+and ids are written in base62: '#e1c' is the event with id 100.
+Menu items never start with PREFIX, so both kinds of data can reach the same handler
+"""
+from typing import Optional, Tuple
+
+from app import base62
+
+PREFIX = '#'
+SEPARATOR = '.'
+
+# actions
+EVENT = 'e'
+NEXT_PAGE = 'n'
+USER = 'u'
+
+
+def pack(
+    action: str,
+    *ids: int,
+) -> str:
+    """
+    @param action: one of the single character actions of this module
+    """
+    if len(action) != 1:
+        raise ValueError(f'Action must be a single character, got {action!r}')
+    return PREFIX + action + SEPARATOR.join(base62.encode(id_) for id_ in ids)
+
+
+def unpack(data: str) -> Optional[Tuple[str, Tuple[int, ...]]]:
+    """
+    @return: (action, ids), None if data was not made by pack
+    """
+    if len(data) < 2 or not data.startswith(PREFIX):
+        return None
+    action, packed_ids = data[1], data[2:]
+    try:
+        ids = tuple(base62.decode(code) for code in packed_ids.split(SEPARATOR)) if packed_ids else ()
+    except ValueError:
+        return None
+    return action, ids
+
+
+def unpack_id(
+    data: str,
+    action: str,
+) -> Optional[int]:
+    """
+    @return: the only id of data packed for action, None for any other data
+    """
+    unpacked = unpack(data)
+    if unpacked is None or unpacked[0] != action or len(unpacked[1]) != 1:
+        return None
+    return unpacked[1][0]
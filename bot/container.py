@@ -0,0 +1,47 @@
+from typing import Optional
+
+from app.splitwise import SplitwiseApp
+from bot.outbox import MessageSender
+from database.config import StorageConfig
+from database.instrumentation import QueryMetrics
+from metrics.registry import Registry
+
+
+class AppContainer:
+    """
+    Owns the application services shared by the whole bot.
+    Every service is created once, on first access, and the same instance
+    is handed to every handler that needs it
+    """
+    def __init__(
+        self,
+        db_name: str = 'database.sqlite',
+        storage_config: Optional[StorageConfig] = None,
+        sender: Optional[MessageSender] = None,
+        registry: Optional[Registry] = None,
+    ):
+        """
+        If sender is not provided, one with Telegram rate limits is created
+        If registry is provided, database statements and handlers record their metrics there
+        """
+        self.db_name = db_name
+        self.storage_config = storage_config
+        self.registry = registry
+        self._splitwise = None
+        self._sender = sender
+
+    @property
+    def splitwise(self) -> SplitwiseApp:
+        if self._splitwise is None:
+            self._splitwise = SplitwiseApp(
+                db_name=self.db_name,
+                storage_config=self.storage_config,
+                query_metrics=QueryMetrics(self.registry) if self.registry is not None else None,
+            )
+        return self._splitwise
+
+    @property
+    def sender(self) -> MessageSender:
+        if self._sender is None:
+            self._sender = MessageSender()
+        return self._sender
@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Hashable, NoReturn, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Dispatcher
+
+from app.cache import LRUCache
+
+
+@dataclass
+class ChatQueueStats:
+    updates: int = 0
+    max_depth: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'updates': self.updates,
+            'max_depth': self.max_depth,
+            'mean_wait': self.total_wait / self.updates if self.updates else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+
+@dataclass
+class _ChatQueue:
+    # (update, time it was queued)
+    pending: Deque[Tuple[Update, float]] = field(default_factory=deque)
+    # True while a worker drains this queue
+    scheduled: bool = False
+
+
+class ChatOrderedDispatcher(Dispatcher):
+    """
+    Dispatcher handling updates of one chat strictly in order of arrival
+    while different chats are handled in parallel by chat_workers threads.
+    Conversation state is keyed by chat and user, so it never sees reordered updates.
+    Every chat has its own queue of at most chat_queue_size updates,
+    when it is full the dispatcher thread waits and the backpressure
+    reaches the update queue
+    """
+    def __init__(
+        self,
+        *args,
+        chat_workers: int = 8,
+        chat_queue_size: int = 100,
+        stats_size: int = 10000,
+        **kwargs,
+    ):
+        """
+        Other arguments are passed to Dispatcher
+        @param stats_size: number of most recently active chats metrics are kept for
+        """
+        if chat_workers < 1 or chat_queue_size < 1:
+            raise ValueError('chat_workers and chat_queue_size must be positive')
+        super().__init__(*args, **kwargs)
+        self.chat_workers = chat_workers
+        self.chat_queue_size = chat_queue_size
+        self._chats: Dict[Hashable, _ChatQueue] = {}
+        self._chats_changed = threading.Condition()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._chat_stats = LRUCache(maxsize=stats_size)
+        self._total = ChatQueueStats()
+
+    @staticmethod
+    def _get_chat_key(update: Any) -> Optional[Hashable]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return 'user', update.effective_user.id
+        return None
+
+    def process_update(self, update: Any) -> NoReturn:
+        chat_key = self._get_chat_key(update)
+        if chat_key is None:
+            # errors and updates without a chat have nothing to be ordered with
+            super().process_update(update)
+            return
+        with self._chats_changed:
+            while True:
+                # the queue may be drained and removed while waiting, so look it up every time
+                chat = self._chats.setdefault(chat_key, _ChatQueue())
+                if len(chat.pending) < self.chat_queue_size:
+                    break
+                self._chats_changed.wait()
+            chat.pending.append((update, time.monotonic()))
+            depth = len(chat.pending)
+            stats = self._get_stats(chat_key)
+            stats.max_depth = max(stats.max_depth, depth)
+            self._total.max_depth = max(self._total.max_depth, depth)
+            if chat.scheduled:
+                return
+            chat.scheduled = True
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.chat_workers, thread_name_prefix='chat')
+            executor = self._executor
+        executor.submit(self._drain, chat_key)
+
+    def _get_stats(self, chat_key: Hashable) -> ChatQueueStats:
+        stats = self._chat_stats.get(chat_key)
+        if stats is None:
+            stats = ChatQueueStats()
+            self._chat_stats.put(chat_key, stats)
+        return stats
+
+    def _drain(self, chat_key: Hashable) -> NoReturn:
+        """
+        Handles updates of one chat until its queue is empty
+        """
+        while True:
+            with self._chats_changed:
+                chat = self._chats[chat_key]
+                if not chat.pending:
+                    del self._chats[chat_key]
+                    self._chats_changed.notify_all()
+                    return
+                update, queued_at = chat.pending.popleft()
+                wait = time.monotonic() - queued_at
+                for stats in (self._get_stats(chat_key), self._total):
+                    stats.updates += 1
+                    stats.total_wait += wait
+                    stats.max_wait = max(stats.max_wait, wait)
+                self._chats_changed.notify_all()
+            try:
+                super().process_update(update)
+            except Exception:
+                self.logger.exception('Error while handling update of chat %s', chat_key)
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until all queued updates are handled
+        @return: False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._chats_changed:
+            while self._chats:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._chats_changed.wait(remaining)
+        return True
+
+    def stop(self) -> NoReturn:
+        super().stop()
+        self.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def queue_stats(self) -> Dict[str, Any]:
+        """
+        Queue depth and wait time in chat queues: current depth of every non-empty queue,
+        totals and per chat maximums for recently active chats
+        """
+        with self._chats_changed:
+            return {
+                'total': self._total.as_dict(),
+                'depth': {chat_key: len(chat.pending) for chat_key, chat in self._chats.items() if chat.pending},
+                'chats': {chat_key: stats.as_dict() for chat_key, stats in self._chat_stats.items()},
+            }
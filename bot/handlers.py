@@ -1,7 +1,8 @@
+import tempfile
 from enum import auto, Enum, unique
-from typing import NoReturn, Optional
+from typing import List, NoReturn, Optional
 
-from telegram import ParseMode
+from telegram import InlineKeyboardMarkup, ParseMode
 from telegram import Update
 from telegram.ext import (
     CallbackContext,
@@ -12,9 +13,12 @@ from telegram.ext import (
     ConversationHandler,
 )
 
-from bot import buttons, menu_items
+from bot import buttons, callback_data, menu_items
+from bot.outbox import MessageSender
+from app import ledger
 from app.splitwise import SplitwiseApp
 from database.model_types import (
+    Event,
     Expense,
     Debt,
     User,
@@ -34,11 +38,36 @@ class States(Enum):
     EXPENSE_SUM = auto()
     DEBTOR_NAME = auto()
     DEBT_SUM = auto()
+    # page cursors of the event and the participant pickers, see buttons.turn_page
+    EVENTS_PAGE = auto()
+    USERS_PAGE = auto()
+
+
+# bots can not download bigger files, https://core.telegram.org/bots/api#getfile
+MAX_DOWNLOAD_SIZE = 20 * 1024 * 1024
+# row errors listed in reply to an imported ledger
+MAX_REPORTED_ERRORS = 10
+# exported ledgers smaller than this are not written to disk
+EXPORT_SPOOL_SIZE = 1024 * 1024
+
+
+def get_event_page_buttons(
+    splitwise: SplitwiseApp,
+    user_id: int,
+    cursors: List[Optional[int]],
+) -> InlineKeyboardMarkup:
+    events, has_next = splitwise.get_user_events_page(user_id, after=cursors[-1])
+    return buttons.get_event_buttons(events, has_prev=len(cursors) > 1, has_next=has_next)
 
 
 class BeginningHandlers:
-    def __init__(self):
-        self._splitwise = SplitwiseApp()
+    def __init__(
+        self,
+        splitwise: SplitwiseApp,
+        sender: Optional[MessageSender] = None,
+    ):
+        self._splitwise = splitwise
+        self._sender = sender or MessageSender()
 
     def start_handler(
         self,
@@ -48,13 +77,14 @@ class BeginningHandlers:
         id_ = update.effective_user.id
         name = update.effective_user.username
 
-        if self._splitwise.user_exists(id_):
-            name = self._splitwise.get_user_info(id_).name
-            update.effective_chat.send_message(f'Привет, {name}! Ты уже был(а) здесь!')
-        else:
-            self._splitwise.add_new_user(User(id_, name))
-            update.effective_chat.send_message(f'Привет, {name}! Ты здесь впервые!')
-        update.effective_chat.send_message('Меню:', reply_markup=buttons.get_menu_keyboard())
+        with self._sender.outbox(update) as outbox:
+            if self._splitwise.user_exists(id_):
+                name = self._splitwise.get_user_info(id_).name
+                outbox.send(f'Привет, {name}! Ты уже был(а) здесь!')
+            else:
+                self._splitwise.add_new_user(User(id_, name))
+                outbox.send(f'Привет, {name}! Ты здесь впервые!')
+            outbox.send('Меню:', reply_markup=buttons.get_menu_keyboard())
 
     def users_of_event_handler(
         self,
@@ -63,67 +93,143 @@ class BeginningHandlers:
     ):
         token = context.args[0]
         users = self._splitwise.get_users_of_event(token)
-        update.effective_chat.send_message(str(users))
+        with self._sender.outbox(update) as outbox:
+            outbox.send(str(users))
 
     def text_handler(
         self,
         update: Update,
         _: CallbackContext,
     ):
-        update.effective_chat.send_message('Выберите пункт меню:')
-        update.effective_chat.send_message('Меню:', reply_markup=buttons.get_menu_keyboard())
+        with self._sender.outbox(update) as outbox:
+            outbox.send('Выберите пункт меню:')
+            outbox.send('Меню:', reply_markup=buttons.get_menu_keyboard())
 
     def get_menu(
         self,
         update: Update,
         _: CallbackContext,
     ):
-        update.effective_chat.send_message('Меню:', reply_markup=buttons.get_menu_keyboard())
+        with self._sender.outbox(update) as outbox:
+            outbox.send('Меню:', reply_markup=buttons.get_menu_keyboard())
+
+    def document_handler(
+        self,
+        update: Update,
+        context: CallbackContext,
+    ) -> NoReturn:
+        """
+        Imports a ledger of expenses and debts, see app/ledger.py
+        The file is downloaded to a temporary file and imported as a stream
+        """
+        document = update.message.document
+        with self._sender.outbox(update) as outbox:
+            try:
+                ledger_format = ledger.detect_format(document.file_name or '')
+            except ledger.LedgerError:
+                outbox.send(f'Пришли файл с тратами в формате {" или ".join(ledger.LEDGER_FORMATS)}')
+                return
+            if document.file_size and document.file_size > MAX_DOWNLOAD_SIZE:
+                outbox.send('Файл слишком большой, раздели его на части до 20 МБ')
+                return
+            with tempfile.TemporaryFile() as file:
+                context.bot.get_file(document.file_id).download(out=file)
+                file.seek(0)
+                report = self._splitwise.import_ledger(
+                    ledger.read_ledger(ledger.text_stream(file, document.file_name), ledger_format),
+                    uploader_id=update.effective_user.id,
+                    max_errors=MAX_REPORTED_ERRORS,
+                )
+            lines = [f'Импортировано трат: {report.expenses}, долгов: {report.debts}']
+            if report.failed:
+                lines.append(f'Пропущено строк: {report.failed}')
+                lines.extend(f'Строка {error.line}: {error.message}' for error in report.errors)
+            outbox.send('\n'.join(lines))
+
+    def export_handler(
+        self,
+        update: Update,
+        context: CallbackContext,
+    ) -> NoReturn:
+        """
+        /export <event token> [csv|jsonl] sends expenses and debts of the event as a gzipped ledger
+        """
+        with self._sender.outbox(update) as outbox:
+            if not context.args or len(context.args) > 2:
+                outbox.send(f'Использование: /export <токен мероприятия> [{"|".join(ledger.LEDGER_FORMATS)}]')
+                return
+            event_token = context.args[0]
+            ledger_format = context.args[1] if len(context.args) > 1 else ledger.CSV
+            if ledger_format not in ledger.LEDGER_FORMATS:
+                outbox.send(f'Формат может быть {" или ".join(ledger.LEDGER_FORMATS)}')
+                return
+            if not self._splitwise.user_participates_in_event(update.effective_user.id, event_token):
+                outbox.send('Ты не участвуешь в этом мероприятии')
+                return
+            with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE) as file:
+                rows = ledger.write_ledger(
+                    self._splitwise.iter_event_ledger(event_token), file, ledger_format, compress=True,
+                )
+                file.seek(0)
+                event = self._splitwise.get_event_info(event_token)
+                outbox.send_document(file, f'{event_token}.{ledger_format}.gz', caption=f'{event.name}: {rows} строк')
+                # sent here, the file is closed before the outbox
+                outbox.flush()
 
 
 class MenuButtonsConversationHandler:
-    def __init__(self):
-        self._splitwise = SplitwiseApp()
+    def __init__(
+        self,
+        splitwise: SplitwiseApp,
+        sender: Optional[MessageSender] = None,
+    ):
+        self._splitwise = splitwise
+        self._sender = sender or MessageSender()
 
     def callback_query_handler(
         self,
         update: Update,
-        _: CallbackContext,
+        context: CallbackContext,
     ) -> NoReturn:
         data = update.callback_query.data
-        update.callback_query.answer()
-        if data == menu_items.CREATE_EVENT:
-            update.callback_query.edit_message_text('Введи название мероприятия или нажми кнопку \'Отмена\'')
-            update.callback_query.edit_message_reply_markup(reply_markup=buttons.get_cancel_button())
-            update.callback_query.answer()
-            return States.EVENT_NAME_STATE
-        elif data == menu_items.JOIN_EVENT:
-            update.callback_query.edit_message_text('Введи токен мероприятия или нажми кнопку \'Отмена\'',
-                                                    reply_markup=buttons.get_cancel_button())
-            update.callback_query.answer()
-            return States.EVENT_TOKEN_STATE
-        elif data == menu_items.SELECT_EVENT:
-            user_id = update.effective_user.id
-            events = self._splitwise.get_user_events(user_id)
-            update.callback_query.edit_message_text('Выбери мероприятие')
-            update.callback_query.edit_message_reply_markup(reply_markup=buttons.get_event_buttons(events))
-            update.callback_query.answer()
-            return States.ASKING_FOR_ACTION
+        with self._sender.outbox(update) as outbox:
+            outbox.answer()
+            if data == menu_items.CREATE_EVENT:
+                outbox.edit('Введи название мероприятия или нажми кнопку \'Отмена\'')
+                outbox.edit(reply_markup=buttons.get_cancel_button())
+                return States.EVENT_NAME_STATE
+            elif data == menu_items.JOIN_EVENT:
+                outbox.edit('Введи токен мероприятия или нажми кнопку \'Отмена\'',
+                            reply_markup=buttons.get_cancel_button())
+                return States.EVENT_TOKEN_STATE
+            elif data == menu_items.SELECT_EVENT:
+                user_id = update.effective_user.id
+                cursors = context.user_data[States.EVENTS_PAGE] = [None]
+                outbox.edit('Выбери мероприятие')
+                outbox.edit(reply_markup=get_event_page_buttons(self._splitwise, user_id, cursors))
+                return States.ASKING_FOR_ACTION
 
     def fallback_handler(
         self,
         update: Update,
         _: CallbackContext,
     ):
-        update.effective_chat.send_message('Ошибка, но мы не знаем что произошло')
+        with self._sender.outbox(update) as outbox:
+            outbox.send('Ошибка, но мы не знаем что произошло')
 
     def get_conversation_handler(self,) -> ConversationHandler:
         conv_handler = ConversationHandler(
             entry_points=[CallbackQueryHandler(self.callback_query_handler), ],
             states={
-                States.EVENT_NAME_STATE: [CreateEventConversation().get_conversation_handler()],
-                States.ASKING_FOR_ACTION: [SelectEventConversation().get_conversation_handler()],
-                States.EVENT_TOKEN_STATE: [JoinEventConversation().get_conversation_handler()],
+                States.EVENT_NAME_STATE: [
+                    CreateEventConversation(self._splitwise, self._sender).get_conversation_handler(),
+                ],
+                States.ASKING_FOR_ACTION: [
+                    SelectEventConversation(self._splitwise, self._sender).get_conversation_handler(),
+                ],
+                States.EVENT_TOKEN_STATE: [
+                    JoinEventConversation(self._splitwise, self._sender).get_conversation_handler(),
+                ],
             },
             fallbacks=[MessageHandler(Filters.all, self.fallback_handler)],
         )
@@ -132,8 +238,13 @@ class MenuButtonsConversationHandler:
 
 class CreateEventConversation:
 
-    def __init__(self,):
-        self._splitwise = SplitwiseApp()
+    def __init__(
+        self,
+        splitwise: SplitwiseApp,
+        sender: Optional[MessageSender] = None,
+    ):
+        self._splitwise = splitwise
+        self._sender = sender or MessageSender()
 
     def event_name_handler(
         self,
@@ -145,11 +256,12 @@ class CreateEventConversation:
             user_id=update.effective_user.id,
             event_name=event_name,
         )
-        update.effective_chat.send_message(
-            f'Мероприятие "{event_name}" создано. Токен: `{event_token}`',
-            parse_mode=ParseMode.MARKDOWN
-        )
-        update.effective_chat.send_message('Меню:', reply_markup=buttons.get_menu_keyboard())
+        with self._sender.outbox(update) as outbox:
+            outbox.send(
+                f'Мероприятие "{event_name}" создано. Токен: `{event_token}`',
+                parse_mode=ParseMode.MARKDOWN
+            )
+            outbox.send('Меню:', reply_markup=buttons.get_menu_keyboard())
         return ConversationHandler.END
 
     def callback_handler(
@@ -157,20 +269,22 @@ class CreateEventConversation:
         update: Update,
         _: CallbackContext,
     ):
-        if update.callback_query.data == menu_items.CANCEL:
-            update.callback_query.answer('Создание мероприятия отменено')
-            update.callback_query.edit_message_text('Меню:')
-            update.callback_query.edit_message_reply_markup(reply_markup=buttons.get_menu_keyboard())
-            return ConversationHandler.END
-        else:
-            update.callback_query.answer('Не на ту кнопку жмешь')
+        with self._sender.outbox(update) as outbox:
+            if update.callback_query.data == menu_items.CANCEL:
+                outbox.answer('Создание мероприятия отменено')
+                outbox.edit('Меню:')
+                outbox.edit(reply_markup=buttons.get_menu_keyboard())
+                return ConversationHandler.END
+            else:
+                outbox.answer('Не на ту кнопку жмешь')
 
     def fallbacks_handler(
         self,
         update: Update,
         _: CallbackContext,
     ):
-        update.effective_chat.send_message('Мимо кассы. Нужно имя.')
+        with self._sender.outbox(update) as outbox:
+            outbox.send('Мимо кассы. Нужно имя.')
 
     def get_conversation_handler(self,) -> ConversationHandler:
         conv_handler = ConversationHandler(
@@ -187,8 +301,13 @@ class CreateEventConversation:
 
 class JoinEventConversation:
 
-    def __init__(self,):
-        self._splitwise = SplitwiseApp()
+    def __init__(
+        self,
+        splitwise: SplitwiseApp,
+        sender: Optional[MessageSender] = None,
+    ):
+        self._splitwise = splitwise
+        self._sender = sender or MessageSender()
 
     def event_token_handler(
         self,
@@ -197,40 +316,43 @@ class JoinEventConversation:
     ) -> NoReturn:
         event_token = update.effective_message.text
         user_id = update.effective_user.id
-        try:
-            self._splitwise.get_event_info(event_token)
-        except KeyError:
-            update.effective_chat.send_message('Мероприятия с таким токеном не существует. '
-                                               'Введи корректный токен или нажми кнопку \'Отмена\'',
-                                               reply_markup=buttons.get_cancel_button())
-            return None
-        if self._splitwise.user_participates_in_event(user_id, event_token):
-            update.effective_chat.send_message('Не прокатит! Ты уже зарегистрирован в этом мероприятии')
-            update.effective_chat.send_message('Меню:', reply_markup=buttons.get_menu_keyboard())
+        with self._sender.outbox(update) as outbox:
+            try:
+                self._splitwise.get_event_info(event_token)
+            except KeyError:
+                outbox.send('Мероприятия с таким токеном не существует. '
+                            'Введи корректный токен или нажми кнопку \'Отмена\'',
+                            reply_markup=buttons.get_cancel_button())
+                return None
+            if self._splitwise.user_participates_in_event(user_id, event_token):
+                outbox.send('Не прокатит! Ты уже зарегистрирован в этом мероприятии')
+                outbox.send('Меню:', reply_markup=buttons.get_menu_keyboard())
+                return ConversationHandler.END
+            self._splitwise.add_user_to_event(user_id, event_token)
+            outbox.send('Ты успешно присоединился к мероприятию')
+            outbox.send('Меню:', reply_markup=buttons.get_menu_keyboard())
             return ConversationHandler.END
-        self._splitwise.add_user_to_event(user_id, event_token)
-        update.effective_chat.send_message('Ты успешно присоединился к мероприятию')
-        update.effective_chat.send_message('Меню:', reply_markup=buttons.get_menu_keyboard())
-        return ConversationHandler.END
 
     def callback_handler(
         self,
         update: Update,
         _: CallbackContext,
     ):
-        if update.callback_query.data == menu_items.CANCEL:
-            update.callback_query.edit_message_text('Меню:')
-            update.callback_query.edit_message_reply_markup(reply_markup=buttons.get_menu_keyboard())
-            return ConversationHandler.END
-        else:
-            update.callback_query.answer('Не на ту кнопку жмешь',)
+        with self._sender.outbox(update) as outbox:
+            if update.callback_query.data == menu_items.CANCEL:
+                outbox.edit('Меню:')
+                outbox.edit(reply_markup=buttons.get_menu_keyboard())
+                return ConversationHandler.END
+            else:
+                outbox.answer('Не на ту кнопку жмешь',)
 
     def fallbacks_handler(
         self,
         update: Update,
         _: CallbackContext,
     ):
-        update.effective_chat.send_message('Давай токен говори')
+        with self._sender.outbox(update) as outbox:
+            outbox.send('Давай токен говори')
 
     def get_conversation_handler(self,) -> ConversationHandler:
         conv_handler = ConversationHandler(
@@ -247,40 +369,88 @@ class JoinEventConversation:
 
 class SelectEventConversation:
 
-    def __init__(self,):
-        self._splitwise = SplitwiseApp()
+    def __init__(
+        self,
+        splitwise: SplitwiseApp,
+        sender: Optional[MessageSender] = None,
+    ):
+        self._splitwise = splitwise
+        self._sender = sender or MessageSender()
+
+    def _get_pressed_event(
+        self,
+        data: str,
+        user_id: int,
+    ) -> Optional[Event]:
+        """
+        Callback data comes from the client, ids of events are sequential
+        and easy to forge, so the event must be one of the user's
+        @param data: callback data of an event button
+        @param user_id: user who pressed the button
+        @return: None if there is no such event or the user does not participate in it
+        """
+        event_id = callback_data.unpack_id(data, callback_data.EVENT)
+        try:
+            if event_id is None:
+                # buttons sent by older versions carry the event token
+                event = self._splitwise.get_event_info(data)
+            else:
+                event = self._splitwise.get_event_by_id(event_id)
+        except KeyError:
+            return None
+        if not self._splitwise.user_participates_in_event(user_id, event.token):
+            return None
+        return event
 
     def asking_for_action(
         self,
         update: Update,
         context: CallbackContext,
     ):
-        if update.callback_query.data == menu_items.CANCEL:
-            context.user_data.pop(States.CURRENT_EVENT_TOKEN, None)
-            update.callback_query.edit_message_text('Меню:')
-            update.callback_query.edit_message_reply_markup(reply_markup=buttons.get_menu_keyboard())
-            update.callback_query.answer()
-            return ConversationHandler.END
-        event_token = update.callback_query.data
-        context.user_data[States.CURRENT_EVENT_TOKEN] = event_token
-        event = self._splitwise.get_event_info(event_token)
-        update.callback_query.edit_message_text(f'{event.name}\nВыберите пункт меню:')
-        update.callback_query.edit_message_reply_markup(reply_markup=buttons.get_event_commands_keyboard())
-        update.callback_query.answer()
-        return States.EVENT_ACTIONS
+        with self._sender.outbox(update) as outbox:
+            if update.callback_query.data == menu_items.CANCEL:
+                context.user_data.pop(States.CURRENT_EVENT_TOKEN, None)
+                context.user_data.pop(States.EVENTS_PAGE, None)
+                outbox.edit('Меню:')
+                outbox.edit(reply_markup=buttons.get_menu_keyboard())
+                outbox.answer()
+                return ConversationHandler.END
+            cursors = context.user_data.setdefault(States.EVENTS_PAGE, [None])
+            if buttons.turn_page(cursors, update.callback_query.data):
+                user_id = update.effective_user.id
+                outbox.edit(reply_markup=get_event_page_buttons(self._splitwise, user_id, cursors))
+                outbox.answer()
+                return None
+            event = self._get_pressed_event(update.callback_query.data, update.effective_user.id)
+            if event is None:
+                # a keyboard sent before events were keyed by id, garbage or a forged id
+                cursors[:] = [None]
+                outbox.edit('Меню устарело, выбери мероприятие еще раз')
+                outbox.edit(reply_markup=get_event_page_buttons(self._splitwise, update.effective_user.id, cursors))
+                outbox.answer()
+                return None
+            context.user_data.pop(States.EVENTS_PAGE, None)
+            context.user_data[States.CURRENT_EVENT_TOKEN] = event.token
+            outbox.edit(f'{event.name}\nВыберите пункт меню:')
+            outbox.edit(reply_markup=buttons.get_event_commands_keyboard())
+            outbox.answer()
+            return States.EVENT_ACTIONS
 
     def fallbacks_handler(
         self,
         update: Update,
         _: CallbackContext,
     ):
-        update.effective_chat.send_message('Что-то пошло не так. Попробуй еще раз')
+        with self._sender.outbox(update) as outbox:
+            outbox.send('Что-то пошло не так. Попробуй еще раз')
 
     def get_conversation_handler(self,) -> ConversationHandler:
         conv_handler = ConversationHandler(
             entry_points=[CallbackQueryHandler(self.asking_for_action)],
             states={
-                States.EVENT_ACTIONS: [ActionProcessHandlers().get_conversation_handler(), ]
+                States.EVENT_ACTIONS: [
+                    ActionProcessHandlers(self._splitwise, self._sender).get_conversation_handler(),
+                ]
             },
             fallbacks=[MessageHandler(Filters.all, self.fallbacks_handler), ],
             map_to_parent={
@@ -292,8 +462,13 @@ class SelectEventConversation:
 
 
 class ActionProcessHandlers:
-    def __init__(self):
-        self._splitwise = SplitwiseApp()
+    def __init__(
+        self,
+        splitwise: SplitwiseApp,
+        sender: Optional[MessageSender] = None,
+    ):
+        self._splitwise = splitwise
+        self._sender = sender or MessageSender()
 
     def callback_query_handler(
         self,
@@ -304,54 +479,56 @@ class ActionProcessHandlers:
         event_token = context.user_data[States.CURRENT_EVENT_TOKEN]
         event = self._splitwise.get_event_info(event_token)
         user_id = update.effective_user.id
-        if data == menu_items.SHOW_DEBTS:
-            lenders_info, debtors_info = self._splitwise.get_final_transactions(event_token)
-            if user_id in debtors_info:
-                update.callback_query.edit_message_text('Вы должны: \n' + str(debtors_info[user_id]) +
-                                                        f'\n\n {event.name}\nВыберите пункт меню:')
-            elif user_id in lenders_info:
-                update.callback_query.edit_message_text('Вам должны: \n' + str(lenders_info[user_id]) +
-                                                        f'\n\n {event.name}\nВыберите пункт меню:')
-            else:
-                update.callback_query.edit_message_text('Вы никому не должны и вам никто не должен!!!' +
-                                                        f'\n\n {event.name}\nВыберите пункт меню:')
-            update.callback_query.edit_message_reply_markup(reply_markup=buttons.get_event_commands_keyboard())
-            update.callback_query.answer()
-            return States.EVENT_ACTIONS
-        elif data == menu_items.ADD_EXPENSE:
-            event_token = context.user_data[States.CURRENT_EVENT_TOKEN]
-            try:
-                self._splitwise.get_event_info(event_token)
-            except KeyError:
-                update.effective_chat.send_message(
-                    'Мероприятия с таким токеном не существует. Повторите создание траты:')
+        with self._sender.outbox(update) as outbox:
+            if data == menu_items.SHOW_DEBTS:
+                lenders_info, debtors_info = self._splitwise.get_final_transactions(event_token)
+                if user_id in debtors_info:
+                    outbox.edit('Вы должны: \n' + str(debtors_info[user_id]) +
+                                f'\n\n {event.name}\nВыберите пункт меню:')
+                elif user_id in lenders_info:
+                    outbox.edit('Вам должны: \n' + str(lenders_info[user_id]) +
+                                f'\n\n {event.name}\nВыберите пункт меню:')
+                else:
+                    outbox.edit('Вы никому не должны и вам никто не должен!!!' +
+                                f'\n\n {event.name}\nВыберите пункт меню:')
+                outbox.edit(reply_markup=buttons.get_event_commands_keyboard())
+                outbox.answer()
+                return States.EVENT_ACTIONS
+            elif data == menu_items.ADD_EXPENSE:
+                event_token = context.user_data[States.CURRENT_EVENT_TOKEN]
+                try:
+                    self._splitwise.get_event_info(event_token)
+                except KeyError:
+                    outbox.send('Мероприятия с таким токеном не существует. Повторите создание траты:')
+                    return ConversationHandler.END
+                expense = Expense()
+                expense.event_token = event_token
+                expense.lender_id = user_id
+                context.user_data[States.EXPENSE] = expense
+                outbox.edit('Введи название траты или нажми \'Отмена\'', reply_markup=buttons.get_cancel_button())
+                return States.EXPENSE_NAME
+            elif data == menu_items.CANCEL:
+                del context.user_data[States.CURRENT_EVENT_TOKEN]
+                outbox.edit('Меню:')
+                outbox.edit(reply_markup=buttons.get_menu_keyboard())
+                outbox.answer()
                 return ConversationHandler.END
-            expense = Expense()
-            expense.event_token = event_token
-            expense.lender_id = user_id
-            context.user_data[States.EXPENSE] = expense
-            update.callback_query.edit_message_text('Введи название траты или нажми \'Отмена\'',
-                                                    reply_markup=buttons.get_cancel_button())
-            return States.EXPENSE_NAME
-        elif data == menu_items.CANCEL:
-            del context.user_data[States.CURRENT_EVENT_TOKEN]
-            update.callback_query.edit_message_text('Меню:')
-            update.callback_query.edit_message_reply_markup(reply_markup=buttons.get_menu_keyboard())
-            update.callback_query.answer()
-            return ConversationHandler.END
 
     def fallbacks_handler(
         self,
         update: Update,
         _: CallbackContext,
     ):
-        update.effective_chat.send_message('Что-то пошло не так. Попробуй еще раз раз')
+        with self._sender.outbox(update) as outbox:
+            outbox.send('Что-то пошло не так. Попробуй еще раз раз')
 
     def get_conversation_handler(self,) -> ConversationHandler:
         conv_handler = ConversationHandler(
             entry_points=[CallbackQueryHandler(self.callback_query_handler), ],
             states={
-                States.EXPENSE_NAME: [AddExpenseHandlers().get_conversation_handler()],
+                States.EXPENSE_NAME: [
+                    AddExpenseHandlers(self._splitwise, self._sender).get_conversation_handler(),
+                ],
             },
             fallbacks=[MessageHandler(Filters.all, self.fallbacks_handler)],
             map_to_parent={
@@ -365,8 +542,26 @@ class ActionProcessHandlers:
 
 class AddExpenseHandlers:
 
-    def __init__(self,):
-        self._splitwise = SplitwiseApp()
+    def __init__(
+        self,
+        splitwise: SplitwiseApp,
+        sender: Optional[MessageSender] = None,
+    ):
+        self._splitwise = splitwise
+        self._sender = sender or MessageSender()
+        self._user_keyboards = buttons.UserKeyboards()
+
+    def _get_user_buttons(
+        self,
+        event_token: str,
+        after: Optional[int] = None,
+    ) -> InlineKeyboardMarkup:
+        version = self._splitwise.get_roster_version(event_token)
+        keyboard = self._user_keyboards.get(event_token, version, after)
+        if keyboard is None:
+            users, has_next = self._splitwise.get_users_of_event_page(event_token, after=after)
+            keyboard = self._user_keyboards.put(event_token, version, users, after, has_next)
+        return keyboard
 
     @staticmethod
     def _get_sum_or_none(text) -> Optional[int]:
@@ -383,8 +578,9 @@ class AddExpenseHandlers:
     ) -> States:
         expense_name = update.effective_message.text
         context.user_data[States.EXPENSE].name = expense_name
-        update.effective_chat.send_message('Введи потраченную сумму или нажми кнопку \'Отмена\'.',
-                                           reply_markup=buttons.get_cancel_button())
+        with self._sender.outbox(update) as outbox:
+            outbox.send('Введи потраченную сумму или нажми кнопку \'Отмена\'.',
+                        reply_markup=buttons.get_cancel_button())
         return States.EXPENSE_SUM
 
     def expense_sum(
@@ -394,21 +590,41 @@ class AddExpenseHandlers:
     ) -> Optional[States]:
         # let's use integer division and forget about cents for some time
         expense_sum = self._get_sum_or_none(update.effective_message.text)
-        if not expense_sum:
-            update.effective_chat.send_message('Потраченная сумма вводится в формате: 123(целое число). '
-                                               'Потраченная сумма должна быть больше нуля. '
-                                               'Попробуй еще раз')
+        with self._sender.outbox(update) as outbox:
+            if not expense_sum:
+                outbox.send('Потраченная сумма вводится в формате: 123(целое число). '
+                            'Потраченная сумма должна быть больше нуля. '
+                            'Попробуй еще раз')
+                return None
+
+            expense = context.user_data[States.EXPENSE]
+            expense.sum = expense_sum
+            # add_expense fills id and datetime of the expense as they are stored
+            self._splitwise.add_expense(expense)
+            outbox.send(f'Создана трата: {str(expense)}.')
+            outbox.send('Приступим к записи долгов')
+            context.user_data[States.USERS_PAGE] = [None]
+            user_buttons = self._get_user_buttons(context.user_data[States.CURRENT_EVENT_TOKEN])
+            outbox.send('Назови имя должника', reply_markup=user_buttons)
+            return States.DEBTOR_NAME
+
+    def _get_pressed_user(
+        self,
+        data: str,
+        event_token: str,
+    ) -> Optional[User]:
+        """
+        @param data: callback data of a user button
+        @param event_token: event the debt is added to
+        @return: None if there is no such user or the user does not participate in the event
+        """
+        user_id = callback_data.unpack_id(data, callback_data.USER)
+        if user_id is None and data.isdigit():
+            # buttons sent by older versions carry the plain user id
+            user_id = int(data)
+        if user_id is None or not self._splitwise.user_participates_in_event(user_id, event_token):
             return None
-
-        context.user_data[States.EXPENSE].sum = expense_sum
-        expense_id = self._splitwise.add_expense(context.user_data[States.EXPENSE])
-        context.user_data[States.EXPENSE].id = expense_id
-        expense = self._splitwise.get_expense(expense_id)
-        update.effective_chat.send_message(f'Создана трата: {str(expense)}.')
-        update.effective_chat.send_message('Приступим к записи долгов')
-        users = self._splitwise.get_users_of_event(context.user_data[States.CURRENT_EVENT_TOKEN])
-        update.effective_chat.send_message('Назови имя должника', reply_markup=buttons.get_user_buttons(users))
-        return States.DEBTOR_NAME
+        return self._splitwise.get_user_info(user_id)
 
     def debtor_name(
         self,
@@ -417,14 +633,32 @@ class AddExpenseHandlers:
     ):
         if update.callback_query.data == menu_items.CANCEL:
             return self.cancel_button_handler(update, context)
+        cursors = context.user_data.setdefault(States.USERS_PAGE, [None])
+        if buttons.turn_page(cursors, update.callback_query.data):
+            event_token = context.user_data[States.EXPENSE].event_token
+            with self._sender.outbox(update) as outbox:
+                outbox.edit(reply_markup=self._get_user_buttons(event_token, after=cursors[-1]))
+                outbox.answer()
+            return None
+
+        event_token = context.user_data[States.EXPENSE].event_token
+        user = self._get_pressed_user(update.callback_query.data, event_token)
+        if user is None:
+            # a keyboard sent before users were packed, garbage or a forged id
+            cursors[:] = [None]
+            with self._sender.outbox(update) as outbox:
+                outbox.edit('Меню устарело, выбери должника еще раз')
+                outbox.edit(reply_markup=self._get_user_buttons(event_token))
+                outbox.answer()
+            return None
 
         user_debt = Debt()
         user_debt.lender_id = update.effective_user.id
-        user_debt.debtor_id = int(update.callback_query.data)
+        user_debt.debtor_id = user.id
         context.user_data[States.DEBT] = user_debt
-        user = self._splitwise.get_user_info(int(update.callback_query.data))
-        update.callback_query.edit_message_text(f'{user.name}\nСколько он тебе задолжал?')
-        update.callback_query.answer()
+        with self._sender.outbox(update) as outbox:
+            outbox.edit(f'{user.name}\nСколько он тебе задолжал?')
+            outbox.answer()
         return States.DEBT_SUM
 
     def debt_sum(
@@ -433,21 +667,23 @@ class AddExpenseHandlers:
         context: CallbackContext,
     ) -> NoReturn:
         debt_sum = self._get_sum_or_none(update.effective_message.text)
-        if not debt_sum:
-            update.effective_chat.send_message('Долг вводится в формате: 123(целое число). '
-                                               'Долг должен быть положительным. '
-                                               'Попробуй еще раз')
-            return None
-
-        context.user_data[States.DEBT].sum = debt_sum
-        context.user_data[States.DEBT].expense_id = context.user_data[States.EXPENSE].id
-        debt = context.user_data[States.DEBT]
-        self._splitwise.add_debt(debt)
-        update.effective_chat.send_message('Записал!')
-        users = self._splitwise.get_users_of_event(context.user_data[States.EXPENSE].event_token)
-        update.effective_chat.send_message('Назови имя следующего должника или нажмите "Закончить"',
-                                           reply_markup=buttons.get_user_buttons(users))
-        return States.DEBTOR_NAME
+        with self._sender.outbox(update) as outbox:
+            if not debt_sum:
+                outbox.send('Долг вводится в формате: 123(целое число). '
+                            'Долг должен быть положительным. '
+                            'Попробуй еще раз')
+                return None
+
+            context.user_data[States.DEBT].sum = debt_sum
+            context.user_data[States.DEBT].expense_id = context.user_data[States.EXPENSE].id
+            debt = context.user_data[States.DEBT]
+            self._splitwise.add_debt(debt)
+            outbox.send('Записал!')
+            context.user_data[States.USERS_PAGE] = [None]
+            user_buttons = self._get_user_buttons(context.user_data[States.EXPENSE].event_token)
+            outbox.send('Назови имя следующего должника или нажмите "Закончить"',
+                        reply_markup=user_buttons)
+            return States.DEBTOR_NAME
 
     def cancel_button_handler(
         self,
@@ -458,11 +694,13 @@ class AddExpenseHandlers:
         if data == menu_items.CANCEL:
             context.user_data.pop(States.EXPENSE, None)
             context.user_data.pop(States.DEBT, None)
+            context.user_data.pop(States.USERS_PAGE, None)
             event_token = context.user_data[States.CURRENT_EVENT_TOKEN]
             event = self._splitwise.get_event_info(event_token)
-            update.callback_query.edit_message_text(f'\n\n {event.name}\nВыберите пункт меню:')
-            update.callback_query.edit_message_reply_markup(reply_markup=buttons.get_event_commands_keyboard())
-            update.callback_query.answer('Закончили')
+            with self._sender.outbox(update) as outbox:
+                outbox.edit(f'\n\n {event.name}\nВыберите пункт меню:')
+                outbox.edit(reply_markup=buttons.get_event_commands_keyboard())
+                outbox.answer('Закончили')
             return States.EVENT_ACTIONS
         return None
 
@@ -472,14 +710,16 @@ class AddExpenseHandlers:
         update: Update,
         _: CallbackContext,
     ):
-        update.effective_chat.send_message('Хватит жмакать на кнопки')
+        with self._sender.outbox(update) as outbox:
+            outbox.send('Хватит жмакать на кнопки')
 
     def fallbacks_handler(
         self,
         update: Update,
         _: CallbackContext,
     ):
-        update.effective_chat.send_message('Что-то пошло не так. Попробуй еще раз раз раз')
+        with self._sender.outbox(update) as outbox:
+            outbox.send('Что-то пошло не так. Попробуй еще раз раз раз')
 
     def get_conversation_handler(self,) -> ConversationHandler:
         conv_handler = ConversationHandler(
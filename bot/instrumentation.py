@@ -0,0 +1,114 @@
+import functools
+import time
+from typing import Any, Callable, List, Optional
+
+from telegram.ext import ConversationHandler, Dispatcher, Handler
+
+from metrics.registry import REGISTRY, Registry
+
+# state label of handlers outside of conversations
+NO_STATE = 'none'
+ENTRY = 'entry'
+FALLBACK = 'fallback'
+
+
+def _state_name(state: Any) -> str:
+    return getattr(state, 'name', str(state))
+
+
+def _join(
+    path: str,
+    state: str,
+) -> str:
+    return f'{path}.{state}' if path else state
+
+
+class HandlerMetrics:
+    """
+    Latency and error count of every handler callback, labelled by the callback
+    and the conversation state it is registered for.
+    Nested conversations give dotted states: EVENT_ACTIONS of a conversation
+    registered for ASKING_FOR_ACTION is labelled ASKING_FOR_ACTION.EVENT_ACTIONS
+    """
+    def __init__(
+        self,
+        registry: Registry = REGISTRY,
+    ):
+        self.seconds = registry.histogram(
+            'bot_handler_seconds',
+            'Time spent in a handler callback',
+            ['handler', 'state'],
+        )
+        self.errors = registry.counter(
+            'bot_handler_errors_total',
+            'Handler callbacks that raised an exception',
+            ['handler', 'state'],
+        )
+
+    def timed(
+        self,
+        callback: Callable,
+        state: str = NO_STATE,
+        name: Optional[str] = None,
+    ) -> Callable:
+        """
+        Wraps a handler callback, can also be used as a decorator
+        @param name: handler label, qualified name of the callback by default
+        """
+        label = name or getattr(callback, '__qualname__', repr(callback))
+
+        @functools.wraps(callback)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return callback(*args, **kwargs)
+            except Exception:
+                self.errors.inc(label, state)
+                raise
+            finally:
+                self.seconds.observe(time.perf_counter() - start, label, state)
+
+        return wrapper
+
+    def instrument(
+        self,
+        dispatcher: Dispatcher,
+    ) -> int:
+        """
+        Wraps callbacks of every handler added to dispatcher so far, including handlers of conversations
+        @return: number of wrapped callbacks
+        """
+        return sum(
+            self._instrument_handlers(handlers, NO_STATE, '')
+            for handlers in dispatcher.handlers.values()
+        )
+
+    def _instrument_handlers(
+        self,
+        handlers: List[Handler],
+        state: str,
+        path: str,
+    ) -> int:
+        wrapped = 0
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                wrapped += self._instrument_conversation(handler, path)
+            else:
+                handler.callback = self.timed(handler.callback, state)
+                wrapped += 1
+        return wrapped
+
+    def _instrument_conversation(
+        self,
+        conversation: ConversationHandler,
+        path: str,
+    ) -> int:
+        """
+        @param path: states of the enclosing conversations, empty for a top level one
+        """
+        wrapped = self._instrument_handlers(conversation.entry_points, path or ENTRY, path)
+        for state, handlers in conversation.states.items():
+            state_path = _join(path, _state_name(state))
+            wrapped += self._instrument_handlers(handlers, state_path, state_path)
+        wrapped += self._instrument_handlers(conversation.fallbacks, _join(path, FALLBACK), path)
+        return wrapped
@@ -4,3 +4,4 @@ CREATE_EVENT = 'create_event'
 ADD_EXPENSE = 'add_expense'
 SHOW_DEBTS = 'show_debts'
 CANCEL = 'cancel'
+PREV_PAGE = 'prev_page'
@@ -0,0 +1,309 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Callable, Dict, List, NoReturn, Optional, Union
+
+from telegram import InlineKeyboardMarkup, ParseMode, Update
+from telegram.error import RetryAfter
+
+from app.cache import LRUCache
+
+log = logging.getLogger(__name__)
+
+# https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+GLOBAL_MESSAGES_PER_SECOND = 30.0
+CHAT_MESSAGES_PER_SECOND = 1.0
+CHAT_BURST = 3
+MAX_MESSAGE_LENGTH = 4096
+MESSAGE_SEPARATOR = '\n\n'
+# characters with a meaning in legacy Markdown, plain text containing them changes when sent as Markdown
+_MARKDOWN_CHARS = set('_*`[')
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: rate tokens per second, at most capacity stored.
+    acquire reserves a token and sleeps until it is available, so concurrent callers
+    are served in order of arrival
+    """
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+    ):
+        if rate <= 0 or capacity < 1:
+            raise ValueError('Token bucket needs positive rate and capacity of at least one token')
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Takes a token, possibly in advance
+        @return: seconds to wait until the token is actually available
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate) - 1
+            self._updated = now
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def acquire(self) -> float:
+        """
+        @return: seconds waited
+        """
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class MessageSender:
+    """
+    Sends Bot API requests on behalf of handlers: every message and edit takes a token from
+    the global bucket and from the bucket of its chat, requests answered with 429 are retried
+    after retry_after seconds.
+    If coalesce is False, outboxes send every queued operation as a separate request
+    """
+    def __init__(
+        self,
+        global_rate: float = GLOBAL_MESSAGES_PER_SECOND,
+        chat_rate: float = CHAT_MESSAGES_PER_SECOND,
+        chat_burst: int = CHAT_BURST,
+        max_retries: int = 3,
+        coalesce: bool = True,
+        max_chats: int = 10000,
+    ):
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chat_buckets = LRUCache(maxsize=max_chats)
+        self._chat_buckets_lock = threading.Lock()
+        self.max_retries = max_retries
+        self.coalesce = coalesce
+        self.api_calls = 0
+        self.retries = 0
+        self.throttled_seconds = 0.0
+
+    def _get_chat_bucket(self, chat_id: int) -> TokenBucket:
+        with self._chat_buckets_lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = TokenBucket(self._chat_rate, self._chat_burst)
+                self._chat_buckets.put(chat_id, bucket)
+            return bucket
+
+    def call(
+        self,
+        chat_id: Optional[int],
+        request: Callable[..., Any],
+        *args,
+        **kwargs,
+    ) -> Any:
+        """
+        Makes a Bot API request, chat_id is None for requests not limited per chat
+        like answerCallbackQuery
+        """
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                wait = max(self._get_chat_bucket(chat_id).reserve(), self._global_bucket.reserve())
+                if wait:
+                    self.throttled_seconds += wait
+                    time.sleep(wait)
+            self.api_calls += 1
+            try:
+                return request(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                log.warning('Flood control exceeded, retrying in %s seconds', e.retry_after)
+                time.sleep(e.retry_after)
+
+    def outbox(self, update: Update) -> 'Outbox':
+        return Outbox(self, update)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'api_calls': self.api_calls,
+            'retries': self.retries,
+            'throttled_seconds': self.throttled_seconds,
+        }
+
+
+@dataclass
+class _Message:
+    text: str
+    reply_markup: Optional[InlineKeyboardMarkup] = None
+    parse_mode: Optional[str] = None
+
+
+@dataclass
+class _Document:
+    document: BinaryIO
+    filename: str
+    caption: Optional[str] = None
+
+
+def _merge(
+    first: Union[_Message, _Document],
+    second: Union[_Message, _Document],
+) -> Optional[_Message]:
+    """
+    One message showing both messages, None if they can not be merged
+    """
+    if isinstance(first, _Document) or isinstance(second, _Document):
+        return None
+    if first.reply_markup is not None:
+        # the keyboard belongs under the first text
+        return None
+    parse_mode = first.parse_mode or second.parse_mode
+    if first.parse_mode != second.parse_mode:
+        # plain text may join a Markdown message only if Markdown leaves it as is
+        plain = first if first.parse_mode is None else second
+        if plain.parse_mode is not None or parse_mode != ParseMode.MARKDOWN or _MARKDOWN_CHARS & set(plain.text):
+            return None
+    text = first.text + MESSAGE_SEPARATOR + second.text
+    if len(text) > MAX_MESSAGE_LENGTH:
+        return None
+    return _Message(text, second.reply_markup, parse_mode)
+
+
+class Outbox:
+    """
+    Collects everything a handler sends in reply to one update and sends it on exit:
+    the callback query is answered once, edits of the callback message become one request,
+    consecutive messages are merged into one message when the result looks the same.
+
+        with sender.outbox(update) as outbox:
+            outbox.send('Записал!')
+            outbox.send('Меню:', reply_markup=keyboard)
+    """
+    def __init__(
+        self,
+        sender: MessageSender,
+        update: Update,
+    ):
+        self._sender = sender
+        self._update = update
+        self._messages: List[Union[_Message, _Document]] = []
+        self._edit_text: Optional[str] = None
+        self._edit_markup: Optional[InlineKeyboardMarkup] = None
+        self._edits: List[Dict[str, Any]] = []
+        self._answers: List[Optional[str]] = []
+
+    def send(
+        self,
+        text: str,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+        parse_mode: Optional[str] = None,
+    ) -> NoReturn:
+        self._messages.append(_Message(text, reply_markup, parse_mode))
+
+    def send_document(
+        self,
+        document: BinaryIO,
+        filename: str,
+        caption: Optional[str] = None,
+    ) -> NoReturn:
+        """
+        Sends the file after the messages queued before it, document must stay open until flush
+        """
+        self._messages.append(_Document(document, filename, caption))
+
+    def edit(
+        self,
+        text: Optional[str] = None,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+    ) -> NoReturn:
+        """
+        Edits the message of the callback query, the last text and the last keyboard win
+        """
+        if text is not None:
+            self._edit_text = text
+        if reply_markup is not None:
+            self._edit_markup = reply_markup
+        self._edits.append({'text': text, 'reply_markup': reply_markup})
+
+    def answer(
+        self,
+        text: Optional[str] = None,
+    ) -> NoReturn:
+        """
+        Answers the callback query, a query is answered once, the first text wins
+        """
+        self._answers.append(text)
+
+    def __enter__(self) -> 'Outbox':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def flush(self) -> NoReturn:
+        if self._sender.coalesce:
+            self._flush_coalesced()
+        else:
+            self._flush_one_by_one()
+        self._messages = []
+        self._edits = []
+        self._answers = []
+        self._edit_text = self._edit_markup = None
+
+    def _flush_coalesced(self) -> NoReturn:
+        query = self._update.callback_query
+        chat_id = self._update.effective_chat.id if self._update.effective_chat else None
+        if self._answers:
+            texts = [text for text in self._answers if text is not None]
+            self._sender.call(None, query.answer, texts[0] if texts else None)
+        if self._edit_text is not None:
+            self._sender.call(chat_id, query.edit_message_text, self._edit_text, reply_markup=self._edit_markup)
+        elif self._edit_markup is not None:
+            self._sender.call(chat_id, query.edit_message_reply_markup, reply_markup=self._edit_markup)
+        merged: List[_Message] = []
+        for message in self._messages:
+            combined = _merge(merged[-1], message) if merged else None
+            if combined is None:
+                merged.append(message)
+            else:
+                merged[-1] = combined
+        for message in merged:
+            self._send(chat_id, message)
+
+    def _flush_one_by_one(self) -> NoReturn:
+        query = self._update.callback_query
+        chat_id = self._update.effective_chat.id if self._update.effective_chat else None
+        for edit in self._edits:
+            if edit['text'] is not None:
+                self._sender.call(chat_id, query.edit_message_text, edit['text'], reply_markup=edit['reply_markup'])
+            else:
+                self._sender.call(chat_id, query.edit_message_reply_markup, reply_markup=edit['reply_markup'])
+        for text in self._answers:
+            self._sender.call(None, query.answer, text)
+        for message in self._messages:
+            self._send(chat_id, message)
+
+    def _send(
+        self,
+        chat_id: int,
+        message: Union[_Message, _Document],
+    ) -> NoReturn:
+        if isinstance(message, _Document):
+            self._sender.call(
+                chat_id,
+                self._update.effective_chat.send_document,
+                message.document,
+                filename=message.filename,
+                caption=message.caption,
+            )
+            return
+        self._sender.call(
+            chat_id,
+            self._update.effective_chat.send_message,
+            message.text,
+            reply_markup=message.reply_markup,
+            parse_mode=message.parse_mode,
+        )
@@ -1,14 +1,50 @@
-from typing import NoReturn
+import signal
+import threading
+from queue import Queue
+from typing import NoReturn, Optional
 
+from telegram import Bot
 from telegram.ext import (
     CommandHandler,
+    Dispatcher,
     Filters,
+    JobQueue,
     MessageHandler,
     Updater,
 )
+from telegram.utils.request import Request
 
 from bot import handlers
-from app.splitwise import SplitwiseApp
+from bot.container import AppContainer
+from bot.dispatcher import ChatOrderedDispatcher
+from bot.instrumentation import HandlerMetrics
+from bot.webhook import WebhookServer
+
+
+def add_handlers(
+    dispatcher: Dispatcher,
+    container: AppContainer,
+) -> NoReturn:
+    """
+    Registers the handlers of the bot, the same for every runtime
+    If the container has a metrics registry, every handler callback is timed, see HandlerMetrics
+    """
+    splitwise = container.splitwise
+    sender = container.sender
+    beginning_handlers = handlers.BeginningHandlers(splitwise, sender)
+    menu_handlers = handlers.MenuButtonsConversationHandler(splitwise, sender)
+    dispatcher.add_handler(menu_handlers.get_conversation_handler())
+    dispatcher.add_handler(CommandHandler('users_of_event', beginning_handlers.users_of_event_handler))
+    dispatcher.add_handler(CommandHandler('start', beginning_handlers.start_handler))
+    dispatcher.add_handler(CommandHandler('get_menu', beginning_handlers.get_menu))
+    dispatcher.add_handler(CommandHandler('export', beginning_handlers.export_handler))
+    # an edited message with a document must not import the ledger once more
+    dispatcher.add_handler(MessageHandler(
+        Filters.document & Filters.update.message, beginning_handlers.document_handler,
+    ))
+    dispatcher.add_handler(MessageHandler(Filters.text, beginning_handlers.text_handler))
+    if container.registry is not None:
+        HandlerMetrics(container.registry).instrument(dispatcher)
 
 
 class TelegramBot:
@@ -16,15 +52,48 @@ class TelegramBot:
         self,
         token: str,
         db_name: str = 'database.sqlite',
+        container: Optional[AppContainer] = None,
+        base_url: Optional[str] = None,
+        base_file_url: Optional[str] = None,
+        workers: int = 4,
+        update_queue_size: int = 0,
+        chat_workers: int = 0,
+        chat_queue_size: int = 100,
     ):
-        self.splitwise = SplitwiseApp(db_name=db_name)
-        self.updater = Updater(token)
-        dispatcher = self.updater.dispatcher
-        dispatcher.add_handler(handlers.MenuButtonsConversationHandler().get_conversation_handler())
-        dispatcher.add_handler(CommandHandler('users_of_event', handlers.BeginningHandlers().users_of_event_handler))
-        dispatcher.add_handler(CommandHandler('start', handlers.BeginningHandlers().start_handler))
-        dispatcher.add_handler(CommandHandler('get_menu', handlers.BeginningHandlers().get_menu))
-        dispatcher.add_handler(MessageHandler(Filters.text, handlers.BeginningHandlers().text_handler))
+        """
+        If container is not provided, a new one is created for db_name
+        update_queue_size bounds the number of received but not yet handled updates,
+        0 means unbounded
+        If chat_workers is set, updates of different chats are handled in parallel
+        by that many threads, keeping order within a chat, see ChatOrderedDispatcher
+        If the container has a metrics registry, every handler callback is timed, see HandlerMetrics
+        """
+        self.container = container or AppContainer(db_name=db_name)
+        self.splitwise = self.container.splitwise
+        bot = Bot(
+            token,
+            base_url=base_url,
+            base_file_url=base_file_url,
+            request=Request(con_pool_size=workers + chat_workers + 4),
+        )
+        job_queue = JobQueue()
+        if chat_workers:
+            dispatcher = ChatOrderedDispatcher(
+                bot,
+                Queue(maxsize=update_queue_size),
+                job_queue=job_queue,
+                workers=workers,
+                chat_workers=chat_workers,
+                chat_queue_size=chat_queue_size,
+            )
+        else:
+            dispatcher = Dispatcher(bot, Queue(maxsize=update_queue_size), job_queue=job_queue, workers=workers)
+        job_queue.set_dispatcher(dispatcher)
+        self.updater = Updater(dispatcher=dispatcher, workers=None)
+        self.webhook: Optional[WebhookServer] = None
+        self._dispatcher_thread: Optional[threading.Thread] = None
+
+        add_handlers(dispatcher, self.container)
 
     def run(self) -> NoReturn:
         """
@@ -32,3 +101,62 @@ class TelegramBot:
         """
         self.updater.start_polling()
         self.updater.idle()
+
+    def start_webhook(
+        self,
+        url: str,
+        secret_token: str,
+        listen: str = '0.0.0.0',
+        port: int = 8443,
+        path: str = '/webhook',
+    ) -> WebhookServer:
+        """
+        Starts the dispatcher and the webhook server without blocking
+        and registers the webhook at Telegram
+        @param url: public url forwarded to listen:port/path
+        """
+        dispatcher = self.updater.dispatcher
+        self._dispatcher_thread = threading.Thread(target=dispatcher.start, name='dispatcher', daemon=True)
+        self._dispatcher_thread.start()
+        self.webhook = WebhookServer(
+            dispatcher.bot,
+            dispatcher.update_queue,
+            secret_token=secret_token,
+            listen=listen,
+            port=port,
+            path=path,
+        )
+        self.webhook.start()
+        dispatcher.bot.set_webhook(url, api_kwargs={'secret_token': secret_token})
+        return self.webhook
+
+    def stop_webhook(self) -> NoReturn:
+        """
+        Stops receiving updates, handles the already received ones and stops the dispatcher
+        The webhook stays registered, Telegram keeps updates until the bot is back
+        """
+        if self.webhook is not None:
+            self.webhook.stop()
+            self.webhook = None
+        if self._dispatcher_thread is not None:
+            self.updater.dispatcher.stop()
+            self._dispatcher_thread.join()
+            self._dispatcher_thread = None
+
+    def run_webhook(
+        self,
+        url: str,
+        secret_token: str,
+        listen: str = '0.0.0.0',
+        port: int = 8443,
+        path: str = '/webhook',
+    ) -> NoReturn:
+        """
+        Starts main cycle receiving updates through webhook, stops on SIGINT or SIGTERM
+        """
+        stopped = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stopped.set())
+        self.start_webhook(url, secret_token, listen=listen, port=port, path=path)
+        stopped.wait()
+        self.stop_webhook()
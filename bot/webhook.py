@@ -0,0 +1,104 @@
+import hmac
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NoReturn, Tuple
+
+from telegram import Bot, Update
+
+log = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class _WebhookRequestHandler(BaseHTTPRequestHandler):
+    server: '_WebhookHTTPServer'
+
+    def do_POST(self):
+        webhook = self.server.webhook
+        if self.path.partition('?')[0] != webhook.path:
+            self._reply(404)
+            return
+        # compare_digest accepts only ASCII strings, a header may carry anything
+        secret_token = self.headers.get(SECRET_TOKEN_HEADER, '').encode('utf-8', 'surrogateescape')
+        if not hmac.compare_digest(secret_token, webhook.secret_token.encode('utf-8', 'surrogateescape')):
+            self._reply(403)
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            update = Update.de_json(json.loads(self.rfile.read(length)), webhook.bot)
+        except (ValueError, TypeError, KeyError):
+            self._reply(400)
+            return
+        if update is None:
+            self._reply(400)
+            return
+        try:
+            webhook.update_queue.put(update, timeout=webhook.put_timeout)
+        except queue.Full:
+            # Telegram retries updates answered with an error, the dispatcher catches up meanwhile
+            log.warning('Update queue is full, update %s rejected', update.update_id)
+            self._reply(503, retry_after=1)
+            return
+        self._reply(200)
+
+    def _reply(
+        self,
+        code: int,
+        retry_after: int = None,
+    ):
+        self.send_response(code)
+        if retry_after is not None:
+            self.send_header('Retry-After', str(retry_after))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class _WebhookHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    webhook: 'WebhookServer'
+
+
+class WebhookServer:
+    """
+    Embedded HTTP server receiving updates from Telegram.
+    Checks the secret token set with setWebhook and puts updates into the dispatcher queue.
+    If the queue is bounded and stays full for put_timeout seconds, the update is
+    answered with 503 and Telegram delivers it again later
+    """
+    def __init__(
+        self,
+        bot: Bot,
+        update_queue: queue.Queue,
+        secret_token: str,
+        listen: str = '0.0.0.0',
+        port: int = 8443,
+        path: str = '/webhook',
+        put_timeout: float = 1.0,
+    ):
+        if not secret_token:
+            raise ValueError('Webhook requires a secret token')
+        self.bot = bot
+        self.update_queue = update_queue
+        self.secret_token = secret_token
+        self.path = path
+        self.put_timeout = put_timeout
+        self._httpd = _WebhookHTTPServer((listen, port), _WebhookRequestHandler)
+        self._httpd.webhook = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='webhook', daemon=True)
+
+    @property
+    def server_address(self) -> Tuple[str, int]:
+        return self._httpd.server_address[:2]
+
+    def start(self) -> NoReturn:
+        self._thread.start()
+
+    def stop(self) -> NoReturn:
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -0,0 +1,155 @@
+"""
+Columnar containers for large result sets: one array('q') per integer column
+and one list per string column, with repeated strings interned.
+A batch of 100k debts takes four 800kB arrays instead of 100k objects,
+models are built on access only
+"""
+import sys
+from array import array
+from typing import Iterable, Iterator, List, NoReturn, overload
+
+from database.model_types import Expense, Debt
+
+
+class ExpenseBatch:
+    """
+    Stored expenses, ids and sums are never NULL.
+    Names and event tokens repeat a lot and are interned, datetimes are kept as they are
+    """
+    __slots__ = ('ids', 'names', 'sums', 'lender_ids', 'event_tokens', 'datetimes')
+
+    def __init__(
+        self,
+        rows: Iterable[tuple] = (),
+    ):
+        """
+        @param rows: (id, name, sum, lender_id, event_token, datetime), e.g. a cursor
+        """
+        self.ids = array('q')
+        self.names: List[str] = []
+        self.sums = array('q')
+        self.lender_ids = array('q')
+        self.event_tokens: List[str] = []
+        self.datetimes: List[str] = []
+        self.extend(rows)
+
+    def extend(
+        self,
+        rows: Iterable[tuple],
+    ) -> NoReturn:
+        intern = sys.intern
+        add_id, add_name, add_sum = self.ids.append, self.names.append, self.sums.append
+        add_lender_id, add_event_token, add_datetime = (
+            self.lender_ids.append, self.event_tokens.append, self.datetimes.append,
+        )
+        for id_, name, sum_, lender_id, event_token, datetime in rows:
+            add_id(id_)
+            add_name(intern(name))
+            add_sum(sum_)
+            add_lender_id(lender_id)
+            add_event_token(intern(event_token))
+            add_datetime(datetime)
+
+    def append(
+        self,
+        expense: Expense,
+    ) -> NoReturn:
+        self.extend([(
+            expense.id, expense.name, expense.sum, expense.lender_id, expense.event_token, expense.datetime,
+        )])
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @overload
+    def __getitem__(self, index: int) -> Expense: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[Expense]: ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return Expense(
+            self.ids[index],
+            self.names[index],
+            self.sums[index],
+            self.lender_ids[index],
+            self.event_tokens[index],
+            self.datetimes[index],
+        )
+
+    def __iter__(self) -> Iterator[Expense]:
+        return map(Expense, self.ids, self.names, self.sums, self.lender_ids, self.event_tokens, self.datetimes)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ExpenseBatch):
+            return NotImplemented
+        return all(getattr(self, column) == getattr(other, column) for column in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({len(self)} expenses)'
+
+
+class DebtBatch:
+    """
+    Debts, every column is an integer array
+    """
+    __slots__ = ('expense_ids', 'lender_ids', 'debtor_ids', 'sums')
+
+    def __init__(
+        self,
+        rows: Iterable[tuple] = (),
+    ):
+        """
+        @param rows: (expense_id, lender_id, debtor_id, sum), e.g. a cursor
+        """
+        self.expense_ids = array('q')
+        self.lender_ids = array('q')
+        self.debtor_ids = array('q')
+        self.sums = array('q')
+        self.extend(rows)
+
+    def extend(
+        self,
+        rows: Iterable[tuple],
+    ) -> NoReturn:
+        add_expense_id, add_lender_id, add_debtor_id, add_sum = (
+            self.expense_ids.append, self.lender_ids.append, self.debtor_ids.append, self.sums.append,
+        )
+        for expense_id, lender_id, debtor_id, sum_ in rows:
+            add_expense_id(expense_id)
+            add_lender_id(lender_id)
+            add_debtor_id(debtor_id)
+            add_sum(sum_)
+
+    def append(
+        self,
+        debt: Debt,
+    ) -> NoReturn:
+        self.extend([(debt.expense_id, debt.lender_id, debt.debtor_id, debt.sum)])
+
+    def __len__(self) -> int:
+        return len(self.expense_ids)
+
+    @overload
+    def __getitem__(self, index: int) -> Debt: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[Debt]: ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return Debt(self.expense_ids[index], self.lender_ids[index], self.debtor_ids[index], self.sums[index])
+
+    def __iter__(self) -> Iterator[Debt]:
+        return map(Debt, self.expense_ids, self.lender_ids, self.debtor_ids, self.sums)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, DebtBatch):
+            return NotImplemented
+        return all(getattr(self, column) == getattr(other, column) for column in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({len(self)} debts)'
@@ -0,0 +1,49 @@
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class StorageConfig:
+    """
+    journal_mode, synchronous: values for the corresponding sqlite pragmas
+    read_pool_size: number of read-only connections used for reads,
+        0 means that reads share the connection with writes.
+        Separate readers only make sense in WAL mode,
+        otherwise every read waits for the writer anyway
+    busy_timeout: seconds to wait for a lock before failing
+    group_commit: execute writes on a dedicated thread, committing
+        everything that is queued in one transaction, see database/writer.py
+    max_batch_size: max number of writes in one group commit
+    max_batch_delay: seconds the writer waits for more writes before committing
+    slow_query_log: path of a JSONL log of statements running longer than
+        slow_query_threshold seconds, see database/slow_log.py, None disables it
+    cached_statements: size of the prepared statement cache of every connection,
+        the default of sqlite3 is 128
+    """
+    journal_mode: str = 'DELETE'
+    synchronous:  str = 'FULL'
+    read_pool_size: int = 0
+    busy_timeout: float = 5.0
+    group_commit: bool = False
+    max_batch_size: int = 64
+    max_batch_delay: float = 0.0
+    slow_query_log: Optional[str] = None
+    slow_query_threshold: float = 0.1
+    cached_statements: int = 256
+
+    @classmethod
+    def wal(
+        cls,
+        read_pool_size: int = 4,
+        group_commit: bool = False,
+    ) -> 'StorageConfig':
+        """
+        WAL with synchronous=NORMAL: commits do not fsync, the database stays
+        consistent after a power loss but may lose the last transactions
+        """
+        return cls(
+            journal_mode='WAL',
+            synchronous='NORMAL',
+            read_pool_size=read_pool_size,
+            group_commit=group_commit,
+        )
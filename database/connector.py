@@ -1,8 +1,32 @@
-from pathlib import Path
-from typing import NoReturn, Optional, List, Tuple
+import functools
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, NoReturn, Optional, List, Sequence, Tuple, Union
 
 import sqlite3
 
+from database import migrations
+from database.batches import ExpenseBatch, DebtBatch
+from database.config import StorageConfig
+from database.instrumentation import QueryMetrics
+from database.pool import ReadConnectionPool
+from database.queries import (
+    RETURNING_SUPPORTED,
+    RowFactory,
+    USER_COLUMNS,
+    EVENT_COLUMNS,
+    EXPENSE_COLUMNS,
+    EXPENSES,
+    DEBT_COLUMNS,
+    columns,
+    first_column,
+    user_row,
+    event_row,
+    expense_row,
+)
+from database.slow_log import SlowQueryLog
+from database.writer import GroupCommitWriter
 from database.model_types import (
     User,
     Event,
@@ -10,230 +34,727 @@ from database.model_types import (
     Debt,
 )
 
+# sqlite may be built with a limit of 999 bound parameters
+DEBTS_QUERY_CHUNK_SIZE = 500
+# lower bound of user ids for keyset pagination
+MIN_USER_ID = -2 ** 63
+# event ids are rowids assigned from 1
+MIN_EVENT_ID = 0
+# expense ids are rowids assigned from 1
+MIN_EXPENSE_ID = 0
+# id of the event with the token bound in its place, NULL for an unknown token
+EVENT_ID = '(SELECT id FROM events WHERE token = ?)'
+# rows or expenses read at a time by streaming methods
+FETCH_SIZE = 1000
+
 
 class Connector:
     def __init__(
         self,
         db_name: str = 'database.sqlite',
+        config: Optional[StorageConfig] = None,
+        query_metrics: Optional[QueryMetrics] = None,
     ):
         """
         Establishes connection to database etc.
+        self.conn is the only connection that writes,
+        reads go through the read pool if config enables it.
+        With group commit enabled all writes are executed by a dedicated writer thread
+        If query_metrics is provided, every connection records its statements there
+        If config sets a slow query log, statements slower than the threshold are logged
         """
-        self.conn = sqlite3.connect(
+        self.config = config or StorageConfig()
+        self.slow_log = None
+        if self.config.slow_query_log:
+            self.slow_log = SlowQueryLog(self.config.slow_query_log, threshold=self.config.slow_query_threshold)
+            # statements are timed by the instrumented connections, kept unexposed without metrics
+            query_metrics = query_metrics or QueryMetrics(registry=None)
+        connect = sqlite3.connect
+        if query_metrics is not None:
+            connect = functools.partial(query_metrics.connect, slow_log=self.slow_log)
+        self.conn = connect(
             db_name,
+            timeout=self.config.busy_timeout,
             check_same_thread=False,
             isolation_level='EXCLUSIVE',
+            cached_statements=self.config.cached_statements,
         )
+        self.conn.execute(f'PRAGMA journal_mode={self.config.journal_mode}')
+        self.conn.execute(f'PRAGMA synchronous={self.config.synchronous}')
         self._create_database()
+        # guards self.conn, which is shared between dispatcher threads
+        self._lock = threading.RLock()
+        self._read_pool = None
+        if self.config.read_pool_size:
+            self._read_pool = ReadConnectionPool(
+                db_name,
+                size=self.config.read_pool_size,
+                busy_timeout=self.config.busy_timeout,
+                connect=connect,
+                cached_statements=self.config.cached_statements,
+            )
+        self._writer = None
+        if self.config.group_commit:
+            self._writer = GroupCommitWriter(
+                self.conn,
+                self._lock,
+                max_batch_size=self.config.max_batch_size,
+                max_delay=self.config.max_batch_delay,
+            )
 
     def _create_database(self) -> NoReturn:
         """
-        Create database
-        Maybe we need to manually apply the migration mechanism instead of this method
+        Brings database schema up to date, see database/migrations.py
         """
-        cursor = self.conn.cursor()
-        current_dir = Path(__file__).resolve().parent
-        try:
-            with open(current_dir.joinpath('sql/create_tables.sql'), 'r') as file:
-                cursor.executescript(file.read())
-            self.conn.commit()
-        except sqlite3.Error as e:
-            self.conn.rollback()
-            raise e
+        self.conn.execute('PRAGMA foreign_keys=on')
+        migrations.apply_migrations(self.conn)
+
+    @contextmanager
+    def _reading(self) -> Iterator[sqlite3.Connection]:
+        """
+        Connection for read-only queries, results must be fetched inside the block
+        """
+        if self._read_pool is None:
+            with self._lock:
+                yield self.conn
+        else:
+            with self._read_pool.connection() as conn:
+                yield conn
+
+    def _select(
+        self,
+        sql: str,
+        parameters: Any = (),
+        row_factory: Optional[RowFactory] = None,
+    ) -> List[Any]:
+        """
+        @return: all rows of the query, converted by row_factory if it is provided
+        """
+        with self._reading() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = row_factory
+            return cursor.execute(sql, parameters).fetchall()
+
+    def _select_one(
+        self,
+        sql: str,
+        parameters: Any = (),
+        row_factory: Optional[RowFactory] = None,
+    ) -> Any:
+        """
+        @return: first row of the query converted by row_factory, None if there are no rows
+        """
+        with self._reading() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = row_factory
+            return cursor.execute(sql, parameters).fetchone()
+
+    def _submit(
+        self,
+        operation: Callable[..., Any],
+        *args,
+    ) -> Future:
+        """
+        Executes operation(cursor, *args) in a transaction
+        Without group commit it is done right away in the calling thread
+        @return: future resolving to the value returned by operation
+        """
+        if self._writer is not None:
+            return self._writer.submit(lambda cursor: operation(cursor, *args))
+
+        future = Future()
+        future.set_running_or_notify_cancel()
+        with self._lock:
+            try:
+                result = operation(self.conn.cursor(), *args)
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+        return future
+
+    def _write(
+        self,
+        operation: Callable[..., Any],
+        *args,
+    ) -> Any:
+        return self._submit(operation, *args).result()
 
     def create_event(
         self,
         event: Event,
         user_id: int,
-    ) -> NoReturn:
+    ) -> Event:
         """
         User with user_id creates an event and joins it
-        Event token must be provided, it has to be unique
+        Event token must be provided, it has to be unique, event.id will be ignored
+        @return: stored event with its id
         """
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute('INSERT INTO events (token, name) VALUES(?, ?)', (event.token, event.name))
-            cursor.execute('INSERT INTO user2event (user_id, event_token) VALUES(?, ?)', (user_id, event.token))
-            self.conn.commit()
-        except sqlite3.Error as e:
-            self.conn.rollback()
-            raise e
+        return self._write(self._insert_event, event, user_id)
+
+    @staticmethod
+    def _insert_event(
+        cursor: sqlite3.Cursor,
+        event: Event,
+        user_id: int,
+    ) -> Event:
+        cursor.execute('INSERT INTO events (token, name) VALUES(?, ?)', (event.token, event.name))
+        event_id = cursor.lastrowid
+        cursor.execute('INSERT INTO user2event (user_id, event_id) VALUES(?, ?)', (user_id, event_id))
+        return Event(token=event.token, name=event.name, id=event_id)
 
     def add_user_to_event(
         self,
         user_id: int,
         event_token: str,
     ) -> NoReturn:
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute('INSERT INTO user2event (user_id, event_token) VALUES(?, ?)', (user_id, event_token))
-            self.conn.commit()
-        except sqlite3.Error as e:
-            self.conn.rollback()
-            raise e
+        self._write(self._insert_user2event, user_id, event_token)
+
+    @staticmethod
+    def _insert_user2event(
+        cursor: sqlite3.Cursor,
+        user_id: int,
+        event_token: str,
+    ) -> NoReturn:
+        cursor.execute(f'INSERT INTO user2event (user_id, event_id) VALUES(?, {EVENT_ID})', (user_id, event_token))
 
     def user_participates_in_event(
         self,
         user_id: int,
         event_token: str,
     ) -> bool:
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM user2event WHERE user_id = ? AND event_token = ?', (user_id, event_token))
-        return bool(cursor.fetchone())
+        return self._select_one(
+            f'SELECT 1 FROM user2event WHERE user_id = ? AND event_id = {EVENT_ID}',
+            (user_id, event_token),
+        ) is not None
 
     def get_event_info(
         self,
         event_token: str,
     ) -> Event:
-        cursor = self.conn.cursor()
-        event = cursor.execute('SELECT * FROM events WHERE token = ?', (event_token,)).fetchone()
-        if not event:
+        event = self._select_one(f'SELECT {EVENT_COLUMNS} FROM events WHERE token = ?', (event_token,), event_row)
+        if event is None:
             raise KeyError(f'Event with token {event_token} does not exist')
-        return Event(token=event[0], name=event[1])
+        return event
+
+    def get_event_by_id(
+        self,
+        event_id: int,
+    ) -> Event:
+        event = self._select_one(f'SELECT {EVENT_COLUMNS} FROM events WHERE id = ?', (event_id,), event_row)
+        if event is None:
+            raise KeyError(f'Event with id {event_id} does not exist')
+        return event
+
+    def get_event_version(
+        self,
+        event_token: str,
+    ) -> int:
+        """
+        Changes whenever an expense or a debt of the event is written, by any connection
+        @return: 0 for an unknown event
+        """
+        version = self._select_one('SELECT version FROM events WHERE token = ?', (event_token,), first_column)
+        return version or 0
+
+    def get_roster_version(
+        self,
+        event_token: str,
+    ) -> int:
+        """
+        Changes whenever a user joins or leaves the event, by any connection
+        @return: 0 for an unknown event
+        """
+        version = self._select_one('SELECT roster_version FROM events WHERE token = ?', (event_token,), first_column)
+        return version or 0
 
     def save_user_info(
         self,
         user: User,
     ) -> NoReturn:
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute('INSERT INTO users VALUES(?, ?)', (user.id, user.name))
-            self.conn.commit()
-        except sqlite3.Error as e:
-            self.conn.rollback()
-            raise e
+        self._write(self._insert_user, user)
+
+    @staticmethod
+    def _insert_user(
+        cursor: sqlite3.Cursor,
+        user: User,
+    ) -> NoReturn:
+        cursor.execute('INSERT INTO users VALUES(?, ?)', (user.id, user.name))
 
     def get_user_info_or_none(
         self,
         user_id: int,
     ) -> Optional[User]:
-        cursor = self.conn.cursor()
-        user = cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-        return None if user is None else User(id=user[0], name=user[1])
+        return self._select_one(f'SELECT {USER_COLUMNS} FROM users WHERE id = ?', (user_id,), user_row)
 
     def get_users_of_event(
         self,
         event_token: str,
     ) -> List[User]:
-        cursor = self.conn.cursor()
-        users = cursor.execute(
-            'SELECT * '
+        return self._select(
+            f'SELECT {columns(User, "u")} '
             'FROM users u, user2event u2e '
-            'WHERE u.id = u2e.user_id AND u2e.event_token = ?',
-            (event_token,)
-        ).fetchall()
-        return [User(id=user[0], name=user[1]) for user in (users or [])]
+            f'WHERE u.id = u2e.user_id AND u2e.event_id = {EVENT_ID}',
+            (event_token,),
+            user_row,
+        )
+
+    def get_users_of_event_page(
+        self,
+        event_token: str,
+        after: Optional[int] = None,
+        limit: int = 20,
+    ) -> List[User]:
+        """
+        Users of the event ordered by id, keyset pagination
+        @param after: id of the last user of the previous page, None for the first page
+        """
+        return self._select(
+            f'SELECT {columns(User, "u")} '
+            'FROM user2event u2e JOIN users u ON u.id = u2e.user_id '
+            f'WHERE u2e.event_id = {EVENT_ID} AND u2e.user_id > ? '
+            'ORDER BY u2e.user_id LIMIT ?',
+            (event_token, MIN_USER_ID if after is None else after, limit),
+            user_row,
+        )
 
     def save_debt_info(
         self,
         debt: Debt,
     ) -> int:
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute(
-                'INSERT INTO debts (expense_id, lender_id, debtor_id, sum) VALUES(?, ?, ?, ?)',
-                (debt.expense_id, debt.lender_id, debt.debtor_id, debt.sum),
-            )
-            self.conn.commit()
-            return cursor.lastrowid
-        except sqlite3.Error as e:
-            self.conn.rollback()
-            raise e
+        return self._write(self._insert_debt, debt)
+
+    def submit_debt_info(
+        self,
+        debt: Debt,
+    ) -> Future:
+        """
+        Same as save_debt_info, but does not wait for the commit
+        @return: future resolving to the row id
+        """
+        return self._submit(self._insert_debt, debt)
+
+    @staticmethod
+    def _insert_debt(
+        cursor: sqlite3.Cursor,
+        debt: Debt,
+    ) -> int:
+        cursor.execute(
+            'INSERT INTO debts (expense_id, lender_id, debtor_id, sum) VALUES(?, ?, ?, ?)',
+            (debt.expense_id, debt.lender_id, debt.debtor_id, debt.sum),
+        )
+        return cursor.lastrowid
 
     def save_expense_info(
         self,
         expense: Expense,
-    ) -> int:
+    ) -> Expense:
         """
         Add new expense to database
         expense.id will be ignored
+        @return: stored expense with its id, the given object is not modified
+        """
+        return self._write(self._insert_expense, expense)
+
+    def submit_expense_info(
+        self,
+        expense: Expense,
+    ) -> Future:
+        """
+        Same as save_expense_info, but does not wait for the commit
+        @return: future resolving to the stored expense
+        """
+        return self._submit(self._insert_expense, expense)
+
+    @staticmethod
+    def _insert_expense(
+        cursor: sqlite3.Cursor,
+        expense: Expense,
+    ) -> Expense:
         """
+        The stored row is read back by RETURNING of the same statement,
+        on sqlite older than 3.35 it is selected by rowid in the same transaction
+        """
+        # the cursor may be shared by a batch of the group commit writer, its row factory is left intact
+        returning = cursor.connection.cursor()
+        returning.row_factory = expense_row
+        parameters = (expense.name, expense.sum, expense.lender_id, expense.event_token, expense.datetime)
+        if RETURNING_SUPPORTED:
+            return returning.execute(
+                f'INSERT INTO expenses (name, sum, lender_id, event_id, datetime) VALUES(?, ?, ?, {EVENT_ID}, ?) '
+                'RETURNING id, name, sum, lender_id, (SELECT token FROM events WHERE id = event_id), datetime',
+                parameters,
+            ).fetchall()[0]
+        returning.execute(
+            f'INSERT INTO expenses (name, sum, lender_id, event_id, datetime) VALUES(?, ?, ?, {EVENT_ID}, ?)',
+            parameters,
+        )
+        return returning.execute(
+            f'SELECT {EXPENSE_COLUMNS} FROM {EXPENSES} WHERE x.id = ?',
+            (returning.lastrowid,),
+        ).fetchall()[0]
+
+    def insert_ledger_entries(
+        self,
+        entries: List[Union[Expense, Debt]],
+    ) -> List[Tuple[int, str]]:
+        """
+        Inserts a chunk of an imported ledger in one transaction, see app/ledger.py
+        Ids of expenses are assigned by database on insert and written to the given objects,
+        a debt without expense_id belongs to the closest expense before it in entries.
+        Normally debts get a single executemany, if the chunk violates a constraint
+        entries are inserted one by one and the failed ones are skipped,
+        together with the debts of a failed expense
+        @return: (index in entries, error message) for every skipped entry
+        """
+        return self._write(self._insert_ledger_entries, entries)
+
+    @classmethod
+    def _insert_ledger_entries(
+        cls,
+        cursor: sqlite3.Cursor,
+        entries: List[Union[Expense, Debt]],
+    ) -> List[Tuple[int, str]]:
+        # index of a debt without expense_id -> expense it belongs to
+        owners: Dict[int, Expense] = {}
+        expense = None
+        for index, entry in enumerate(entries):
+            if isinstance(entry, Expense):
+                expense = entry
+            elif entry.expense_id is None:
+                if expense is None:
+                    raise ValueError('Debt without expense at the beginning of a ledger chunk')
+                owners[index] = expense
+
+        cursor.execute('SAVEPOINT ledger_chunk')
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(
-                'INSERT INTO expenses (name, sum, lender_id, event_token, datetime) VALUES(?, ?, ?, ?, ?)',
-                (expense.name, expense.sum, expense.lender_id, expense.event_token, expense.datetime),
+            for index, entry in enumerate(entries):
+                if isinstance(entry, Expense):
+                    entry.id = cls._insert_ledger_expense(cursor, entry)
+                elif index in owners:
+                    entry.expense_id = owners[index].id
+            cursor.executemany(
+                'INSERT INTO debts (expense_id, lender_id, debtor_id, sum) VALUES(?, ?, ?, ?)',
+                (
+                    (entry.expense_id, entry.lender_id, entry.debtor_id, entry.sum)
+                    for entry in entries if isinstance(entry, Debt)
+                ),
             )
-            self.conn.commit()
-            return cursor.lastrowid
-        except sqlite3.Error as e:
-            self.conn.rollback()
-            raise e
+            failures = []
+        except sqlite3.IntegrityError:
+            cursor.execute('ROLLBACK TO ledger_chunk')
+            failures = cls._insert_ledger_entries_one_by_one(cursor, entries, owners)
+        cursor.execute('RELEASE ledger_chunk')
+        return failures
+
+    @staticmethod
+    def _insert_ledger_expense(
+        cursor: sqlite3.Cursor,
+        expense: Expense,
+    ) -> int:
+        cursor.execute(
+            f'INSERT INTO expenses (name, sum, lender_id, event_id, datetime) VALUES(?, ?, ?, {EVENT_ID}, ?)',
+            (expense.name, expense.sum, expense.lender_id, expense.event_token, expense.datetime),
+        )
+        return cursor.lastrowid
+
+    @classmethod
+    def _insert_ledger_entries_one_by_one(
+        cls,
+        cursor: sqlite3.Cursor,
+        entries: List[Union[Expense, Debt]],
+        owners: Dict[int, Expense],
+    ) -> List[Tuple[int, str]]:
+        failures = []
+        for index, entry in enumerate(entries):
+            if isinstance(entry, Expense):
+                # id assigned by the rolled back attempt
+                entry.id = None
+            elif index in owners:
+                entry.expense_id = owners[index].id
+                if entry.expense_id is None:
+                    failures.append((index, 'expense of the debt was not imported'))
+                    continue
+            cursor.execute('SAVEPOINT ledger_entry')
+            try:
+                if isinstance(entry, Expense):
+                    entry.id = cls._insert_ledger_expense(cursor, entry)
+                else:
+                    cls._insert_debt(cursor, entry)
+            except sqlite3.IntegrityError as e:
+                cursor.execute('ROLLBACK TO ledger_entry')
+                failures.append((index, str(e)))
+            cursor.execute('RELEASE ledger_entry')
+        return failures
 
     def get_expense_info(
         self,
         expense_id: int,
     ) -> Expense:
-        cursor = self.conn.cursor()
-        expense = cursor.execute('SELECT * FROM expenses WHERE id = ?', (expense_id,)).fetchone()
-        return Expense(
-            id=expense[0],
-            name=expense[1],
-            sum=expense[2],
-            lender_id=expense[3],
-            event_token=expense[4],
-            datetime=expense[5],
-        )
+        return self._select_one(f'SELECT {EXPENSE_COLUMNS} FROM {EXPENSES} WHERE x.id = ?', (expense_id,), expense_row)
 
     def get_event_expenses(
         self,
         event_token: str,
-    ) -> List[Expense]:
-        cursor = self.conn.cursor()
-        expenses = cursor.execute('SELECT * FROM expenses WHERE event_token = ?', (event_token,))
-        return [Expense(
-            id=item[0],
-            name=item[1],
-            sum=item[2],
-            lender_id=item[3],
-            event_token=item[4],
-            datetime=item[5],
-        ) for item in expenses.fetchall()]
+    ) -> ExpenseBatch:
+        """
+        @return: expenses of the event as columns, see database/batches.py
+        """
+        expenses = ExpenseBatch()
+        with self._reading() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT {EXPENSE_COLUMNS} FROM {EXPENSES} WHERE ev.token = ?', (event_token,))
+            # rows are fetched in chunks, so a large event is never held as tuples
+            while True:
+                rows = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    return expenses
+                expenses.extend(rows)
 
     def get_debts_by_expenses(
         self,
-        expense_ids: List[int],
-    ) -> List[Debt]:
-        cursor = self.conn.cursor()
-        sql_query = 'SELECT * FROM debts WHERE expense_id in ({seq})'.format(
-            seq=','.join('?' * len(expense_ids))
+        expense_ids: Sequence[int],
+    ) -> DebtBatch:
+        """
+        Ids are passed in chunks of fixed size, so the number of bound parameters
+        never exceeds sqlite limit and the same prepared statement is reused
+        @param expense_ids: e.g. ExpenseBatch.ids
+        @return: debts as columns, see database/batches.py
+        """
+        sql_query = 'SELECT {columns} FROM debts WHERE expense_id in ({seq})'.format(
+            columns=DEBT_COLUMNS,
+            seq=','.join('?' * DEBTS_QUERY_CHUNK_SIZE),
         )
-        return [Debt(
-            expense_id=item[0],
-            lender_id=item[1],
-            debtor_id=item[2],
-            sum=item[3],
-        ) for item in cursor.execute(sql_query, expense_ids).fetchall()]
+        debts = DebtBatch()
+        with self._reading() as conn:
+            cursor = conn.cursor()
+            for start in range(0, len(expense_ids), DEBTS_QUERY_CHUNK_SIZE):
+                chunk = list(expense_ids[start:start + DEBTS_QUERY_CHUNK_SIZE])
+                # NULL never matches, padding keeps the statement text the same
+                chunk += [None] * (DEBTS_QUERY_CHUNK_SIZE - len(chunk))
+                debts.extend(cursor.execute(sql_query, chunk).fetchall())
+        return debts
+
+    def _iter_expense_chunks(
+        self,
+        sql_query: str,
+        event_token: str,
+        chunk_size: int,
+    ) -> Iterator[List[tuple]]:
+        """
+        Yields rows of sql_query for consecutive chunks of chunk_size expenses of the event,
+        the query gets the event token and the bounds of expense ids of the chunk.
+        Every chunk is read in a separate block of _reading, so the connection,
+        and the lock of the shared one, is not held while the caller handles the rows
+        """
+        after = MIN_EXPENSE_ID
+        while True:
+            with self._reading() as conn:
+                last = conn.execute(
+                    'SELECT MAX(id) FROM ('
+                    f'SELECT id FROM expenses WHERE event_id = {EVENT_ID} AND id > ? ORDER BY id LIMIT ?'
+                    ')',
+                    (event_token, after, chunk_size),
+                ).fetchone()[0]
+                if last is None:
+                    return
+                rows = conn.execute(sql_query, (event_token, after, last)).fetchall()
+            after = last
+            yield rows
+
+    def iter_event_debts(
+        self,
+        event_token: str,
+        chunk_size: int = FETCH_SIZE,
+    ) -> Iterator[Debt]:
+        """
+        Yields debts of all expenses of the event, reading chunk_size expenses at a time,
+        so memory usage does not depend on the number of debts.
+        Chunks are separate reads, a write made meanwhile may be seen only in part
+        """
+        for rows in self._iter_expense_chunks(
+            'SELECT e.id, d.lender_id, d.debtor_id, d.sum '
+            'FROM expenses e LEFT JOIN debts d ON d.expense_id = e.id '
+            f'WHERE e.event_id = {EVENT_ID} AND e.id > ? AND e.id <= ? '
+            'ORDER BY e.id',
+            event_token,
+            chunk_size,
+        ):
+            for item in rows:
+                if item[2] is not None:
+                    yield Debt(
+                        expense_id=item[0],
+                        lender_id=item[1],
+                        debtor_id=item[2],
+                        sum=item[3],
+                    )
+
+    def iter_event_ledger(
+        self,
+        event_token: str,
+        chunk_size: int = FETCH_SIZE,
+    ) -> Iterator[Union[Expense, Debt]]:
+        """
+        Yields expenses of the event ordered by id, each one followed by its debts,
+        reading chunk_size expenses at a time, see iter_event_debts for the caveats
+        """
+        for rows in self._iter_expense_chunks(
+            'SELECT e.id, e.name, e.sum, e.lender_id, e.datetime, d.lender_id, d.debtor_id, d.sum '
+            'FROM expenses e LEFT JOIN debts d ON d.expense_id = e.id '
+            f'WHERE e.event_id = {EVENT_ID} AND e.id > ? AND e.id <= ? '
+            'ORDER BY e.id',
+            event_token,
+            chunk_size,
+        ):
+            expense_id = None
+            for item in rows:
+                if item[0] != expense_id:
+                    expense_id = item[0]
+                    yield Expense(
+                        id=item[0],
+                        name=item[1],
+                        sum=item[2],
+                        lender_id=item[3],
+                        event_token=event_token,
+                        datetime=item[4],
+                    )
+                if item[6] is not None:
+                    yield Debt(
+                        expense_id=item[0],
+                        lender_id=item[5],
+                        debtor_id=item[6],
+                        sum=item[7],
+                    )
 
     def get_user_events(
             self,
             user_id: int
     ) -> List[Event]:
-        cursor = self.conn.cursor()
-        events = cursor.execute(
-            'SELECT e.token, e.name '
+        return self._select(
+            f'SELECT {columns(Event, "e")} '
             'FROM events e, user2event ev '
-            'WHERE ev.user_id = ? AND ev.event_token = e.token', (user_id,))
-        return [Event(*item) for item in events.fetchall()]
+            'WHERE ev.user_id = ? AND ev.event_id = e.id',
+            (user_id,),
+            event_row,
+        )
+
+    def get_user_events_page(
+        self,
+        user_id: int,
+        after: Optional[int] = None,
+        limit: int = 20,
+    ) -> List[Event]:
+        """
+        Events of the user ordered by id, keyset pagination
+        @param after: id of the last event of the previous page, None for the first page
+        """
+        return self._select(
+            f'SELECT {columns(Event, "e")} '
+            'FROM user2event ev JOIN events e ON e.id = ev.event_id '
+            'WHERE ev.user_id = ? AND ev.event_id > ? '
+            'ORDER BY ev.event_id LIMIT ?',
+            (user_id, MIN_EVENT_ID if after is None else after, limit),
+            event_row,
+        )
+
+    def get_event_balances(
+        self,
+        event_token: str,
+    ) -> List[Tuple[int, int, int]]:
+        """
+        Reads materialized balances, one row per user who took part in any debt of the event
+        @return: list of (user_id, lent, owed)
+        """
+        return self._select(f'SELECT user_id, lent, owed FROM balances WHERE event_id = {EVENT_ID}', (event_token,))
+
+    def get_event_net_balances(
+        self,
+        event_token: str,
+    ) -> List[Tuple[int, int]]:
+        """
+        Same as compute_event_net_balances, but reads materialized balances
+        Users whose balance is settled are skipped
+        @return: list of (user_id, lent - owed)
+        """
+        return self._select(
+            f'SELECT user_id, lent - owed FROM balances WHERE event_id = {EVENT_ID} AND lent != owed',
+            (event_token,),
+        )
+
+    def compute_event_net_balances(
+        self,
+        event_token: str,
+    ) -> List[Tuple[int, int]]:
+        """
+        Aggregates net balances straight from debts with one GROUP BY query,
+        does not depend on the balances table
+        @return: list of (user_id, lent - owed)
+        """
+        return self._select(
+            'SELECT user_id, SUM(amount) '
+            'FROM ('
+            '    SELECT d.lender_id AS user_id, d.sum AS amount '
+            '    FROM expenses e JOIN debts d ON d.expense_id = e.id '
+            f'    WHERE e.event_id = {EVENT_ID} '
+            '    UNION ALL '
+            '    SELECT d.debtor_id AS user_id, -d.sum AS amount '
+            '    FROM expenses e JOIN debts d ON d.expense_id = e.id '
+            f'    WHERE e.event_id = {EVENT_ID}'
+            ') '
+            'GROUP BY user_id',
+            (event_token, event_token),
+        )
+
+    def rebuild_balances(self) -> int:
+        """
+        Recomputes balances table from debts
+        @return: number of balance rows
+        """
+        return self._write(self._rebuild_balances)
+
+    @staticmethod
+    def _rebuild_balances(
+        cursor: sqlite3.Cursor,
+    ) -> int:
+        cursor.execute('DELETE FROM balances')
+        cursor.execute(
+            'INSERT INTO balances (event_id, user_id, lent, owed) '
+            'SELECT event_id, user_id, SUM(lent), SUM(owed) '
+            'FROM ('
+            '    SELECT e.event_id, d.lender_id AS user_id, d.sum AS lent, 0 AS owed '
+            '    FROM debts d JOIN expenses e ON e.id = d.expense_id '
+            '    UNION ALL '
+            '    SELECT e.event_id, d.debtor_id AS user_id, 0 AS lent, d.sum AS owed '
+            '    FROM debts d JOIN expenses e ON e.id = d.expense_id'
+            ') '
+            'GROUP BY event_id, user_id'
+        )
+        return cursor.rowcount
 
     def __del__(self):
         """
         Closes connection etc.
         """
-        self.conn.close()
+        # __init__ may have failed before assigning them
+        writer = getattr(self, '_writer', None)
+        if writer is not None:
+            writer.close()
+        read_pool = getattr(self, '_read_pool', None)
+        if read_pool is not None:
+            read_pool.close()
+        conn = getattr(self, 'conn', None)
+        if conn is not None:
+            conn.close()
 
     # following methods are for testing purposes only
     # please do not use them in production
     def get_all_users(self) -> List[User]:
-        cursor = self.conn.cursor()
-        result = cursor.execute('SELECT * FROM users').fetchall()
-        return [User(id=item[0], name=item[1]) for item in result]
+        return self._select(f'SELECT {USER_COLUMNS} FROM users', row_factory=user_row)
 
     def get_all_events(self) -> List[Event]:
-        cursor = self.conn.cursor()
-        result = cursor.execute('SELECT * FROM events').fetchall()
-        return [Event(token=item[0], name=item[1]) for item in result]
+        return self._select(f'SELECT {EVENT_COLUMNS} FROM events', row_factory=event_row)
 
     def get_all_user2event(self) -> List[Tuple[int, str]]:
-        cursor = self.conn.cursor()
-        return cursor.execute('SELECT * FROM user2event').fetchall()
+        return self._select('SELECT u2e.user_id, e.token FROM user2event u2e JOIN events e ON e.id = u2e.event_id')
@@ -0,0 +1,309 @@
+import bisect
+import math
+import re
+import threading
+import time
+from typing import Any, Dict, List, NoReturn, Optional
+
+import sqlite3
+
+from database.slow_log import SlowQueryLog
+from metrics.registry import DEFAULT_BUCKETS, REGISTRY, Counter, Histogram, Registry
+
+# sqlite virtual machine instructions between two calls of the progress handler
+PROGRESS_STEPS = 1000
+
+_SPACES = re.compile(r'\s+')
+# IN (?, ?, ?) with a varying number of parameters
+_PARAMETER_LIST = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+
+
+def statement_label(sql: str) -> str:
+    """
+    One label for all executions of a statement: whitespace is collapsed and
+    IN lists of any number of parameters are written as IN (?, ...)
+    """
+    return _PARAMETER_LIST.sub('IN (?, ...)', _SPACES.sub(' ', sql).strip())
+
+
+class _StatementStats:
+    __slots__ = ('counts', 'seconds', 'fetch_seconds', 'steps', 'programs', 'errors')
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * buckets
+        self.seconds = 0.0
+        self.fetch_seconds = 0.0
+        self.steps = 0
+        self.programs = 0
+        self.errors = 0
+
+
+class QueryMetrics:
+    """
+    Per statement counts and durations of every connection opened by connect().
+    execute and executemany of the connection cursors are timed, fetchmany and fetchall
+    are accounted separately, commit and rollback are timed as COMMIT and ROLLBACK.
+    fetchone is not wrapped: the first row is stepped by execute, and the connector
+    reads single rows only.
+    sqlite trace callback counts programs started by every statement, so statements
+    firing triggers stand out, and the progress handler counts virtual machine instructions
+    of every statement, so full scans stand out even when they are fast.
+
+    A connection is used by one thread at a time, so each one accumulates its own
+    statistics without locking; they are summed up when the registry is scraped
+    """
+    def __init__(
+        self,
+        registry: Optional[Registry] = REGISTRY,
+        progress_steps: int = PROGRESS_STEPS,
+        trace_programs: bool = True,
+    ):
+        """
+        @param registry: where the statistics are exposed, None keeps them to collect()
+        @param progress_steps: granularity of instruction counts, 0 disables them
+        @param trace_programs: count programs with the trace callback
+        """
+        self.progress_steps = progress_steps
+        self.trace_programs = trace_programs
+        self.buckets = DEFAULT_BUCKETS
+        # statement -> label, shared by all connections
+        self._labels: Dict[str, str] = {}
+        # statistics of every connection opened so far, statement -> stats
+        self._connections: List[Dict[str, _StatementStats]] = []
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def connect(
+        self,
+        *args,
+        slow_log: Optional[SlowQueryLog] = None,
+        **kwargs,
+    ) -> sqlite3.Connection:
+        """
+        sqlite3.connect opening an instrumented connection
+        @param slow_log: log of statements of the connection slower than its threshold
+        """
+        conn = sqlite3.connect(*args, factory=_InstrumentedConnection, **kwargs)
+        conn.metrics = self
+        conn.slow_log = slow_log
+        conn.stats = {}
+        conn.steps = 0
+        conn.programs = 0
+        conn.slow_threshold = slow_log.threshold if slow_log is not None else math.inf
+        if self.progress_steps:
+            conn.set_progress_handler(conn.count_steps, self.progress_steps)
+        if self.trace_programs:
+            conn.set_trace_callback(conn.count_program)
+        with self._lock:
+            self._connections.append(conn.stats)
+        return conn
+
+    def label(self, sql: str) -> str:
+        return self._labels[sql]
+
+    def new_stats(self, sql: str) -> _StatementStats:
+        with self._lock:
+            if sql not in self._labels:
+                self._labels[sql] = statement_label(sql)
+        return _StatementStats(len(self.buckets) + 1)
+
+    def collect(self) -> List[Any]:
+        seconds = Histogram(
+            'sqlite_statement_seconds',
+            'Time of execute and executemany calls per statement',
+            ['statement'],
+            buckets=self.buckets,
+        )
+        fetch_seconds = Counter(
+            'sqlite_fetch_seconds_total',
+            'Time of fetching rows of a statement after it was executed',
+            ['statement'],
+        )
+        errors = Counter(
+            'sqlite_statement_errors_total',
+            'Statements failed with an sqlite error',
+            ['statement'],
+        )
+        steps = Counter(
+            'sqlite_statement_vm_steps_total',
+            f'Virtual machine instructions per statement, counted by {self.progress_steps}',
+            ['statement'],
+        )
+        programs = Counter(
+            'sqlite_statement_programs_total',
+            'Programs started per statement as reported by sqlite trace: the statement and its triggers',
+            ['statement'],
+        )
+        with self._lock:
+            connections = list(self._connections)
+            labels = dict(self._labels)
+        for connection in connections:
+            for sql, stats in list(connection.items()):
+                label = labels[sql]
+                seconds.merge((label,), stats.counts, stats.seconds)
+                if stats.fetch_seconds:
+                    fetch_seconds.inc(label, amount=stats.fetch_seconds)
+                if stats.errors:
+                    errors.inc(label, amount=stats.errors)
+                if stats.steps:
+                    steps.inc(label, amount=stats.steps * self.progress_steps)
+                if stats.programs:
+                    programs.inc(label, amount=stats.programs)
+        return [seconds, fetch_seconds, errors, steps, programs]
+
+
+class _InstrumentedConnection(sqlite3.Connection):
+    metrics: QueryMetrics
+    stats: Dict[str, _StatementStats]
+    steps: int
+    programs: int
+    slow_log: Optional[SlowQueryLog]
+    slow_threshold: float
+
+    def count_steps(self) -> int:
+        self.steps += 1
+        # 0 lets the statement go on
+        return 0
+
+    def count_program(self, _: str) -> NoReturn:
+        self.programs += 1
+
+    def statement_stats(self, sql: str) -> _StatementStats:
+        stats = self.stats.get(sql)
+        if stats is None:
+            stats = self.stats[sql] = self.metrics.new_stats(sql)
+        return stats
+
+    def slow_statement(
+        self,
+        sql: str,
+        parameters: Any,
+        seconds: float,
+        many: bool = False,
+    ) -> NoReturn:
+        self.slow_log.record(self, self.metrics.label(sql), sql, parameters, seconds, many=many)
+
+    def record(
+        self,
+        stats: _StatementStats,
+        seconds: float,
+        steps: int,
+        programs: int,
+    ) -> NoReturn:
+        stats.counts[bisect.bisect_left(self.metrics.buckets, seconds)] += 1
+        stats.seconds += seconds
+        stats.steps += self.steps - steps
+        stats.programs += self.programs - programs
+
+    def cursor(self, factory=None) -> sqlite3.Cursor:
+        return super().cursor(factory or _TimedCursor)
+
+    def commit(self) -> NoReturn:
+        self._timed('COMMIT', super().commit)
+
+    def rollback(self) -> NoReturn:
+        self._timed('ROLLBACK', super().rollback)
+
+    def _timed(
+        self,
+        sql: str,
+        call,
+    ) -> NoReturn:
+        stats = self.statement_stats(sql)
+        steps, programs = self.steps, self.programs
+        start = time.perf_counter()
+        try:
+            call()
+        except sqlite3.Error:
+            stats.errors += 1
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            self.record(stats, seconds, steps, programs)
+            if seconds >= self.slow_threshold:
+                self.slow_statement(sql, (), seconds)
+
+
+class _TimedCursor(sqlite3.Cursor):
+    """
+    For the slow query log a statement takes the time of its execute and of the fetches
+    of its rows, it is logged once, as soon as it exceeds the threshold
+    """
+    connection: _InstrumentedConnection
+    _stats = None
+    # of the last executed statement
+    _sql = ''
+    _parameters = None
+    _elapsed = 0.0
+    _logged = True
+
+    def execute(self, sql: str, parameters: Any = ()) -> sqlite3.Cursor:
+        return self._timed(_execute, sql, parameters)
+
+    def executemany(self, sql: str, parameters: Any) -> sqlite3.Cursor:
+        if self.connection.slow_threshold != math.inf and not isinstance(parameters, (list, tuple)):
+            # the slow query log needs the rows after they have been consumed
+            parameters = list(parameters)
+        return self._timed(_executemany, sql, parameters, many=True)
+
+    def _timed(
+        self,
+        call,
+        sql: str,
+        parameters: Any,
+        many: bool = False,
+    ) -> sqlite3.Cursor:
+        conn = self.connection
+        stats = conn.stats.get(sql) or conn.statement_stats(sql)
+        self._stats = stats
+        steps, programs = conn.steps, conn.programs
+        start = time.perf_counter()
+        try:
+            return call(self, sql, parameters)
+        except sqlite3.Error:
+            stats.errors += 1
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            stats.counts[bisect.bisect_left(conn.metrics.buckets, seconds)] += 1
+            stats.seconds += seconds
+            stats.steps += conn.steps - steps
+            stats.programs += conn.programs - programs
+            if conn.slow_threshold != math.inf:
+                self._sql, self._parameters, self._elapsed = sql, parameters, seconds
+                self._logged = seconds >= conn.slow_threshold
+                if self._logged:
+                    conn.slow_statement(sql, parameters, seconds, many=many)
+
+    def _fetch(self, call, *args) -> Any:
+        stats = self._stats
+        if stats is None:
+            return call(self, *args)
+        conn = self.connection
+        steps = conn.steps
+        start = time.perf_counter()
+        try:
+            return call(self, *args)
+        finally:
+            seconds = time.perf_counter() - start
+            stats.fetch_seconds += seconds
+            stats.steps += conn.steps - steps
+            if not self._logged:
+                self._elapsed += seconds
+                if self._elapsed >= conn.slow_threshold:
+                    self._logged = True
+                    conn.slow_statement(self._sql, self._parameters, self._elapsed)
+
+    def fetchmany(self, *args) -> list:
+        return self._fetch(_fetchmany, *args)
+
+    def fetchall(self) -> list:
+        return self._fetch(_fetchall)
+
+
+# unbound methods of the base class, cheaper to call than through super()
+_execute = sqlite3.Cursor.execute
+_executemany = sqlite3.Cursor.executemany
+_fetchmany = sqlite3.Cursor.fetchmany
+_fetchall = sqlite3.Cursor.fetchall
@@ -0,0 +1,72 @@
+import re
+from pathlib import Path
+from typing import List, Tuple
+
+import sqlite3
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.joinpath('sql/migrations')
+_MIGRATION_NAME = re.compile(r'^(\d+)_\w+\.sql$')
+
+
+def get_migrations() -> List[Tuple[int, Path]]:
+    """
+    @return: list of (version, path) sorted by version
+    Migration file names look like 0001_some_description.sql,
+    version numbers must start with 1 and have no gaps
+    """
+    migrations = []
+    for path in MIGRATIONS_DIR.iterdir():
+        match = _MIGRATION_NAME.match(path.name)
+        if match:
+            migrations.append((int(match.group(1)), path))
+    migrations.sort()
+
+    versions = [version for version, _ in migrations]
+    if versions != list(range(1, len(versions) + 1)):
+        raise RuntimeError(f'Migration versions must be 1..N without gaps, got {versions}')
+    return migrations
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def apply_migrations(conn: sqlite3.Connection) -> int:
+    """
+    Applies every migration newer than PRAGMA user_version.
+    Each migration runs in its own transaction together with the user_version bump,
+    so a failed migration leaves the database at the previous version
+    Foreign keys are not enforced while migrating, so that a referenced table can be rebuilt,
+    instead every migration is checked with foreign_key_check before it is committed
+    @return: schema version after migrating
+    """
+    version = get_schema_version(conn)
+    foreign_keys = conn.execute('PRAGMA foreign_keys').fetchone()[0]
+    # the pragma is a no-op inside a transaction
+    conn.commit()
+    conn.execute('PRAGMA foreign_keys=off')
+    try:
+        for migration_version, path in get_migrations():
+            if migration_version <= version:
+                continue
+            with open(path, 'r') as file:
+                script = file.read()
+            try:
+                conn.executescript(
+                    'BEGIN IMMEDIATE;\n'
+                    f'{script}\n'
+                    f'PRAGMA user_version = {migration_version};\n'
+                )
+                violations = conn.execute('PRAGMA foreign_key_check').fetchall()
+                if violations:
+                    raise sqlite3.IntegrityError(
+                        f'Migration {path.name} violates foreign keys: (table, rowid, parent, fkid) {violations[:10]}'
+                    )
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                raise e
+            version = migration_version
+    finally:
+        conn.execute(f'PRAGMA foreign_keys={foreign_keys}')
+    return version
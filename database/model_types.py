@@ -1,22 +1,61 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
+from typing import Optional
 import datetime as dt
 
-# see create_tables.sql for type info
+# see sql/migrations for type info
 
 
-@dataclass
+def slotted(
+    cls: Optional[type] = None,
+    frozen: bool = False,
+):
+    """
+    dataclass with __slots__ instead of a per-instance __dict__,
+    same as dataclass(slots=True) of python 3.10 but works on 3.8 too
+    Frozen models are hashable and can be shared between threads and caches
+    """
+    def wrap(cls: type) -> type:
+        cls = dataclass(cls, frozen=frozen)
+        namespace = dict(cls.__dict__)
+        names = tuple(field.name for field in fields(cls))
+        # defaults live in the generated __init__, class attributes would conflict with slots
+        for name in names:
+            namespace.pop(name, None)
+        namespace.pop('__dict__', None)
+        namespace.pop('__weakref__', None)
+        namespace['__slots__'] = names
+        if frozen:
+            # default pickling restores slots with setattr, which is forbidden for frozen instances
+            def __getstate__(self) -> tuple:
+                return tuple(getattr(self, name) for name in names)
+
+            def __setstate__(self, state: tuple):
+                for name, value in zip(names, state):
+                    object.__setattr__(self, name, value)
+
+            namespace['__getstate__'] = __getstate__
+            namespace['__setstate__'] = __setstate__
+        slotted_cls = type(cls)(cls.__name__, cls.__bases__, namespace)
+        slotted_cls.__qualname__ = cls.__qualname__
+        return slotted_cls
+
+    return wrap if cls is None else wrap(cls)
+
+
+@slotted(frozen=True)
 class User:
     id:   int = None
     name: str = None
 
 
-@dataclass
+@slotted(frozen=True)
 class Event:
-    token: str = None
+    token: str = None  # join code
     name:  str = None
+    id:    int = None
 
 
-@dataclass
+@slotted
 class Expense:
     id:          int = None
     name:        str = None
@@ -26,7 +65,7 @@ class Expense:
     datetime:    dt.datetime = None
 
 
-@dataclass
+@slotted
 class Debt:
     expense_id: int = None
     lender_id:  int = None
@@ -0,0 +1,81 @@
+import queue
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, List, NoReturn
+
+import sqlite3
+
+
+class ReadConnectionPool:
+    """
+    Bounded pool of read-only connections.
+    A connection is used by one thread at a time: it is taken from the pool
+    for the duration of a read and returned afterwards.
+    Connections are opened lazily, when all opened ones are busy
+    and the pool is not full yet; otherwise the reader waits
+    """
+    def __init__(
+        self,
+        db_name: str,
+        size: int,
+        busy_timeout: float = 5.0,
+        connect: Callable[..., sqlite3.Connection] = sqlite3.connect,
+        cached_statements: int = 128,
+    ):
+        """
+        @param connect: opens a connection, sqlite3.connect or an instrumented replacement
+        @param cached_statements: size of the prepared statement cache of every connection
+        """
+        if size < 1:
+            raise ValueError(f'Pool size must be positive, got {size}')
+        if db_name == ':memory:':
+            raise ValueError('Read pool can not be used with in-memory database')
+        self._uri = Path(db_name).resolve().as_uri() + '?mode=ro'
+        self._busy_timeout = busy_timeout
+        self._connect = connect
+        self._cached_statements = cached_statements
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._opened: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        return self._connect(
+            self._uri,
+            uri=True,
+            timeout=self._busy_timeout,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=self._cached_statements,
+        )
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._opened) < self.size:
+                conn = self._open()
+                self._opened.append(conn)
+                return conn
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    @property
+    def opened(self) -> int:
+        return len(self._opened)
+
+    def close(self) -> NoReturn:
+        with self._lock:
+            for conn in self._opened:
+                conn.close()
+            self._opened = []
@@ -0,0 +1,58 @@
+"""
+Column lists and row factories of the models.
+Columns of a model are its dataclass fields in order, so a cursor with a model row factory
+builds models straight from the selected rows. Expenses store event_id,
+their event_token is joined from events, see EXPENSES
+"""
+from dataclasses import fields
+from typing import Any, Callable, Optional, Type
+
+import sqlite3
+
+from database.model_types import (
+    User,
+    Event,
+    Expense,
+    Debt,
+)
+
+RowFactory = Callable[[sqlite3.Cursor, tuple], Any]
+
+# INSERT ... RETURNING appeared in sqlite 3.35
+RETURNING_SUPPORTED = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+def columns(
+    model: Type,
+    alias: Optional[str] = None,
+) -> str:
+    """
+    @return: column list of the model for SELECT, e.g. 'u.id, u.name' for User and alias 'u'
+    """
+    prefix = f'{alias}.' if alias else ''
+    return ', '.join(prefix + field.name for field in fields(model))
+
+
+def model_row(model: Type) -> RowFactory:
+    def factory(_: sqlite3.Cursor, row: tuple) -> Any:
+        return model(*row)
+
+    factory.__name__ = f'{model.__name__.lower()}_row'
+    return factory
+
+
+def first_column(_: sqlite3.Cursor, row: tuple) -> Any:
+    return row[0]
+
+
+USER_COLUMNS = columns(User)
+EVENT_COLUMNS = columns(Event)
+# select EXPENSE_COLUMNS FROM EXPENSES
+EXPENSE_COLUMNS = 'x.id, x.name, x.sum, x.lender_id, ev.token, x.datetime'
+EXPENSES = 'expenses x JOIN events ev ON ev.id = x.event_id'
+DEBT_COLUMNS = columns(Debt)
+
+user_row = model_row(User)
+event_row = model_row(Event)
+expense_row = model_row(Expense)
+debt_row = model_row(Debt)
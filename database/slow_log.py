@@ -0,0 +1,128 @@
+import json
+import logging
+import sys
+import threading
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, List, NoReturn, Optional, Set
+
+import sqlite3
+
+# module whose methods are reported as the caller of a slow statement
+CALLER_MODULE = 'app.splitwise'
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+
+
+def parameters_shape(parameters: Any) -> Any:
+    """
+    Types of bound parameters, values are not logged:
+    ['int', 'str'] for positional ones, {'name': 'str'} for named ones
+    """
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def query_plan(
+    conn: sqlite3.Connection,
+    sql: str,
+    parameters: Any,
+) -> List[str]:
+    """
+    EXPLAIN QUERY PLAN of the statement as indented lines, like the sqlite shell prints it
+    """
+    rows = conn.cursor(sqlite3.Cursor).execute(f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node_id] + detail)
+    return lines
+
+
+def calling_method(module: str = CALLER_MODULE) -> Optional[str]:
+    """
+    Outermost method of module on the stack of the current thread,
+    None if the statement was not executed on behalf of it, e.g. by the group commit writer
+    """
+    caller = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_globals.get('__name__') == module:
+            owner = frame.f_locals.get('self')
+            name = frame.f_code.co_name
+            caller = f'{type(owner).__name__}.{name}' if owner is not None else name
+        frame = frame.f_back
+    return caller
+
+
+class SlowQueryLog:
+    """
+    JSONL log of statements running longer than threshold seconds, rotated at max_bytes.
+    An entry has the statement, the types of its parameters and the calling SplitwiseApp method;
+    the first entry of every statement also has its query plan
+    """
+    def __init__(
+        self,
+        path: str,
+        threshold: float = 0.1,
+        max_bytes: int = MAX_BYTES,
+        backup_count: int = BACKUP_COUNT,
+    ):
+        self.path = path
+        self.threshold = threshold
+        self._handler = RotatingFileHandler(
+            path,
+            maxBytes=max_bytes,
+            backupCount=backup_count,
+            encoding='utf-8',
+            delay=True,
+        )
+        self._handler.setFormatter(logging.Formatter('%(message)s'))
+        # statements whose plan has been logged
+        self._explained: Set[str] = set()
+        self._lock = threading.Lock()
+        self.entries = 0
+
+    def record(
+        self,
+        conn: sqlite3.Connection,
+        statement: str,
+        sql: str,
+        parameters: Any,
+        seconds: float,
+        many: bool = False,
+    ) -> NoReturn:
+        """
+        @param statement: label of the statement, see statement_label
+        @param many: parameters are a sequence of rows passed to executemany
+        """
+        entry: Dict[str, Any] = {
+            'time': datetime.now().isoformat(timespec='milliseconds'),
+            'seconds': round(seconds, 6),
+            'statement': statement,
+            'caller': calling_method(),
+        }
+        rows = parameters if isinstance(parameters, (list, tuple)) else None
+        if many:
+            entry['rows'] = len(rows) if rows is not None else None
+            parameters = rows[0] if rows else None
+        entry['parameters'] = parameters_shape(parameters) if parameters is not None else None
+
+        with self._lock:
+            explain = statement not in self._explained
+            self._explained.add(statement)
+        if explain:
+            try:
+                entry['plan'] = query_plan(conn, sql, parameters if parameters is not None else ())
+            except sqlite3.Error as e:
+                entry['plan_error'] = str(e)
+
+        self._handler.handle(logging.makeLogRecord({'msg': json.dumps(entry, ensure_ascii=False)}))
+        self.entries += 1
+
+    def close(self) -> NoReturn:
+        self._handler.close()
@@ -1,5 +1,3 @@
-PRAGMA foreign_keys=on;
-
 CREATE TABLE IF NOT EXISTS users (
     id   INTEGER PRIMARY KEY,
     name VARCHAR
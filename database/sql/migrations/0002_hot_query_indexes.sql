@@ -0,0 +1,25 @@
+-- user2event gets a composite primary key and is stored WITHOUT ROWID,
+-- so membership checks and "events of user" lookups are served by the table itself
+CREATE TABLE user2event_new (
+    user_id     INTEGER NOT NULL,
+    event_token VARCHAR NOT NULL,
+
+    PRIMARY KEY (user_id, event_token),
+    FOREIGN KEY (user_id)     REFERENCES users(id),
+    FOREIGN KEY (event_token) REFERENCES events(token)
+) WITHOUT ROWID;
+
+INSERT OR IGNORE INTO user2event_new (user_id, event_token)
+SELECT user_id, event_token FROM user2event;
+
+DROP TABLE user2event;
+ALTER TABLE user2event_new RENAME TO user2event;
+
+-- users of event
+CREATE INDEX idx_user2event_event_token ON user2event (event_token, user_id);
+
+-- expenses of event
+CREATE INDEX idx_expenses_event_token ON expenses (event_token, id);
+
+-- debts of expense, covering so that balances are computed from the index only
+CREATE INDEX idx_debts_expense_id ON debts (expense_id, lender_id, debtor_id, sum);
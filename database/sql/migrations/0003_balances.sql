@@ -0,0 +1,64 @@
+-- per-event balance of every user, maintained by triggers on debts
+-- in the same transaction as the debt write itself
+CREATE TABLE balances (
+    event_token VARCHAR NOT NULL,
+    user_id     INTEGER NOT NULL,
+    lent        INTEGER NOT NULL DEFAULT 0,
+    owed        INTEGER NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (event_token, user_id),
+    FOREIGN KEY (event_token) REFERENCES events(token),
+    FOREIGN KEY (user_id)     REFERENCES users(id)
+) WITHOUT ROWID;
+
+INSERT INTO balances (event_token, user_id, lent, owed)
+SELECT event_token, user_id, SUM(lent), SUM(owed)
+FROM (
+    SELECT e.event_token, d.lender_id AS user_id, d.sum AS lent, 0 AS owed
+    FROM debts d JOIN expenses e ON e.id = d.expense_id
+    UNION ALL
+    SELECT e.event_token, d.debtor_id AS user_id, 0 AS lent, d.sum AS owed
+    FROM debts d JOIN expenses e ON e.id = d.expense_id
+)
+GROUP BY event_token, user_id;
+
+CREATE TRIGGER debts_insert_balances AFTER INSERT ON debts
+BEGIN
+    INSERT INTO balances (event_token, user_id, lent, owed)
+    SELECT event_token, NEW.lender_id, NEW.sum, 0 FROM expenses WHERE id = NEW.expense_id
+    ON CONFLICT (event_token, user_id) DO UPDATE SET lent = lent + excluded.lent;
+
+    INSERT INTO balances (event_token, user_id, lent, owed)
+    SELECT event_token, NEW.debtor_id, 0, NEW.sum FROM expenses WHERE id = NEW.expense_id
+    ON CONFLICT (event_token, user_id) DO UPDATE SET owed = owed + excluded.owed;
+END;
+
+CREATE TRIGGER debts_delete_balances AFTER DELETE ON debts
+BEGIN
+    UPDATE balances SET lent = lent - OLD.sum
+    WHERE user_id = OLD.lender_id
+      AND event_token = (SELECT event_token FROM expenses WHERE id = OLD.expense_id);
+
+    UPDATE balances SET owed = owed - OLD.sum
+    WHERE user_id = OLD.debtor_id
+      AND event_token = (SELECT event_token FROM expenses WHERE id = OLD.expense_id);
+END;
+
+CREATE TRIGGER debts_update_balances AFTER UPDATE OF expense_id, lender_id, debtor_id, sum ON debts
+BEGIN
+    UPDATE balances SET lent = lent - OLD.sum
+    WHERE user_id = OLD.lender_id
+      AND event_token = (SELECT event_token FROM expenses WHERE id = OLD.expense_id);
+
+    UPDATE balances SET owed = owed - OLD.sum
+    WHERE user_id = OLD.debtor_id
+      AND event_token = (SELECT event_token FROM expenses WHERE id = OLD.expense_id);
+
+    INSERT INTO balances (event_token, user_id, lent, owed)
+    SELECT event_token, NEW.lender_id, NEW.sum, 0 FROM expenses WHERE id = NEW.expense_id
+    ON CONFLICT (event_token, user_id) DO UPDATE SET lent = lent + excluded.lent;
+
+    INSERT INTO balances (event_token, user_id, lent, owed)
+    SELECT event_token, NEW.debtor_id, 0, NEW.sum FROM expenses WHERE id = NEW.expense_id
+    ON CONFLICT (event_token, user_id) DO UPDATE SET owed = owed + excluded.owed;
+END;
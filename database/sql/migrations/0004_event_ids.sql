@@ -0,0 +1,118 @@
+-- events get an integer primary key, the token stays as a unique join code users share.
+-- Tables referencing events store event_id instead of the token,
+-- which shrinks their rows and indexes and turns joins on events into integer lookups.
+-- Tables are rebuilt in the create-copy-drop-rename way, see migrations.apply_migrations;
+-- LEFT JOIN makes a row with a dangling token fail on NOT NULL instead of being dropped
+CREATE TABLE events_new (
+    id    INTEGER PRIMARY KEY,
+    token VARCHAR NOT NULL UNIQUE,
+    name  VARCHAR NOT NULL UNIQUE
+);
+
+INSERT INTO events_new (token, name)
+SELECT token, name FROM events ORDER BY rowid;
+
+CREATE TABLE user2event_new (
+    user_id  INTEGER NOT NULL,
+    event_id INTEGER NOT NULL,
+
+    PRIMARY KEY (user_id, event_id),
+    FOREIGN KEY (user_id)  REFERENCES users(id),
+    FOREIGN KEY (event_id) REFERENCES events(id)
+) WITHOUT ROWID;
+
+INSERT INTO user2event_new (user_id, event_id)
+SELECT u2e.user_id, e.id
+FROM user2event u2e LEFT JOIN events_new e ON e.token = u2e.event_token;
+
+CREATE TABLE expenses_new (
+    id        INTEGER PRIMARY KEY,
+    name      VARCHAR NOT NULL,
+    sum       INTEGER NOT NULL,
+    lender_id INTEGER NOT NULL,
+    event_id  INTEGER NOT NULL,
+    datetime  DATETIME NOT NULL,
+
+    FOREIGN KEY (lender_id) REFERENCES users(id),
+    FOREIGN KEY (event_id)  REFERENCES events(id)
+);
+
+INSERT INTO expenses_new (id, name, sum, lender_id, event_id, datetime)
+SELECT x.id, x.name, x.sum, x.lender_id, e.id, x.datetime
+FROM expenses x LEFT JOIN events_new e ON e.token = x.event_token;
+
+CREATE TABLE balances_new (
+    event_id INTEGER NOT NULL,
+    user_id  INTEGER NOT NULL,
+    lent     INTEGER NOT NULL DEFAULT 0,
+    owed     INTEGER NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (event_id, user_id),
+    FOREIGN KEY (event_id) REFERENCES events(id),
+    FOREIGN KEY (user_id)  REFERENCES users(id)
+) WITHOUT ROWID;
+
+INSERT INTO balances_new (event_id, user_id, lent, owed)
+SELECT e.id, b.user_id, b.lent, b.owed
+FROM balances b LEFT JOIN events_new e ON e.token = b.event_token;
+
+DROP TRIGGER debts_insert_balances;
+DROP TRIGGER debts_delete_balances;
+DROP TRIGGER debts_update_balances;
+
+DROP TABLE balances;
+DROP TABLE user2event;
+DROP TABLE expenses;
+DROP TABLE events;
+
+ALTER TABLE events_new RENAME TO events;
+ALTER TABLE user2event_new RENAME TO user2event;
+ALTER TABLE expenses_new RENAME TO expenses;
+ALTER TABLE balances_new RENAME TO balances;
+
+-- users of event
+CREATE INDEX idx_user2event_event_id ON user2event (event_id, user_id);
+
+-- expenses of event
+CREATE INDEX idx_expenses_event_id ON expenses (event_id, id);
+
+CREATE TRIGGER debts_insert_balances AFTER INSERT ON debts
+BEGIN
+    INSERT INTO balances (event_id, user_id, lent, owed)
+    SELECT event_id, NEW.lender_id, NEW.sum, 0 FROM expenses WHERE id = NEW.expense_id
+    ON CONFLICT (event_id, user_id) DO UPDATE SET lent = lent + excluded.lent;
+
+    INSERT INTO balances (event_id, user_id, lent, owed)
+    SELECT event_id, NEW.debtor_id, 0, NEW.sum FROM expenses WHERE id = NEW.expense_id
+    ON CONFLICT (event_id, user_id) DO UPDATE SET owed = owed + excluded.owed;
+END;
+
+CREATE TRIGGER debts_delete_balances AFTER DELETE ON debts
+BEGIN
+    UPDATE balances SET lent = lent - OLD.sum
+    WHERE user_id = OLD.lender_id
+      AND event_id = (SELECT event_id FROM expenses WHERE id = OLD.expense_id);
+
+    UPDATE balances SET owed = owed - OLD.sum
+    WHERE user_id = OLD.debtor_id
+      AND event_id = (SELECT event_id FROM expenses WHERE id = OLD.expense_id);
+END;
+
+CREATE TRIGGER debts_update_balances AFTER UPDATE OF expense_id, lender_id, debtor_id, sum ON debts
+BEGIN
+    UPDATE balances SET lent = lent - OLD.sum
+    WHERE user_id = OLD.lender_id
+      AND event_id = (SELECT event_id FROM expenses WHERE id = OLD.expense_id);
+
+    UPDATE balances SET owed = owed - OLD.sum
+    WHERE user_id = OLD.debtor_id
+      AND event_id = (SELECT event_id FROM expenses WHERE id = OLD.expense_id);
+
+    INSERT INTO balances (event_id, user_id, lent, owed)
+    SELECT event_id, NEW.lender_id, NEW.sum, 0 FROM expenses WHERE id = NEW.expense_id
+    ON CONFLICT (event_id, user_id) DO UPDATE SET lent = lent + excluded.lent;
+
+    INSERT INTO balances (event_id, user_id, lent, owed)
+    SELECT event_id, NEW.debtor_id, 0, NEW.sum FROM expenses WHERE id = NEW.expense_id
+    ON CONFLICT (event_id, user_id) DO UPDATE SET owed = owed + excluded.owed;
+END;
@@ -0,0 +1,48 @@
+-- versions of an event kept by triggers, so that every process sees writes of the others:
+-- version changes whenever an expense or a debt of the event is written,
+-- roster_version whenever a user joins or leaves the event
+ALTER TABLE events ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE events ADD COLUMN roster_version INTEGER NOT NULL DEFAULT 0;
+
+CREATE TRIGGER expenses_insert_version AFTER INSERT ON expenses
+BEGIN
+    UPDATE events SET version = version + 1 WHERE id = NEW.event_id;
+END;
+
+CREATE TRIGGER expenses_delete_version AFTER DELETE ON expenses
+BEGIN
+    UPDATE events SET version = version + 1 WHERE id = OLD.event_id;
+END;
+
+CREATE TRIGGER expenses_update_version AFTER UPDATE ON expenses
+BEGIN
+    UPDATE events SET version = version + 1 WHERE id IN (OLD.event_id, NEW.event_id);
+END;
+
+CREATE TRIGGER debts_insert_version AFTER INSERT ON debts
+BEGIN
+    UPDATE events SET version = version + 1
+    WHERE id = (SELECT event_id FROM expenses WHERE id = NEW.expense_id);
+END;
+
+CREATE TRIGGER debts_delete_version AFTER DELETE ON debts
+BEGIN
+    UPDATE events SET version = version + 1
+    WHERE id = (SELECT event_id FROM expenses WHERE id = OLD.expense_id);
+END;
+
+CREATE TRIGGER debts_update_version AFTER UPDATE ON debts
+BEGIN
+    UPDATE events SET version = version + 1
+    WHERE id IN (SELECT event_id FROM expenses WHERE id IN (OLD.expense_id, NEW.expense_id));
+END;
+
+CREATE TRIGGER user2event_insert_version AFTER INSERT ON user2event
+BEGIN
+    UPDATE events SET roster_version = roster_version + 1 WHERE id = NEW.event_id;
+END;
+
+CREATE TRIGGER user2event_delete_version AFTER DELETE ON user2event
+BEGIN
+    UPDATE events SET roster_version = roster_version + 1 WHERE id = OLD.event_id;
+END;
@@ -0,0 +1,23 @@
+-- balances of the debts of an expense follow the expense when it is moved to another event.
+-- lender_id of an expense is not a part of balances, they take the lender of every debt
+CREATE TRIGGER expenses_update_balances AFTER UPDATE OF event_id ON expenses
+WHEN OLD.event_id IS NOT NEW.event_id
+BEGIN
+    UPDATE balances
+    SET lent = lent - (SELECT SUM(sum) FROM debts WHERE expense_id = NEW.id AND lender_id = balances.user_id)
+    WHERE event_id = OLD.event_id
+      AND user_id IN (SELECT lender_id FROM debts WHERE expense_id = NEW.id);
+
+    UPDATE balances
+    SET owed = owed - (SELECT SUM(sum) FROM debts WHERE expense_id = NEW.id AND debtor_id = balances.user_id)
+    WHERE event_id = OLD.event_id
+      AND user_id IN (SELECT debtor_id FROM debts WHERE expense_id = NEW.id);
+
+    INSERT INTO balances (event_id, user_id, lent, owed)
+    SELECT NEW.event_id, lender_id, SUM(sum), 0 FROM debts WHERE expense_id = NEW.id GROUP BY lender_id
+    ON CONFLICT (event_id, user_id) DO UPDATE SET lent = lent + excluded.lent;
+
+    INSERT INTO balances (event_id, user_id, lent, owed)
+    SELECT NEW.event_id, debtor_id, 0, SUM(sum) FROM debts WHERE expense_id = NEW.id GROUP BY debtor_id
+    ON CONFLICT (event_id, user_id) DO UPDATE SET owed = owed + excluded.owed;
+END;
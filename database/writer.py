@@ -0,0 +1,154 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, NoReturn, Tuple
+
+import sqlite3
+
+log = logging.getLogger(__name__)
+
+WriteOperation = Callable[[sqlite3.Cursor], Any]
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    """
+    Dedicated thread that owns all writes to the database.
+    Write operations are taken from a queue and everything that has arrived
+    (up to max_batch_size, waiting at most max_delay seconds for more)
+    is executed in one transaction, so the whole batch pays for a single commit.
+    Every operation runs inside its own savepoint: a failed operation is rolled back
+    and reported through its future without affecting the rest of the batch
+    """
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        lock: threading.RLock,
+        max_batch_size: int = 64,
+        max_delay: float = 0.0,
+    ):
+        """
+        @param conn: connection used only by the writer thread while it holds the lock
+        @param lock: lock shared with other users of conn
+        """
+        if max_batch_size < 1:
+            raise ValueError(f'Batch size must be positive, got {max_batch_size}')
+        self.conn = conn
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._lock = lock
+        self._queue = queue.Queue()
+        # guards _closed together with putting to _queue, nothing is queued after _STOP
+        self._state_lock = threading.Lock()
+        self._closed = False
+        self.batches = 0
+        self.operations = 0
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+
+    def submit(
+        self,
+        operation: WriteOperation,
+    ) -> Future:
+        """
+        @param operation: function executing statements with the given cursor, must not commit
+        @return: future resolving to the value returned by operation
+        """
+        future = Future()
+        with self._state_lock:
+            if self._closed:
+                raise RuntimeError('Writer is closed')
+            self._queue.put((operation, future))
+        return future
+
+    def close(self) -> NoReturn:
+        """
+        Executes already submitted operations and stops the thread,
+        operations the thread did not take, e.g. because it died, fail
+        """
+        with self._state_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP:
+                _, future = item
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(RuntimeError('Writer is closed'))
+
+    def _collect_batch(
+        self,
+        first: Tuple[WriteOperation, Future],
+    ) -> Tuple[List[Tuple[WriteOperation, Future]], bool]:
+        """
+        @return: (batch, stop requested)
+        """
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self) -> NoReturn:
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch, stop = self._collect_batch(item)
+            self._commit(batch)
+
+    def _commit(
+        self,
+        batch: List[Tuple[WriteOperation, Future]],
+    ) -> NoReturn:
+        outcomes = []
+        with self._lock:
+            try:
+                cursor = self.conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                for operation, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    cursor.execute('SAVEPOINT write_operation')
+                    try:
+                        result = operation(cursor)
+                    except Exception as e:
+                        cursor.execute('ROLLBACK TO write_operation')
+                        outcomes.append((future, None, e))
+                    else:
+                        outcomes.append((future, result, None))
+                    cursor.execute('RELEASE write_operation')
+                self.conn.commit()
+            except sqlite3.Error as e:
+                log.exception('Group commit of %d operations failed', len(batch))
+                self.conn.rollback()
+                for _, future in batch:
+                    if not future.done():
+                        if future.running() or future.set_running_or_notify_cancel():
+                            future.set_exception(e)
+                return
+
+        self.batches += 1
+        self.operations += len(outcomes)
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
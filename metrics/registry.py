@@ -0,0 +1,246 @@
+import bisect
+import math
+import threading
+from typing import Dict, Iterable, List, NoReturn, Optional, Protocol, Sequence, Tuple
+
+# seconds, from a cached read to a slow fsync
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(
+    names: Sequence[str],
+    values: LabelValues,
+    extra: Optional[Tuple[str, str]] = None,
+) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    type_name = ''
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _check(self, label_values: LabelValues) -> NoReturn:
+        if len(label_values) != len(self.labels):
+            raise ValueError(f'{self.name} expects labels {self.labels}, got {label_values}')
+
+    def render(self) -> List[str]:
+        return [
+            f'# HELP {self.name} {_escape(self.documentation)}',
+            f'# TYPE {self.name} {self.type_name}',
+        ] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(
+        self,
+        *label_values: str,
+        amount: float = 1,
+    ) -> NoReturn:
+        with self._lock:
+            value = self._values.get(label_values)
+            if value is None:
+                self._check(label_values)
+                value = 0
+            self._values[label_values] = value + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}' for labels, value in values]
+
+
+class Histogram(_Metric):
+    """
+    Cumulative histogram in Prometheus terms, observations are counted in the first bucket
+    with upper bound not less than the value, cumulative sums are computed on render
+    """
+    type_name = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket with +Inf last, sum]
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(
+        self,
+        value: float,
+        *label_values: str,
+    ) -> NoReturn:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                self._check(label_values)
+                state = self._values[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+            state[0][index] += 1
+            state[1][0] += value
+
+    def merge(
+        self,
+        label_values: LabelValues,
+        counts: Sequence[int],
+        total: float,
+    ) -> NoReturn:
+        """
+        Adds observations counted elsewhere
+        @param counts: count per bucket as in bucket_index, +Inf last
+        """
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                self._check(label_values)
+                state = self._values[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+            for index, count in enumerate(counts):
+                state[0][index] += count
+            state[1][0] += total
+
+    def bucket_index(self, value: float) -> int:
+        return bisect.bisect_left(self.buckets, value)
+
+    def count(self, *label_values: str) -> int:
+        state = self._values.get(label_values)
+        return sum(state[0]) if state else 0
+
+    def sum(self, *label_values: str) -> float:
+        state = self._values.get(label_values)
+        return state[1][0] if state else 0.0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((labels, (list(counts), total[0])) for labels, (counts, total) in self._values.items())
+        lines = []
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.labels, labels, ('le', _format_value(bound)))
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, labels)} {cumulative}')
+        return lines
+
+
+class Collector(Protocol):
+    def collect(self) -> Iterable[_Metric]:
+        """
+        Metrics built at scrape time
+        """
+
+
+class Registry:
+    """
+    Named metrics of a process, rendered in Prometheus text exposition format.
+    Asking for a metric that already exists returns it, so modules may declare
+    the metrics they use without coordinating
+    """
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Collector] = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(
+        self,
+        cls: type,
+        name: str,
+        *args,
+        **kwargs,
+    ) -> _Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f'Metric {name} is already registered as {metric.type_name}')
+            return metric
+
+    def counter(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+    ) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labels)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labels, buckets=buckets)
+
+    def register(self, collector: Collector) -> NoReturn:
+        """
+        For metrics that are cheaper to aggregate on scrape than to keep in the registry
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def collect(self) -> List[_Metric]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for collector in collectors:
+            metrics.extend(collector.collect())
+        return sorted(metrics, key=lambda metric: metric.name)
+
+    def render(self) -> str:
+        metrics = self.collect()
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
@@ -0,0 +1,63 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NoReturn, Tuple
+
+from metrics.registry import REGISTRY, Registry
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    server: '_MetricsHTTPServer'
+
+    def do_GET(self):
+        metrics_server = self.server.metrics_server
+        if self.path.partition('?')[0] != metrics_server.path:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = metrics_server.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _MetricsHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    metrics_server: 'MetricsServer'
+
+
+class MetricsServer:
+    """
+    Embedded HTTP server exposing a registry to Prometheus scrapes.
+    Listens on localhost by default, metrics are not meant to be public
+    """
+    def __init__(
+        self,
+        registry: Registry = REGISTRY,
+        listen: str = '127.0.0.1',
+        port: int = 9100,
+        path: str = '/metrics',
+    ):
+        self.registry = registry
+        self.path = path
+        self._httpd = _MetricsHTTPServer((listen, port), _MetricsRequestHandler)
+        self._httpd.metrics_server = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='metrics', daemon=True)
+
+    @property
+    def server_address(self) -> Tuple[str, int]:
+        return self._httpd.server_address[:2]
+
+    def start(self) -> NoReturn:
+        self._thread.start()
+
+    def stop(self) -> NoReturn:
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -1,7 +1,15 @@
+import gzip
+import json
+
 import pytest
 import sqlite3
 
-from app.splitwise import SplitwiseApp
+from app import ledger
+from app.splitwise import JOIN_CODE_LENGTH, SplitwiseApp
+from benchmarks import suite as benchmark_suite
+from benchmarks.workload import SCALES, populate
+from database.connector import Connector
+from database.config import StorageConfig
 from database.model_types import (
     User,
     Event,
@@ -16,9 +24,9 @@ USERS = [
 ]
 
 EVENTS = [
-    Event(token='token1', name='Pilsener'),
-    Event(token='token2', name='Smoking'),
-    Event(token='token3', name='Yachts'),
+    Event(token='token1', name='Pilsener', id=1),
+    Event(token='token2', name='Smoking', id=2),
+    Event(token='token3', name='Yachts', id=3),
 ]
 
 
@@ -27,9 +35,16 @@ def db_name(tmpdir):
     return str(tmpdir / 'db.sqlite')
 
 
-@pytest.fixture(scope='function')
-def app(db_name):
-    return SplitwiseApp(db_name)
+STORAGE_CONFIGS = {
+    'default': StorageConfig(),
+    'wal': StorageConfig.wal(),
+    'wal_group_commit': StorageConfig.wal(group_commit=True),
+}
+
+
+@pytest.fixture(scope='function', params=list(STORAGE_CONFIGS))
+def app(db_name, request):
+    return SplitwiseApp(db_name, storage_config=STORAGE_CONFIGS[request.param])
 
 
 def test_storing_users(app):
@@ -57,6 +72,7 @@ def test_storing_events(app):
 
     for event in EVENTS:
         assert app.get_event_info(event.token) == event
+        assert app.get_event_by_id(event.id) == event
 
     NONEXISTENT_TOKEN = 'nonexistent_token'
     with pytest.raises(KeyError, match=f'Event with token {NONEXISTENT_TOKEN} does not exist'):
@@ -69,6 +85,10 @@ def test_storing_events(app):
     stored_events = sorted(app.get_all_events(), key=lambda event: event.token)
     assert stored_events == EVENTS
 
+    join_code = app.create_event(user_id=USERS[0].id, event_name='no token given')
+    assert len(join_code) == JOIN_CODE_LENGTH and join_code.isalnum()
+    assert app.get_event_info(join_code).id == len(EVENTS) + 1
+
 
 def test_adding_users_to_events(app):
     for user in USERS:
@@ -200,3 +220,276 @@ def test_several_executes_rollback(app):
         app.create_event(event_name=EVENTS[0].name, user_id=USERS[0].id)  # no such user in database
 
     assert app.get_all_events() == []
+
+
+def test_final_transactions_cache_invalidation(app):
+    for user in USERS:
+        app.add_new_user(user)
+    event_token = app.create_event(user_id=USERS[0].id, event_name='Test event')
+    for user in USERS[1:]:
+        app.add_user_to_event(user_id=user.id, event_token=event_token)
+
+    assert app.get_final_transactions(event_token) == ({}, {})
+    assert app.get_final_transactions(event_token) == ({}, {})
+    assert app.get_cache_stats()['settlement']['hits'] == 1
+
+    expense_id = app.add_expense(Expense(
+        name='expense',
+        sum=100,
+        lender_id=USERS[0].id,
+        event_token=event_token,
+    ))
+    version = app.get_event_version(event_token)
+    assert version > 0
+    app.get_final_transactions(event_token)
+    assert app.get_cache_stats()['settlement']['misses'] == 2
+
+    app.add_debt(Debt(
+        expense_id=expense_id,
+        lender_id=USERS[0].id,
+        debtor_id=USERS[1].id,
+        sum=100,
+    ))
+    assert app.get_event_version(event_token) > version
+    lenders_info, debtors_info = app.get_final_transactions(event_token)
+    assert lenders_info == {USERS[0].id: [(USERS[1].name, 100)]}
+    assert debtors_info == {USERS[1].id: [(USERS[0].name, 100)]}
+    assert app.get_cache_stats()['settlement']['misses'] == 3
+
+
+def test_final_transactions_cache_eviction(db_name):
+    app = SplitwiseApp(db_name, settlement_cache_size=1)
+    for user in USERS:
+        app.add_new_user(user)
+    for user, event in zip(USERS, EVENTS):
+        app.create_event(user_id=user.id, event_name=event.name, event_token=event.token)
+        app.get_final_transactions(event.token)
+
+    assert app.get_cache_stats()['settlement']['evictions'] == len(EVENTS) - 1
+
+
+def test_final_transactions_see_writes_of_other_connections(db_name):
+    app = SplitwiseApp(db_name)
+    for user in USERS[:2]:
+        app.add_new_user(user)
+    event_token = app.create_event(user_id=USERS[0].id, event_name='Test event')
+    app.add_user_to_event(USERS[1].id, event_token)
+    assert app.get_final_transactions(event_token) == ({}, {})
+    roster_version = app.get_roster_version(event_token)
+
+    # e.g. the import CLI
+    other = Connector(db_name)
+    expense = other.save_expense_info(Expense(name='beer', sum=100, lender_id=1, event_token=event_token,
+                                              datetime='2021-05-01 20:00:00'))
+    other.save_debt_info(Debt(expense.id, USERS[0].id, USERS[1].id, 100))
+    assert app.get_final_transactions(event_token) == (
+        {USERS[0].id: [(USERS[1].name, 100)]},
+        {USERS[1].id: [(USERS[0].name, 100)]},
+    )
+    other.save_user_info(USERS[2])
+    other.add_user_to_event(USERS[2].id, event_token)
+    assert app.get_roster_version(event_token) > roster_version
+
+
+def test_entity_cache_invalidation(app):
+    assert not app.user_exists(USERS[0].id)
+    app.add_new_user(USERS[0])
+    assert app.user_exists(USERS[0].id)
+    app.add_new_user(USERS[1])
+
+    event_token = app.create_event(user_id=USERS[0].id, event_name='Test event')
+    assert app.get_event_info(event_token).name == 'Test event'
+    assert app.get_event_info(event_token).name == 'Test event'
+    assert not app.user_participates_in_event(USERS[1].id, event_token)
+    app.add_user_to_event(USERS[1].id, event_token)
+    assert app.user_participates_in_event(USERS[1].id, event_token)
+
+    stats = app.get_cache_stats()
+    assert stats['events']['hits'] >= 1
+    assert stats['memberships']['misses'] == 2
+
+
+def test_entity_cache_ttl(db_name):
+    app = SplitwiseApp(db_name, entity_cache_ttl=0)
+    app.add_new_user(USERS[0])
+    assert app.user_exists(USERS[0].id)
+    assert app.user_exists(USERS[0].id)
+    assert app.get_cache_stats()['users']['hits'] == 0
+
+
+def test_entity_cache_sees_rows_of_other_connections(db_name):
+    app = SplitwiseApp(db_name)
+    other = Connector(db_name)
+    assert not app.user_exists(USERS[0].id)
+    other.save_user_info(USERS[0])
+    assert app.user_exists(USERS[0].id)
+
+    event = other.create_event(EVENTS[0], USERS[0].id)
+    assert not app.user_participates_in_event(USERS[1].id, event.token)
+    other.save_user_info(USERS[1])
+    other.add_user_to_event(USERS[1].id, event.token)
+    assert app.user_participates_in_event(USERS[1].id, event.token)
+
+
+def import_rows(*rows):
+    return ((line, row) for line, row in enumerate(rows, start=2))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 1000])
+def test_import_ledger(app, chunk_size):
+    for user in USERS:
+        app.add_new_user(user)
+    app.create_event(user_id=USERS[0].id, event_name=EVENTS[0].name, event_token=EVENTS[0].token)
+    app.add_user_to_event(user_id=USERS[1].id, event_token=EVENTS[0].token)
+    version = app.get_event_version(EVENTS[0].token)
+
+    report = app.import_ledger(import_rows(
+        {'kind': 'expense', 'event_token': 'token1', 'lender_id': '1', 'name': 'beer', 'sum': '300'},
+        {'kind': 'debt', 'debtor_id': '2', 'sum': '100'},
+        {'kind': 'debt', 'debtor_id': '3', 'sum': '100'},
+        {'kind': 'debt', 'debtor_id': '2', 'sum': 'a lot'},
+        {'kind': 'expense', 'event_token': 'token1', 'lender_id': '3', 'name': 'fish', 'sum': '10'},
+        {'kind': 'debt', 'debtor_id': '1', 'sum': '10'},
+        {'kind': 'expense', 'event_token': 'token1', 'lender_id': 2, 'name': 'chips', 'sum': 50,
+         'datetime': '2021-05-01T20:00:00'},
+        {'kind': 'debt', 'debtor_id': 1, 'sum': 20},
+        {'kind': 'refund'},
+    ), chunk_size=chunk_size)
+
+    assert (report.expenses, report.debts, report.failed) == (2, 2, 5)
+    assert [(error.line, error.message) for error in report.errors] == [
+        (4, 'debtor 3 does not participate in event token1'),
+        (5, "sum must be an integer, got 'a lot'"),
+        (6, 'lender 3 does not participate in event token1'),
+        (7, 'expense on line 6 was not imported'),
+        (10, "kind must be expense or debt, got 'refund'"),
+    ]
+    assert app.get_event_version(EVENTS[0].token) > version
+    lenders_info, debtors_info = app.get_final_transactions(EVENTS[0].token)
+    assert lenders_info == {USERS[0].id: [(USERS[1].name, 80)]}
+    assert [expense.name for expense in app.conn.get_event_expenses(EVENTS[0].token)] == ['beer', 'chips']
+
+
+def test_import_ledger_checks_uploader(app):
+    for user in USERS:
+        app.add_new_user(user)
+    app.create_event(user_id=USERS[0].id, event_name=EVENTS[0].name, event_token=EVENTS[0].token)
+
+    report = app.import_ledger(import_rows(
+        {'kind': 'debt', 'debtor_id': '1', 'sum': '100'},
+        {'kind': 'expense', 'event_token': 'token1', 'lender_id': '1', 'name': 'beer', 'sum': '300'},
+        {'kind': 'debt', 'debtor_id': '1', 'sum': '100'},
+    ), uploader_id=USERS[1].id, max_errors=2)
+
+    assert (report.expenses, report.debts, report.failed) == (0, 0, 3)
+    assert [error.message for error in report.errors] == [
+        'debt must follow an expense',
+        'uploader 2 does not participate in event token1',
+    ]
+
+
+def test_read_ledger_formats(tmpdir):
+    csv_path = str(tmpdir / 'ledger.csv')
+    with open(csv_path, 'w') as file:
+        file.write('kind,event_token,lender_id,debtor_id,name,sum,datetime\n')
+        file.write('expense,token1,1,,"beer, dark",300,\n')
+        file.write('debt,,,2,,100,\n')
+    jsonl_path = str(tmpdir / 'ledger.jsonl.gz')
+    with gzip.open(jsonl_path, 'wt') as file:
+        file.write('{"kind": "expense", "event_token": "token1", "lender_id": 1, "name": "beer, dark", "sum": 300}\n')
+        file.write('\n')
+        file.write('{"kind": "debt", "debtor_id": 2, "sum": 100}\n')
+        file.write('{"kind": "debt",\n')
+
+    parsed = {}
+    for path in (csv_path, jsonl_path):
+        ledger_format = ledger.detect_format(path)
+        with ledger.open_ledger(path) as stream:
+            rows = list(ledger.read_ledger(stream, ledger_format))
+        parsed[ledger_format] = [
+            (line, row if isinstance(row, ledger.LedgerError) else ledger.parse_row(row)) for line, row in rows
+        ]
+
+    expected = [
+        (2, Expense(name='beer, dark', sum=300, lender_id=1, event_token='token1')),
+        (3, Debt(debtor_id=2, sum=100)),
+    ]
+    assert parsed['csv'] == expected
+    assert parsed['jsonl'][:2] == [(1, expected[0][1]), (3, expected[1][1])]
+    assert parsed['jsonl'][2][0] == 4 and 'invalid JSON' in str(parsed['jsonl'][2][1])
+    with pytest.raises(ledger.LedgerError):
+        ledger.detect_format('ledger.xlsx')
+
+
+@pytest.mark.parametrize('ledger_format', ledger.LEDGER_FORMATS)
+def test_export_import_round_trip(app, db_name, tmpdir, ledger_format):
+    for user in USERS:
+        app.add_new_user(user)
+    app.create_event(user_id=USERS[0].id, event_name=EVENTS[0].name, event_token=EVENTS[0].token)
+    for user in USERS[1:]:
+        app.add_user_to_event(user_id=user.id, event_token=EVENTS[0].token)
+    for lender in USERS:
+        expense_id = app.add_expense(Expense(name=f'paid by {lender.name}', sum=300, lender_id=lender.id,
+                                             event_token=EVENTS[0].token))
+        for debtor in USERS:
+            if debtor != lender:
+                app.add_debt(Debt(expense_id=expense_id, lender_id=lender.id, debtor_id=debtor.id, sum=lender.id))
+
+    path = str(tmpdir / f'ledger.{ledger_format}.gz')
+    with open(path, 'wb') as file:
+        rows = ledger.write_ledger(app.iter_event_ledger(EVENTS[0].token), file, ledger_format, compress=True)
+    assert rows == len(USERS) * len(USERS)
+
+    copy = SplitwiseApp(str(tmpdir / 'copy.sqlite'))
+    for user in USERS:
+        copy.add_new_user(user)
+    copy.create_event(user_id=USERS[0].id, event_name=EVENTS[0].name, event_token=EVENTS[0].token)
+    for user in USERS[1:]:
+        copy.add_user_to_event(user_id=user.id, event_token=EVENTS[0].token)
+    with ledger.open_ledger(path) as stream:
+        report = copy.import_ledger(ledger.read_ledger(stream, ledger_format))
+    assert (report.expenses + report.debts, report.failed) == (rows, 0)
+    assert list(copy.iter_event_ledger(EVENTS[0].token)) == list(app.iter_event_ledger(EVENTS[0].token))
+
+
+def test_workload_is_seeded(tmpdir):
+    config = SCALES['tiny']
+    apps = [SplitwiseApp(str(tmpdir / f'workload{i}.sqlite')) for i in range(2)]
+    workloads = [populate(app, config) for app in apps]
+
+    assert workloads[0] == workloads[1]
+    assert workloads[0].debts == config.events * config.expenses_per_event * config.debts_per_expense
+    for token in workloads[0].event_tokens:
+        assert list(apps[0].iter_event_ledger(token)) == list(apps[1].iter_event_ledger(token))
+        assert sorted(user.id for user in apps[0].get_users_of_event(token)) == sorted(workloads[0].members[token])
+
+
+def test_benchmark_suite_times_every_method(db_name):
+    report = benchmark_suite.run(db_name, SCALES['tiny'], number=2, threads=2)
+    json.dumps(report)
+
+    timed = {(result['group'], result['name']) for result in report['results']}
+    for group, cls in (('connector', Connector), ('splitwise', SplitwiseApp)):
+        methods = {
+            name for name in vars(cls)
+            if callable(getattr(cls, name)) and not name.startswith('_') and not name.startswith('get_all_')
+        }
+        assert methods <= {name for result_group, name in timed if result_group == group}
+    assert {group for group, _ in timed} == {'connector', 'splitwise', 'settlement', 'mixed'}
+    assert not any(change['regression'] for change in benchmark_suite.compare(report, report))
+
+
+def test_slow_query_log_names_caller(db_name, tmpdir):
+    path = str(tmpdir / 'slow.jsonl')
+    app = SplitwiseApp(db_name, storage_config=StorageConfig(slow_query_log=path, slow_query_threshold=0.0))
+    for user in USERS[:2]:
+        app.add_new_user(user)
+    app.create_event(USERS[0].id, EVENTS[0].name, event_token=EVENTS[0].token)
+    app.add_user_to_event(USERS[1].id, EVENTS[0].token)
+    app.get_user_events(USERS[1].id)
+    with open(path) as file:
+        callers = {entry['statement']: entry['caller'] for entry in map(json.loads, file)}
+
+    assert callers['INSERT INTO events (token, name) VALUES(?, ?)'] == 'SplitwiseApp.create_event'
+    assert callers['SELECT e.token, e.name, e.id FROM events e, user2event ev '
+                   'WHERE ev.user_id = ? AND ev.event_id = e.id'] == 'SplitwiseApp.get_user_events'
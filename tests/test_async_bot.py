@@ -0,0 +1,152 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.splitwise import PAGE_SIZE
+from benchmarks.fake_bot_api import FakeBotApiServer, make_message_update
+from benchmarks.startup import FAKE_TOKEN
+from bot import menu_items
+from bot.async_bot import AsyncTelegramBot
+from bot.callback_data import EVENT, NEXT_PAGE, USER, pack
+from database.model_types import User
+
+
+@pytest.fixture(scope='function')
+def server():
+    with FakeBotApiServer() as server:
+        yield server
+
+
+@pytest.fixture(scope='function')
+def bot(tmpdir, server):
+    bot = AsyncTelegramBot(FAKE_TOKEN, db_name=str(tmpdir / 'db.sqlite'), base_url=server.base_url, poll_timeout=1)
+    yield bot
+    bot.close()
+
+
+def run_session(bot, server, script):
+    """
+    Runs polling while script pushes updates, script is called in a thread
+    """
+    async def main():
+        polling = asyncio.ensure_future(bot.run_polling())
+        await asyncio.get_running_loop().run_in_executor(None, script)
+        bot.stop()
+        await polling
+        await bot.join()
+
+    asyncio.run(asyncio.wait_for(main(), timeout=20))
+
+
+def texts(server, method='sendMessage'):
+    return [call.params['text'] for call in server.api.calls_of(method)]
+
+
+def test_start_and_create_event(bot, server):
+    api = server.api
+
+    def script():
+        api.push_message(1, '/start', username='Car')
+        assert api.wait_for_calls(1, 'sendMessage')
+        api.push_callback(1, menu_items.CREATE_EVENT)
+        assert api.wait_for_calls(1, 'editMessageText')
+        api.push_message(1, 'Pilsener')
+        assert api.wait_for_calls(2, 'sendMessage')
+
+    run_session(bot, server, script)
+    sent = texts(server)
+    # replies of one update are coalesced by MessageSender
+    assert sent[0] == 'Привет, Car! Ты здесь впервые!\n\nМеню:'
+    assert sent[1].startswith('Мероприятие "Pilsener" создано.')
+    assert texts(server, 'editMessageText') == ['Введи название мероприятия или нажми кнопку \'Отмена\'']
+    assert len(api.calls_of('answerCallbackQuery')) == 1
+    assert bot.container.splitwise.get_all_events()[0].name == 'Pilsener'
+
+
+def test_chats_are_independent_and_ordered(bot, server):
+    api = server.api
+    users = list(range(1, 21))
+
+    def script():
+        for user_id in users:
+            api.push_message(user_id, '/start')
+            api.push_message(user_id, '/start')
+        assert api.wait_for_calls(2 * len(users), 'sendMessage')
+
+    run_session(bot, server, script)
+    for user_id in users:
+        chat_texts = [call.params['text'] for call in api.calls_of('sendMessage') if call.chat_id == user_id]
+        assert chat_texts[0].startswith(f'Привет, user{user_id}! Ты здесь впервые!')
+        assert chat_texts[1].startswith(f'Привет, user{user_id}! Ты уже был(а) здесь!')
+
+
+def test_export_and_unknown_commands(bot, server):
+    api = server.api
+    splitwise = bot.container.splitwise
+    splitwise.add_new_user(User(1, 'Car'))
+    token = splitwise.create_event(1, 'Pilsener', event_token='token')
+
+    def script():
+        api.push_message(1, f'/export {token}')
+        assert api.wait_for_calls(1, 'sendDocument')
+        api.push_message(1, '/unknown')
+        assert api.wait_for_calls(1, 'sendMessage')
+
+    run_session(bot, server, script)
+    assert api.calls_of('sendDocument')[0].params['caption'] == 'Pilsener: 0 строк'
+    assert texts(server) == ['Выберите пункт меню:\n\nМеню:']
+
+
+def test_debtor_picker_pages(bot, server):
+    api = server.api
+    splitwise = bot.container.splitwise
+    users = [User(i, f'user{i}') for i in range(1, PAGE_SIZE + 3)]
+    for user in users:
+        splitwise.add_new_user(user)
+    token = splitwise.create_event(1, 'Pilsener', event_token='token')
+    for user in users[1:]:
+        splitwise.add_user_to_event(user.id, token)
+
+    def script():
+        for data in (menu_items.SELECT_EVENT, pack(EVENT, splitwise.get_event_info(token).id), menu_items.ADD_EXPENSE):
+            api.push_callback(1, data)
+        api.push_message(1, 'dinner')
+        api.push_message(1, '300')
+        assert api.wait_for_calls(2, 'sendMessage')
+        keyboard = api.calls_of('sendMessage')[-1].params['reply_markup']['inline_keyboard']
+        api.push_callback(1, keyboard[-2][0]['callback_data'])
+        assert api.wait_for_calls(1, 'editMessageReplyMarkup')
+
+    run_session(bot, server, script)
+    first_page = api.calls_of('sendMessage')[-1].params['reply_markup']['inline_keyboard']
+    second_page = api.calls_of('editMessageReplyMarkup')[0].params['reply_markup']['inline_keyboard']
+    users = [pack(USER, user.id) for user in users]
+    assert [row[0]['callback_data'] for row in first_page[:PAGE_SIZE]] == users[:PAGE_SIZE]
+    assert first_page[PAGE_SIZE][0]['callback_data'] == pack(NEXT_PAGE, PAGE_SIZE)
+    assert [row[0]['callback_data'] for row in second_page] == users[PAGE_SIZE:] + ['prev_page', 'cancel']
+
+
+def test_pending_updates_are_bounded(tmpdir, server):
+    bot = AsyncTelegramBot(
+        FAKE_TOKEN, db_name=str(tmpdir / 'db.sqlite'), base_url=server.base_url, workers=1, max_pending_updates=1,
+    )
+    release = threading.Event()
+
+    async def main():
+        # the only worker is busy, so the first update stays pending
+        blocker = bot._executor.submit(release.wait, 5)
+        await bot.dispatch(dict(make_message_update(1, '/start'), update_id=1))
+        second = asyncio.ensure_future(bot.dispatch(dict(make_message_update(2, '/start'), update_id=2)))
+        await asyncio.sleep(0.1)
+        assert not second.done()
+        release.set()
+        await second
+        await bot.join()
+        assert blocker.result()
+
+    try:
+        asyncio.run(asyncio.wait_for(main(), timeout=20))
+    finally:
+        bot.close()
+    assert len(server.api.calls_of('sendMessage')) == 2
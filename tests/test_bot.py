@@ -0,0 +1,217 @@
+import gzip
+import json
+import os
+
+import pytest
+from telegram import Update
+
+from app.splitwise import PAGE_SIZE
+from bot import menu_items
+from bot.callback_data import EVENT, NEXT_PAGE, USER, pack
+from bot.handlers import States
+from bot.tgbot import TelegramBot
+from benchmarks import replay
+from benchmarks.fake_bot_api import FakeBotApiServer, make_callback_update, make_document_update, make_message_update
+from benchmarks.startup import FAKE_TOKEN, run
+from database.model_types import User, Expense, Debt
+
+
+@pytest.fixture(scope='function')
+def db_name(tmpdir):
+    return str(tmpdir / 'db.sqlite')
+
+
+def test_bot_uses_given_database(db_name):
+    bot = TelegramBot(FAKE_TOKEN, db_name=db_name)
+    assert os.path.exists(db_name)
+    assert bot.splitwise is bot.container.splitwise
+
+
+def test_bot_opens_single_connection(db_name):
+    assert run(db_name)['connections'] == 1
+
+
+def test_event_picker_pages(db_name):
+    with FakeBotApiServer() as server:
+        bot = TelegramBot(FAKE_TOKEN, db_name=db_name, base_url=server.base_url)
+        dispatcher = bot.updater.dispatcher
+        splitwise = bot.splitwise
+        splitwise.add_new_user(User(1, 'Car'))
+        tokens = [splitwise.create_event(1, f'event #{i}', event_token=f'token{i:02}') for i in range(PAGE_SIZE + 3)]
+
+        def press(data):
+            update = dict(make_callback_update(1, data), update_id=len(server.api.calls) + 1)
+            dispatcher.process_update(Update.de_json(update, dispatcher.bot))
+            return server.api.calls[-1].params['reply_markup']['inline_keyboard']
+
+        def callback_data(keyboard):
+            return [button['callback_data'] for row in keyboard for button in row]
+
+        events = [pack(EVENT, splitwise.get_event_info(token).id) for token in tokens]
+        first_page = press(menu_items.SELECT_EVENT)
+        assert callback_data(first_page) == events[:PAGE_SIZE] + [pack(NEXT_PAGE, PAGE_SIZE), 'cancel']
+        second_page = press(callback_data(first_page)[PAGE_SIZE])
+        assert callback_data(second_page) == events[PAGE_SIZE:] + ['prev_page', 'cancel']
+        assert press(menu_items.PREV_PAGE) == first_page
+
+        press(events[1])
+        assert server.api.calls_of('editMessageText')[-1].params['text'] == 'event #1\nВыберите пункт меню:'
+
+
+def test_outdated_event_buttons(db_name):
+    with FakeBotApiServer() as server:
+        bot = TelegramBot(FAKE_TOKEN, db_name=db_name, base_url=server.base_url)
+        dispatcher = bot.updater.dispatcher
+        bot.splitwise.add_new_user(User(1, 'Car'))
+        bot.splitwise.create_event(1, 'Pilsener', event_token='token')
+
+        def press(data):
+            update = dict(make_callback_update(1, data), update_id=len(server.api.calls) + 1)
+            dispatcher.process_update(Update.de_json(update, dispatcher.bot))
+            return server.api.calls_of('editMessageText')[-1].params
+
+        first_page = press(menu_items.SELECT_EVENT)['reply_markup']
+        # a next page button of the old format
+        reply = press('next_page:token')
+        assert reply['text'] == 'Меню устарело, выбери мероприятие еще раз'
+        assert reply['reply_markup'] == first_page
+        # an event button carrying the token
+        assert press('token')['text'] == 'Pilsener\nВыберите пункт меню:'
+
+
+def test_event_buttons_of_other_users(db_name):
+    with FakeBotApiServer() as server:
+        bot = TelegramBot(FAKE_TOKEN, db_name=db_name, base_url=server.base_url)
+        dispatcher = bot.updater.dispatcher
+        for user in (User(1, 'Car'), User(2, 'Major')):
+            bot.splitwise.add_new_user(user)
+        bot.splitwise.create_event(1, 'Pilsener', event_token='token1')
+        bot.splitwise.create_event(2, 'Smoking', event_token='token2')
+        foreign = bot.splitwise.get_event_info('token1')
+
+        def press(data):
+            update = dict(make_callback_update(2, data), update_id=len(server.api.calls) + 1)
+            dispatcher.process_update(Update.de_json(update, dispatcher.bot))
+            return server.api.calls_of('editMessageText')[-1].params
+
+        press(menu_items.SELECT_EVENT)
+        # a forged button with the id of an event the user does not participate in
+        assert press(pack(EVENT, foreign.id))['text'] == (
+            'Меню устарело, выбери мероприятие еще раз'
+        )
+        assert press('token1')['text'] == 'Меню устарело, выбери мероприятие еще раз'
+        assert States.CURRENT_EVENT_TOKEN not in dispatcher.user_data[2]
+
+
+def test_outdated_debtor_buttons(db_name):
+    with FakeBotApiServer() as server:
+        bot = TelegramBot(FAKE_TOKEN, db_name=db_name, base_url=server.base_url)
+        dispatcher = bot.updater.dispatcher
+        splitwise = bot.splitwise
+        for user in (User(1, 'Car'), User(2, 'Major'), User(3, 'Smoking')):
+            splitwise.add_new_user(user)
+        splitwise.create_event(1, 'Pilsener', event_token='token1')
+        splitwise.add_user_to_event(2, 'token1')
+
+        def push(update):
+            update = dict(update, update_id=len(server.api.calls) + 1)
+            dispatcher.process_update(Update.de_json(update, dispatcher.bot))
+            return server.api.calls_of('editMessageText')[-1].params
+
+        push(make_callback_update(1, menu_items.SELECT_EVENT))
+        push(make_callback_update(1, pack(EVENT, splitwise.get_event_info('token1').id)))
+        push(make_callback_update(1, menu_items.ADD_EXPENSE))
+        push(make_message_update(1, 'beer'))
+        push(make_message_update(1, '300'))
+        first_page = server.api.calls_of('sendMessage')[-1].params['reply_markup']
+        # garbage, a user out of the event and a button of the old format
+        for data in ('#u!', pack(USER, 3), '3'):
+            reply = push(make_callback_update(1, data))
+            assert reply['text'] == 'Меню устарело, выбери должника еще раз'
+            assert reply['reply_markup'] == first_page
+        assert push(make_callback_update(1, '2'))['text'] == 'Major\nСколько он тебе задолжал?'
+
+
+def test_ledger_upload(db_name):
+    with FakeBotApiServer() as server:
+        bot = TelegramBot(FAKE_TOKEN, db_name=db_name, base_url=server.base_url, base_file_url=server.base_file_url)
+        dispatcher = bot.updater.dispatcher
+        splitwise = bot.splitwise
+        for user in (User(1, 'Car'), User(2, 'Major')):
+            splitwise.add_new_user(user)
+        splitwise.create_event(1, 'Pilsener', event_token='token1')
+        splitwise.add_user_to_event(2, 'token1')
+
+        def upload(file_name, content):
+            update = server.api.push_document(1, file_name, content)
+            dispatcher.process_update(Update.de_json(update, dispatcher.bot))
+            return server.api.calls_of('sendMessage')[-1].params['text']
+
+        text = upload('ledger.csv', (
+            'kind,event_token,lender_id,debtor_id,name,sum\n'
+            'expense,token1,1,,beer,300\n'
+            'debt,,,2,,100\n'
+            'debt,,,3,,100\n'
+        ).encode())
+        assert text == (
+            'Импортировано трат: 1, долгов: 1\n'
+            'Пропущено строк: 1\n'
+            'Строка 4: debtor 3 does not participate in event token1'
+        )
+        assert splitwise.get_final_transactions('token1')[0] == {1: [('Major', 100)]}
+        assert upload('ledger.pdf', b'%PDF').startswith('Пришли файл с тратами')
+
+        errors = []
+        dispatcher.add_error_handler(lambda _, context: errors.append(context.error))
+        sent = len(server.api.calls_of('sendMessage'))
+        edited = make_document_update(1, 'file', 'ledger.csv', 10)
+        edited['message']['edit_date'] = edited['message']['date']
+        update = {'update_id': len(server.api.calls) + 1, 'edited_message': edited['message']}
+        dispatcher.process_update(Update.de_json(update, dispatcher.bot))
+        assert errors == []
+        assert len(server.api.calls_of('sendMessage')) == sent
+
+
+def test_ledger_export(db_name):
+    with FakeBotApiServer() as server:
+        bot = TelegramBot(FAKE_TOKEN, db_name=db_name, base_url=server.base_url)
+        dispatcher = bot.updater.dispatcher
+        splitwise = bot.splitwise
+        for user in (User(1, 'Car'), User(2, 'Major')):
+            splitwise.add_new_user(user)
+        splitwise.create_event(1, 'Pilsener', event_token='token1')
+        splitwise.add_user_to_event(2, 'token1')
+        expense_id = splitwise.add_expense(Expense(name='beer', sum=300, lender_id=1, event_token='token1'))
+        splitwise.add_debt(Debt(expense_id=expense_id, lender_id=1, debtor_id=2, sum=100))
+
+        def command(user_id, text):
+            update = server.api.push_message(user_id, text)
+            dispatcher.process_update(Update.de_json(update, dispatcher.bot))
+            return server.api.calls[-1]
+
+        call = command(2, '/export token1 jsonl')
+        assert call.method == 'sendDocument'
+        assert call.params['document']['filename'] == 'token1.jsonl.gz'
+        assert call.params['caption'] == 'Pilsener: 2 строк'
+        rows = [json.loads(line) for line in gzip.decompress(call.params['document']['content']).splitlines()]
+        assert [row['kind'] for row in rows] == ['expense', 'debt']
+        assert rows[1] == {'kind': 'debt', 'lender_id': 1, 'debtor_id': 2, 'sum': 100}
+
+        assert command(3, '/export token1').params['text'] == 'Ты не участвуешь в этом мероприятии'
+        assert command(1, '/export').params['text'].startswith('Использование')
+
+
+def test_replayed_sessions(db_name, tmpdir):
+    path = str(tmpdir / 'session.jsonl')
+    replay.save_script(replay.group_session_script(members=2), path)
+    steps = replay.load_script(path)
+    assert steps == replay.group_session_script(members=2)
+
+    result = replay.run(db_name, steps, sessions=3, concurrency=2, members=2)
+    assert (result['sessions'], result['failed_sessions']) == (3, 0)
+    assert len(result['steps']) == len(steps)
+    # /start of a new user is answered with one message, the debtor picker edits the message and answers the query
+    assert result['actions']['start']['api_calls'] == 2
+    debtor_step = next(step for step in result['steps'] if step['update'] == 'callback {debtor1}')
+    assert debtor_step['api_calls'] == 2
+    assert result['sessions_per_second'] > 0
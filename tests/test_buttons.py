@@ -0,0 +1,71 @@
+import pytest
+
+from app import base62
+from app.splitwise import SplitwiseApp
+from benchmarks import keyboards as keyboards_benchmark
+from bot import buttons, callback_data
+from database.model_types import User, Event
+
+
+@pytest.fixture(scope='function')
+def app(tmpdir):
+    return SplitwiseApp(db_name=str(tmpdir / 'db.sqlite'))
+
+
+def test_static_keyboards_are_shared():
+    assert buttons.get_menu_keyboard() is buttons.get_menu_keyboard()
+    assert buttons.get_cancel_button() is buttons.get_cancel_button()
+    assert buttons.get_event_commands_keyboard() is buttons.get_event_commands_keyboard()
+    assert buttons.get_menu_keyboard().to_dict() == keyboards_benchmark.build_menu_keyboard().to_dict()
+    assert buttons.get_menu_keyboard().to_json() == keyboards_benchmark.build_menu_keyboard().to_json()
+
+
+def test_event_buttons_are_memoized():
+    events = [Event('token1', 'first', 1), Event('token2', 'second', 100)]
+    keyboard = buttons.get_event_buttons(events)
+    assert buttons.get_event_buttons(list(events)) is keyboard
+    assert buttons.get_event_buttons(events + [Event('token3', 'third', 101)]) is not keyboard
+    assert [row[0].callback_data for row in keyboard.inline_keyboard] == ['#e1', '#e1c', 'cancel']
+
+
+def test_callback_data_round_trip():
+    for number in (0, 1, 61, 62, 3843, 2 ** 63 - 1):
+        assert base62.decode(base62.encode(number)) == number
+    assert base62.encode(2 ** 63 - 1) == 'AzL8n0Y58m7'
+    with pytest.raises(ValueError):
+        base62.decode('a-b')
+    code = base62.random_code(12)
+    assert len(code) == 12 and set(code) <= set(base62.ALPHABET)
+
+    data = callback_data.pack(callback_data.EVENT, 2 ** 63 - 1)
+    assert len(data.encode()) <= 64
+    assert callback_data.unpack(data) == (callback_data.EVENT, (2 ** 63 - 1,))
+    assert callback_data.unpack(callback_data.pack(callback_data.NEXT_PAGE, 7, 8)) == (callback_data.NEXT_PAGE, (7, 8))
+    assert callback_data.unpack_id(data, callback_data.NEXT_PAGE) is None
+    # menu items and garbage are not callback data of this codec
+    for data in ('cancel', '#', '#e!', ''):
+        assert callback_data.unpack_id(data, callback_data.EVENT) is None
+
+
+def test_user_keyboards_follow_roster_version(app):
+    for user_id in (1, 2, 3):
+        app.add_new_user(User(user_id, f'user{user_id}'))
+    token = app.create_event(user_id=1, event_name='event', event_token='token')
+    app.add_user_to_event(2, token)
+    keyboards = buttons.UserKeyboards()
+
+    version = app.get_roster_version(token)
+    assert keyboards.get(token, version) is None
+    keyboard = keyboards.put(token, version, app.get_users_of_event(token))
+    assert keyboards.get(token, app.get_roster_version(token)) is keyboard
+    assert keyboard.to_dict() == keyboards_benchmark.build_user_keyboard(app.get_users_of_event(token)).to_dict()
+
+    app.add_user_to_event(3, token)
+    assert app.get_roster_version(token) > version
+    assert keyboards.get(token, app.get_roster_version(token)) is None
+
+
+def test_keyboards_benchmark():
+    result = keyboards_benchmark.run(users=5, number=10)
+    assert result['menu_shared_us'] < result['menu_rebuilt_us']
+    assert result['users_memoized_us'] < result['users_rebuilt_us']
@@ -0,0 +1,535 @@
+import dataclasses
+import json
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+
+import pytest
+import sqlite3
+
+from database import migrations
+from database.batches import ExpenseBatch, DebtBatch
+from database.config import StorageConfig
+from database.connector import Connector, DEBTS_QUERY_CHUNK_SIZE
+from database.model_types import User, Event, Expense, Debt
+from database.pool import ReadConnectionPool
+from database.slow_log import SlowQueryLog
+
+LEGACY_SCHEMA = '''
+CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR);
+CREATE TABLE events (token VARCHAR PRIMARY KEY, name VARCHAR NOT NULL UNIQUE);
+CREATE TABLE user2event (user_id INTEGER NOT NULL, event_token VARCHAR NOT NULL);
+'''
+
+# (query, index that must be used)
+HOT_QUERIES = [
+    (
+        'SELECT 1 FROM user2event WHERE user_id = ? AND event_id = (SELECT id FROM events WHERE token = ?)',
+        'PRIMARY KEY',
+    ),
+    (
+        'SELECT u.id, u.name FROM users u, user2event u2e '
+        'WHERE u.id = u2e.user_id AND u2e.event_id = (SELECT id FROM events WHERE token = ?)',
+        'idx_user2event_event_id',
+    ),
+    (
+        'SELECT e.token, e.name, e.id FROM events e, user2event ev WHERE ev.user_id = ? AND ev.event_id = e.id',
+        'PRIMARY KEY',
+    ),
+    (
+        'SELECT u.id, u.name FROM user2event u2e JOIN users u ON u.id = u2e.user_id '
+        'WHERE u2e.event_id = (SELECT id FROM events WHERE token = ?) AND u2e.user_id > ? '
+        'ORDER BY u2e.user_id LIMIT ?',
+        'idx_user2event_event_id',
+    ),
+    (
+        'SELECT e.token, e.name, e.id FROM user2event ev JOIN events e ON e.id = ev.event_id '
+        'WHERE ev.user_id = ? AND ev.event_id > ? ORDER BY ev.event_id LIMIT ?',
+        'PRIMARY KEY',
+    ),
+    (
+        'SELECT x.id, x.name, x.sum, x.lender_id, ev.token, x.datetime '
+        'FROM expenses x JOIN events ev ON ev.id = x.event_id WHERE ev.token = ?',
+        'idx_expenses_event_id',
+    ),
+    (
+        'SELECT version FROM events WHERE token = ?',
+        'sqlite_autoindex_events_1',
+    ),
+    (
+        'SELECT MAX(id) FROM (SELECT id FROM expenses '
+        'WHERE event_id = (SELECT id FROM events WHERE token = ?) AND id > ? ORDER BY id LIMIT ?)',
+        'idx_expenses_event_id',
+    ),
+    (
+        'SELECT e.id, e.name, e.sum, e.lender_id, e.datetime, d.lender_id, d.debtor_id, d.sum '
+        'FROM expenses e LEFT JOIN debts d ON d.expense_id = e.id '
+        'WHERE e.event_id = (SELECT id FROM events WHERE token = ?) AND e.id > ? AND e.id <= ? ORDER BY e.id',
+        'idx_expenses_event_id',
+    ),
+    (
+        'SELECT expense_id, lender_id, debtor_id, sum FROM debts WHERE expense_id in (?,?,?)',
+        'idx_debts_expense_id',
+    ),
+]
+
+
+@pytest.fixture(scope='function')
+def db_name(tmpdir):
+    return str(tmpdir / 'db.sqlite')
+
+
+@pytest.fixture(scope='function')
+def connector(db_name):
+    return Connector(db_name)
+
+
+def test_migrations_applied_once(db_name, connector):
+    last_version = migrations.get_migrations()[-1][0]
+    assert migrations.get_schema_version(connector.conn) == last_version
+
+    reopened = Connector(db_name)
+    assert migrations.get_schema_version(reopened.conn) == last_version
+
+
+def test_legacy_database_is_upgraded(db_name):
+    conn = sqlite3.connect(db_name)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.execute("INSERT INTO users VALUES (1, 'Car')")
+    conn.execute("INSERT INTO events VALUES ('token1', 'Pilsener')")
+    conn.executemany('INSERT INTO user2event VALUES (?, ?)', [(1, 'token1'), (1, 'token1')])
+    conn.commit()
+    conn.close()
+
+    connector = Connector(db_name)
+    assert connector.get_all_user2event() == [(1, 'token1')]
+    with pytest.raises(sqlite3.IntegrityError):
+        connector.add_user_to_event(1, 'token1')
+
+
+def test_event_tokens_become_join_codes(db_name):
+    conn = sqlite3.connect(db_name)
+    for _, path in migrations.get_migrations()[:3]:
+        conn.executescript(path.read_text())
+    conn.execute('PRAGMA user_version = 3')
+    token = '2f1c7c4e-8a8e-4c63-9a4b-2e0b7d1f5c11'
+    conn.executemany('INSERT INTO users VALUES (?, ?)', [(1, 'Car'), (2, 'Major')])
+    conn.execute('INSERT INTO events VALUES (?, ?)', (token, 'Pilsener'))
+    conn.executemany('INSERT INTO user2event VALUES (?, ?)', [(1, token), (2, token)])
+    conn.execute("INSERT INTO expenses VALUES (7, 'beer', 100, 1, ?, '2021-05-01 20:00:00')", (token,))
+    conn.execute('INSERT INTO debts VALUES (7, 1, 2, 60)')
+    conn.commit()
+    conn.close()
+
+    connector = Connector(db_name)
+    event = connector.get_event_info(token)
+    assert event == Event(token, 'Pilsener', 1)
+    assert connector.get_event_by_id(event.id) == event
+    assert [user.id for user in connector.get_users_of_event(token)] == [1, 2]
+    assert list(connector.get_event_expenses(token)) == [
+        Expense(7, 'beer', 100, 1, token, '2021-05-01 20:00:00'),
+    ]
+    assert sorted(connector.get_event_balances(token)) == [(1, 60, 0), (2, 0, 60)]
+    # balances are still maintained by triggers
+    connector.save_debt_info(Debt(7, 1, 1, 40))
+    assert sorted(connector.get_event_balances(token)) == [(1, 100, 40), (2, 0, 60)]
+    assert connector.conn.execute('PRAGMA foreign_keys').fetchone()[0] == 1
+
+
+@pytest.mark.parametrize('query, index', HOT_QUERIES)
+def test_hot_queries_use_indexes(connector, query, index):
+    params = (1,) * query.count('?')
+    plan = [row[-1] for row in connector.conn.execute('EXPLAIN QUERY PLAN ' + query, params)]
+    assert not [step for step in plan if step.startswith('SCAN')], plan
+    assert not [step for step in plan if 'TEMP B-TREE' in step], plan
+    assert any(index in step for step in plan), plan
+
+
+def test_wal_mode_reads_through_pool(db_name):
+    connector = Connector(db_name, config=StorageConfig.wal(read_pool_size=2))
+    assert connector.conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+    connector.save_user_info(User(id=1, name='Car'))
+    assert connector.get_user_info_or_none(1) == User(id=1, name='Car')
+    with connector._reading() as conn:
+        assert conn is not connector.conn
+        with pytest.raises(sqlite3.OperationalError, match='readonly'):
+            conn.execute("INSERT INTO users VALUES (2, 'Major')")
+
+
+def test_failed_connector_is_collected(tmpdir):
+    with pytest.raises(sqlite3.OperationalError):
+        Connector(str(tmpdir / 'missing' / 'db.sqlite'))
+    # nothing was assigned yet
+    Connector.__new__(Connector).__del__()
+
+
+def test_read_pool_is_bounded(db_name):
+    Connector(db_name)
+    pool = ReadConnectionPool(db_name, size=2)
+    with pool.connection() as first, pool.connection() as second:
+        assert first is not second
+    with pool.connection():
+        pass
+    assert pool.opened == 2
+
+
+def test_group_commit_batches_writes(db_name):
+    connector = Connector(db_name, config=StorageConfig.wal(group_commit=True))
+    connector.save_user_info(User(id=1, name='Car'))
+    connector.create_event(Event(token='token1', name='Pilsener'), user_id=1)
+
+    batches_before = connector._writer.batches
+    release = threading.Event()
+    blocker = connector._writer.submit(lambda cursor: release.wait(timeout=5))
+    futures = [
+        connector.submit_expense_info(Expense(
+            name=f'expense #{i}', sum=100, lender_id=1, event_token='token1', datetime=datetime.now(),
+        ))
+        for i in range(10)
+    ]
+    failing = connector.submit_debt_info(Debt(expense_id=100500, lender_id=1, debtor_id=1, sum=1))
+    release.set()
+
+    expenses = [future.result(timeout=5) for future in futures]
+    assert len({expense.id for expense in expenses}) == len(expenses)
+    with pytest.raises(sqlite3.IntegrityError, match='FOREIGN KEY constraint failed'):
+        failing.result(timeout=5)
+    assert blocker.result(timeout=5)
+    # blocked batch and everything that was queued meanwhile
+    assert connector._writer.batches <= batches_before + 2
+    assert list(connector.get_event_expenses('token1')) == expenses
+
+
+def test_closing_writer_resolves_every_future(db_name):
+    connector = Connector(db_name, config=StorageConfig.wal(group_commit=True))
+    writer = connector._writer
+    futures = []
+
+    def submit():
+        for _ in range(200):
+            try:
+                futures.append(writer.submit(lambda cursor: cursor.execute('SELECT 1').fetchone()[0]))
+            except RuntimeError:
+                return
+
+    submitters = [threading.Thread(target=submit) for _ in range(4)]
+    for submitter in submitters:
+        submitter.start()
+    while len(futures) < 10:
+        time.sleep(0.001)
+    writer.close()
+    for submitter in submitters:
+        submitter.join()
+    assert [future.result(timeout=5) for future in futures] == [1] * len(futures)
+    with pytest.raises(RuntimeError, match='closed'):
+        writer.submit(lambda cursor: None)
+
+
+def test_closed_writer_fails_operations_left_in_queue(db_name):
+    connector = Connector(db_name, config=StorageConfig.wal(group_commit=True))
+    writer = connector._writer
+    release = threading.Event()
+    blocker = writer.submit(lambda cursor: release.wait(timeout=5))
+    closing = threading.Thread(target=writer.close)
+    closing.start()
+    while not writer._closed:
+        time.sleep(0.001)
+    # an operation that got behind the stop mark
+    late = Future()
+    writer._queue.put((lambda cursor: None, late))
+    release.set()
+    closing.join(timeout=5)
+    assert blocker.result(timeout=5)
+    with pytest.raises(RuntimeError, match='closed'):
+        late.result(timeout=5)
+
+
+def test_balances_follow_debt_writes(connector):
+    for user in (User(id=1, name='Car'), User(id=2, name='Major')):
+        connector.save_user_info(user)
+    connector.create_event(Event(token='token1', name='Pilsener'), user_id=1)
+    expense_id = connector.save_expense_info(Expense(
+        name='expense', sum=300, lender_id=1, event_token='token1', datetime=datetime.now(),
+    )).id
+
+    connector.save_debt_info(Debt(expense_id=expense_id, lender_id=1, debtor_id=2, sum=100))
+    connector.save_debt_info(Debt(expense_id=expense_id, lender_id=1, debtor_id=2, sum=50))
+    assert sorted(connector.get_event_balances('token1')) == [(1, 150, 0), (2, 0, 150)]
+
+    with connector.conn:
+        connector.conn.execute('UPDATE debts SET sum = 70 WHERE sum = 50')
+    assert sorted(connector.get_event_balances('token1')) == [(1, 170, 0), (2, 0, 170)]
+
+    with connector.conn:
+        connector.conn.execute('DELETE FROM debts WHERE sum = 100')
+    assert sorted(connector.get_event_balances('token1')) == [(1, 70, 0), (2, 0, 70)]
+
+    with connector.conn:
+        connector.conn.execute('UPDATE balances SET lent = 0, owed = 0')
+    assert connector.rebuild_balances() == 2
+    assert sorted(connector.get_event_balances('token1')) == [(1, 70, 0), (2, 0, 70)]
+
+    # debts of an expense moved to another event move with it
+    connector.create_event(Event(token='token2', name='Smoking'), user_id=1)
+    connector.save_debt_info(Debt(expense_id=expense_id, lender_id=2, debtor_id=1, sum=20))
+    with connector.conn:
+        connector.conn.execute("UPDATE expenses SET event_id = (SELECT id FROM events WHERE token = 'token2')")
+    assert sorted(connector.get_event_balances('token1')) == [(1, 0, 0), (2, 0, 0)]
+    assert sorted(connector.get_event_balances('token2')) == [(1, 70, 20), (2, 20, 70)]
+
+
+def test_net_balances_match_materialized_balances(connector):
+    users = [User(id=i, name=f'user #{i}') for i in range(1, 5)]
+    for user in users:
+        connector.save_user_info(user)
+    connector.create_event(Event(token='token1', name='Pilsener'), user_id=1)
+    connector.create_event(Event(token='token2', name='Smoking'), user_id=1)
+    for i, lender in enumerate(users):
+        expense_id = connector.save_expense_info(Expense(
+            name='expense', sum=100, lender_id=lender.id, event_token='token1', datetime=datetime.now(),
+        )).id
+        for debtor in users[:i]:
+            connector.save_debt_info(Debt(expense_id=expense_id, lender_id=lender.id, debtor_id=debtor.id, sum=10 * i))
+    other_expense_id = connector.save_expense_info(Expense(
+        name='expense', sum=100, lender_id=1, event_token='token2', datetime=datetime.now(),
+    )).id
+    connector.save_debt_info(Debt(expense_id=other_expense_id, lender_id=1, debtor_id=2, sum=1000))
+
+    materialized = {user_id: lent - owed for user_id, lent, owed in connector.get_event_balances('token1')}
+    assert dict(connector.compute_event_net_balances('token1')) == materialized
+    assert dict(connector.get_event_net_balances('token1')) == {
+        user_id: balance for user_id, balance in materialized.items() if balance
+    }
+    assert sum(materialized.values()) == 0
+
+
+def test_saved_expense_is_returned_without_select(connector):
+    connector.save_user_info(User(id=1, name='Car'))
+    connector.create_event(Event(token='token1', name='Pilsener'), user_id=1)
+    statements = []
+    connector.conn.set_trace_callback(statements.append)
+    expense = connector.save_expense_info(Expense(
+        name='beer', sum=300, lender_id=1, event_token='token1', datetime='2021-05-01 20:00:00',
+    ))
+    connector.conn.set_trace_callback(None)
+
+    assert expense == Expense(
+        id=expense.id, name='beer', sum=300, lender_id=1, event_token='token1', datetime='2021-05-01 20:00:00',
+    )
+    assert expense.id is not None
+    assert not [statement for statement in statements if statement.startswith('SELECT')]
+    assert connector.get_expense_info(expense.id) == expense
+    assert list(connector.get_event_expenses('token1')) == [expense]
+    assert connector.get_user_info_or_none(1) == User(id=1, name='Car')
+    assert connector.get_user_events(1) == [Event(token='token1', name='Pilsener', id=1)]
+
+
+def test_debts_of_large_event(connector):
+    for user in (User(id=1, name='Car'), User(id=2, name='Major')):
+        connector.save_user_info(user)
+    connector.create_event(Event(token='token1', name='Pilsener'), user_id=1)
+    expenses_count = 2 * DEBTS_QUERY_CHUNK_SIZE + 1
+    for i in range(expenses_count):
+        expense_id = connector._insert_expense(connector.conn.cursor(), Expense(
+            name='expense', sum=i + 1, lender_id=1, event_token='token1', datetime=datetime.now(),
+        )).id
+        connector._insert_debt(connector.conn.cursor(), Debt(
+            expense_id=expense_id, lender_id=1, debtor_id=2, sum=i + 1,
+        ))
+    connector.conn.commit()
+
+    expense_ids = [expense.id for expense in connector.get_event_expenses('token1')]
+    debts = connector.get_debts_by_expenses(expense_ids)
+    assert sorted(debt.sum for debt in debts) == list(range(1, expenses_count + 1))
+
+    streamed = connector.iter_event_debts('token1', chunk_size=100)
+    assert next(streamed).lender_id == 1
+    assert 1 + sum(1 for _ in streamed) == expenses_count
+    assert list(connector.iter_event_debts('nonexistent_token')) == []
+
+
+def test_models_and_batches_are_compact(connector):
+    user = User(id=1, name='Car')
+    assert not hasattr(user, '__dict__')
+    assert {user: 'hashable'}[User(id=1, name='Car')] == 'hashable'
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        user.name = 'Major'
+    with pytest.raises(AttributeError):
+        Debt().note = 'no such field'
+
+    for user in (User(id=1, name='Car'), User(id=2, name='Major')):
+        connector.save_user_info(user)
+    connector.create_event(Event(token='token1', name='Pilsener'), user_id=1)
+    stored = [
+        connector.save_expense_info(Expense(
+            name='beer', sum=i + 1, lender_id=1, event_token='token1', datetime='2021-05-01 20:00:00',
+        ))
+        for i in range(3)
+    ]
+    for expense in stored:
+        connector.save_debt_info(Debt(expense_id=expense.id, lender_id=1, debtor_id=2, sum=expense.sum))
+
+    expenses = connector.get_event_expenses('token1')
+    assert isinstance(expenses, ExpenseBatch) and len(expenses) == 3
+    assert list(expenses) == stored and expenses[-1] == stored[-1] and expenses[1:] == stored[1:]
+    assert expenses.names[0] is expenses.names[2] and expenses.event_tokens[0] is expenses.event_tokens[1]
+    debts = connector.get_debts_by_expenses(expenses.ids)
+    assert isinstance(debts, DebtBatch) and list(debts.sums) == [1, 2, 3]
+    assert debts == DebtBatch((expense.id, 1, 2, expense.sum) for expense in stored)
+    assert list(debts)[0] == Debt(expense_id=stored[0].id, lender_id=1, debtor_id=2, sum=1)
+
+
+def test_keyset_pages(connector):
+    users = [User(id=i, name=f'user #{i}') for i in range(1, 26)]
+    for user in users:
+        connector.save_user_info(user)
+    for i in range(1, 26):
+        connector.create_event(Event(token=f'token{i:02}', name=f'event #{i}'), user_id=1)
+    for user in users[1:]:
+        connector.add_user_to_event(user.id, 'token01')
+
+    pages, after = [], None
+    while True:
+        page = connector.get_users_of_event_page('token01', after=after, limit=10)
+        if not page:
+            break
+        pages.append(page)
+        after = page[-1].id
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert [user for page in pages for user in page] == users
+
+    first = connector.get_user_events_page(1, limit=10)
+    second = connector.get_user_events_page(1, after=first[-1].id, limit=10)
+    assert [event.token for event in first + second] == [f'token{i:02}' for i in range(1, 21)]
+
+
+@pytest.mark.parametrize('config', [StorageConfig(), StorageConfig.wal(group_commit=True)], ids=['default', 'group_commit'])
+def test_ledger_entries_with_constraint_violation(db_name, config):
+    connector = Connector(db_name, config=config)
+    for user in (User(id=1, name='Car'), User(id=2, name='Major')):
+        connector.save_user_info(user)
+    connector.create_event(Event(token='token1', name='Pilsener'), user_id=1)
+    entries = [
+        Expense(name='first', sum=100, lender_id=1, event_token='token1', datetime=datetime.now()),
+        Debt(lender_id=1, debtor_id=2, sum=50),
+        Expense(name='unknown event', sum=100, lender_id=1, event_token='nope', datetime=datetime.now()),
+        Debt(lender_id=1, debtor_id=2, sum=10),
+        Debt(lender_id=1, debtor_id=3, sum=10),
+    ]
+
+    failures = connector.insert_ledger_entries(entries)
+    assert [index for index, _ in failures] == [2, 3, 4]
+    # an unknown token has no event id
+    assert 'NOT NULL constraint failed: expenses.event_id' in failures[0][1]
+    assert entries[0].id is not None and entries[2].id is None
+    assert [expense.id for expense in connector.get_event_expenses('token1')] == [entries[0].id]
+    assert sorted(connector.get_event_balances('token1')) == [(1, 50, 0), (2, 0, 50)]
+
+    # a debt of an expense imported earlier refers to it by id
+    assert connector.insert_ledger_entries([Debt(expense_id=entries[0].id, lender_id=1, debtor_id=2, sum=5)]) == []
+    assert sorted(connector.get_event_balances('token1')) == [(1, 55, 0), (2, 0, 55)]
+
+
+def test_ledger_entries_take_ids_from_database(db_name, connector):
+    for user in (User(id=1, name='Car'), User(id=2, name='Major')):
+        connector.save_user_info(user)
+    connector.create_event(Event(token='token1', name='Pilsener'), user_id=1)
+    other = Connector(db_name)
+    saved = []
+    for i in range(3):
+        entries = [
+            Expense(name=f'imported #{i}', sum=100, lender_id=1, event_token='token1', datetime='2021-05-01 20:00:00'),
+            Debt(lender_id=1, debtor_id=2, sum=i + 1),
+        ]
+        assert connector.insert_ledger_entries(entries) == []
+        saved.append(entries[0].id)
+        saved.append(other.save_expense_info(Expense(
+            name=f'saved #{i}', sum=1, lender_id=1, event_token='token1', datetime='2021-05-01 20:00:00',
+        )).id)
+
+    assert [expense.id for expense in connector.get_event_expenses('token1')] == sorted(saved)
+    assert [(debt.expense_id, debt.sum) for debt in connector.iter_event_debts('token1')] == [
+        (saved[0], 1), (saved[2], 2), (saved[4], 3),
+    ]
+
+
+def test_event_ledger_is_streamed_in_order(connector):
+    for user in (User(id=1, name='Car'), User(id=2, name='Major')):
+        connector.save_user_info(user)
+    connector.create_event(Event(token='token1', name='Pilsener'), user_id=1)
+    connector.create_event(Event(token='token2', name='Smoking'), user_id=1)
+    entries = []
+    for i in range(5):
+        expense = Expense(name=f'expense #{i}', sum=100, lender_id=1 + i % 2, event_token='token1', datetime='2021-05-01 20:00:00')
+        entries.append(expense)
+        entries.extend(Debt(lender_id=expense.lender_id, debtor_id=2 - i % 2, sum=j) for j in range(1, i))
+    connector.insert_ledger_entries(entries)
+    connector.insert_ledger_entries([
+        Expense(name='other', sum=1, lender_id=1, event_token='token2', datetime='2021-05-01 20:00:00'),
+        Debt(lender_id=1, debtor_id=2, sum=1),
+    ])
+
+    assert list(connector.iter_event_ledger('token1', chunk_size=2)) == entries
+    # a debt keeps its own lender even if it differs from the lender of the expense
+    other = connector.get_event_expenses('token2')[0]
+    connector.save_debt_info(Debt(expense_id=other.id, lender_id=2, debtor_id=1, sum=3))
+    assert list(connector.iter_event_ledger('token2'))[1:] == [
+        Debt(expense_id=other.id, lender_id=1, debtor_id=2, sum=1),
+        Debt(expense_id=other.id, lender_id=2, debtor_id=1, sum=3),
+    ]
+
+
+def test_suspended_ledger_does_not_hold_connection(connector):
+    connector.save_user_info(User(id=1, name='Car'))
+    connector.create_event(Event(token='token1', name='Pilsener'), user_id=1)
+    connector.insert_ledger_entries([
+        Expense(name=f'expense #{i}', sum=100, lender_id=1, event_token='token1', datetime='2021-05-01 20:00:00')
+        for i in range(3)
+    ])
+
+    ledger = connector.iter_event_ledger('token1', chunk_size=1)
+    assert next(ledger).name == 'expense #0'
+    writer = threading.Thread(target=connector.save_user_info, args=(User(id=2, name='Major'),), daemon=True)
+    writer.start()
+    writer.join(timeout=5)
+    assert not writer.is_alive()
+    assert [expense.name for expense in ledger] == ['expense #1', 'expense #2']
+    assert connector.get_user_info_or_none(2) == User(id=2, name='Major')
+
+
+def test_slow_query_log(db_name, tmpdir):
+    path = str(tmpdir / 'slow.jsonl')
+    connector = Connector(db_name, config=StorageConfig(slow_query_log=path, slow_query_threshold=0.0))
+    connector.save_user_info(User(id=1, name='Car'))
+    connector.create_event(Event(token='token1', name='Pilsener'), user_id=1)
+    for _ in range(2):
+        connector.get_users_of_event('token1')
+    connector.insert_ledger_entries([
+        Expense(name='first', sum=100, lender_id=1, event_token='token1', datetime='2021-05-01 20:00:00'),
+        Debt(lender_id=1, debtor_id=1, sum=50),
+    ])
+    with open(path) as file:
+        entries = [json.loads(line) for line in file]
+
+    query = HOT_QUERIES[1][0]
+    first, second = [entry for entry in entries if entry['statement'] == query]
+    assert first['parameters'] == second['parameters'] == ['str']
+    assert first['caller'] is None
+    assert any('idx_user2event_event_id' in step for step in first['plan'])
+    # the plan is captured once per statement
+    assert 'plan' not in second
+    debts = [entry for entry in entries if entry['statement'].startswith('INSERT INTO debts')]
+    assert debts[0]['rows'] == 1 and debts[0]['parameters'] == ['int', 'int', 'int', 'int']
+    assert {'COMMIT', 'SAVEPOINT ledger_chunk'} <= {entry['statement'] for entry in entries}
+
+
+def test_slow_query_log_rotates(tmpdir):
+    conn = sqlite3.connect(':memory:')
+    log = SlowQueryLog(str(tmpdir / 'slow.jsonl'), threshold=0.0, max_bytes=500, backup_count=2)
+    for _ in range(10):
+        log.record(conn, 'SELECT ?', 'SELECT ?', (1,), 1.0)
+    log.close()
+    assert sorted(path.basename for path in tmpdir.listdir()) == ['slow.jsonl', 'slow.jsonl.1', 'slow.jsonl.2']
+    assert log.entries == 10
@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import defaultdict
+from queue import Queue
+
+import pytest
+from telegram import Bot, Update
+from telegram.ext import TypeHandler
+
+from benchmarks.fake_bot_api import make_message_update
+from benchmarks.startup import FAKE_TOKEN
+from bot.dispatcher import ChatOrderedDispatcher
+
+
+def make_update(
+    update_id: int,
+    user_id: int,
+    bot: Bot,
+) -> Update:
+    return Update.de_json(dict(make_message_update(user_id, str(update_id)), update_id=update_id), bot)
+
+
+@pytest.fixture(scope='function')
+def dispatcher():
+    dispatcher = ChatOrderedDispatcher(Bot(FAKE_TOKEN), Queue(), chat_workers=4, chat_queue_size=100)
+    yield dispatcher
+    dispatcher.stop()
+
+
+def test_order_within_chat_and_parallelism_across_chats(dispatcher):
+    handled = defaultdict(list)
+    active = set()
+    max_active = 0
+    lock = threading.Lock()
+
+    def callback(update, context):
+        nonlocal max_active
+        chat_id = update.effective_chat.id
+        with lock:
+            assert chat_id not in active, 'two updates of one chat are handled at once'
+            active.add(chat_id)
+            max_active = max(max_active, len(active))
+        time.sleep(0.002)
+        with lock:
+            active.remove(chat_id)
+            handled[chat_id].append(update.update_id)
+
+    dispatcher.add_handler(TypeHandler(Update, callback))
+    sent = defaultdict(list)
+    for update_id in range(1, 201):
+        chat_id = update_id % 8
+        sent[chat_id].append(update_id)
+        dispatcher.process_update(make_update(update_id, chat_id, dispatcher.bot))
+    assert dispatcher.join(timeout=10)
+
+    assert handled == sent
+    assert max_active > 1
+    stats = dispatcher.queue_stats()
+    assert stats['total']['updates'] == 200
+    assert stats['depth'] == {}
+    assert {chat_id: chat['updates'] for chat_id, chat in stats['chats'].items()} == {i: 25 for i in range(8)}
+    assert all(chat['max_depth'] >= 1 for chat in stats['chats'].values())
+
+
+def test_full_chat_queue_blocks_dispatcher(dispatcher):
+    dispatcher.chat_queue_size = 1
+    release = threading.Event()
+    dispatcher.add_handler(TypeHandler(Update, lambda update, context: release.wait(5)))
+    # the first update is taken by a worker, the second one fills the queue
+    dispatcher.process_update(make_update(1, 1, dispatcher.bot))
+    dispatcher.process_update(make_update(2, 1, dispatcher.bot))
+    third = threading.Thread(target=dispatcher.process_update, args=(make_update(3, 1, dispatcher.bot),))
+    third.start()
+    third.join(0.2)
+    assert third.is_alive()
+    assert dispatcher.queue_stats()['depth'] == {1: 1}
+
+    release.set()
+    third.join(5)
+    assert not third.is_alive()
+    assert dispatcher.join(timeout=5)
+    stats = dispatcher.queue_stats()['chats'][1]
+    assert stats['updates'] == 3
+    assert stats['max_wait'] > 0.1
+
+
+def test_handler_errors_do_not_stop_chat(dispatcher):
+    handled = []
+
+    def callback(update, context):
+        if update.update_id == 1:
+            raise RuntimeError('boom')
+        handled.append(update.update_id)
+
+    dispatcher.add_handler(TypeHandler(Update, callback))
+    dispatcher.process_update(make_update(1, 1, dispatcher.bot))
+    dispatcher.process_update(make_update(2, 1, dispatcher.bot))
+    assert dispatcher.join(timeout=5)
+    assert handled == [2]
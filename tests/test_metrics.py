@@ -0,0 +1,127 @@
+import sqlite3
+from datetime import datetime
+import urllib.error
+import urllib.request
+
+import pytest
+from telegram import Update
+
+from benchmarks.fake_bot_api import FakeBotApiServer, make_callback_update, make_message_update
+from benchmarks.startup import FAKE_TOKEN
+from bot import menu_items
+from bot.container import AppContainer
+from bot.tgbot import TelegramBot
+from database.config import StorageConfig
+from database.connector import Connector
+from database.instrumentation import QueryMetrics, statement_label
+from database.model_types import User, Event, Expense, Debt
+from metrics.registry import Registry
+from metrics.server import MetricsServer
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    updates = registry.counter('updates_total', 'Updates', ['kind'])
+    latency = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+    updates.inc('message')
+    updates.inc('message', amount=2)
+    updates.inc('callback "query"')
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value)
+
+    assert registry.counter('updates_total', 'Updates', ['kind']) is updates
+    with pytest.raises(ValueError):
+        registry.histogram('updates_total', 'Updates')
+    with pytest.raises(ValueError):
+        updates.inc('message', 'extra')
+    assert registry.render().splitlines() == [
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        'latency_seconds_sum 3.65',
+        'latency_seconds_count 4',
+        '# HELP updates_total Updates',
+        '# TYPE updates_total counter',
+        'updates_total{kind="callback \\"query\\""} 1',
+        'updates_total{kind="message"} 3',
+    ]
+
+
+def test_statement_label():
+    assert statement_label('SELECT *\n    FROM debts WHERE expense_id IN (?, ?,?)') == \
+        'SELECT * FROM debts WHERE expense_id IN (?, ...)'
+    assert statement_label('INSERT INTO users VALUES(?, ?)') == 'INSERT INTO users VALUES(?, ?)'
+
+
+@pytest.mark.parametrize('config', [StorageConfig(), StorageConfig.wal(read_pool_size=2, group_commit=True)])
+def test_query_metrics(tmpdir, config):
+    registry = Registry()
+    conn = Connector(str(tmpdir / 'db.sqlite'), config=config, query_metrics=QueryMetrics(registry))
+    for user_id in (1, 2):
+        conn.save_user_info(User(user_id, f'user #{user_id}'))
+    conn.create_event(Event('token', 'event'), 1)
+    conn.add_user_to_event(2, 'token')
+    expense_id = conn.save_expense_info(Expense(
+        name='dinner', sum=300, lender_id=1, event_token='token', datetime=datetime.now(),
+    )).id
+    conn.save_debt_info(Debt(expense_id, 1, 2, 100))
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.save_user_info(User(1, 'again'))
+    for _ in range(3):
+        conn.get_user_info_or_none(2)
+    conn.get_event_expenses('token')
+    metrics = {metric.name: metric for metric in registry.collect()}
+
+    seconds = metrics['sqlite_statement_seconds']
+    assert seconds.count('SELECT id, name FROM users WHERE id = ?') == 3
+    assert seconds.count('INSERT INTO users VALUES(?, ?)') == 3
+    assert seconds.count('COMMIT') >= 5
+    assert metrics['sqlite_statement_errors_total'].value('INSERT INTO users VALUES(?, ?)') == 1
+    # balances are maintained by triggers on debts
+    assert metrics['sqlite_statement_programs_total'].value(
+        'INSERT INTO debts (expense_id, lender_id, debtor_id, sum) VALUES(?, ?, ?, ?)') > 1
+    assert metrics['sqlite_fetch_seconds_total'].value(
+        'SELECT x.id, x.name, x.sum, x.lender_id, ev.token, x.datetime '
+        'FROM expenses x JOIN events ev ON ev.id = x.event_id WHERE ev.token = ?') > 0
+    assert 'sqlite_statement_seconds_bucket{statement="SELECT id, name FROM users WHERE id = ?",le="+Inf"} 3' \
+        in registry.render().splitlines()
+
+
+def test_bot_metrics_endpoint(tmpdir):
+    registry = Registry()
+    with FakeBotApiServer() as server:
+        container = AppContainer(db_name=str(tmpdir / 'db.sqlite'), registry=registry)
+        bot = TelegramBot(FAKE_TOKEN, container=container, base_url=server.base_url)
+        dispatcher = bot.updater.dispatcher
+        updates = [
+            make_message_update(1, '/start', username='Car'),
+            make_callback_update(1, menu_items.CREATE_EVENT),
+            make_message_update(1, 'Pilsener'),
+        ]
+        for update_id, update in enumerate(updates, start=1):
+            dispatcher.process_update(Update.de_json(dict(update, update_id=update_id), dispatcher.bot))
+
+    metrics_server = MetricsServer(registry, port=0)
+    metrics_server.start()
+    try:
+        host, port = metrics_server.server_address
+        with urllib.request.urlopen(f'http://{host}:{port}/metrics') as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            lines = response.read().decode().splitlines()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f'http://{host}:{port}/other')
+    finally:
+        metrics_server.stop()
+
+    handler_counts = {
+        line.split('{')[1].split('}')[0]: line.split()[-1]
+        for line in lines if line.startswith('bot_handler_seconds_count')
+    }
+    assert handler_counts == {
+        'handler="BeginningHandlers.start_handler",state="none"': '1',
+        'handler="MenuButtonsConversationHandler.callback_query_handler",state="entry"': '1',
+        'handler="CreateEventConversation.event_name_handler",state="EVENT_NAME_STATE"': '1',
+    }
+    assert any(line.startswith('sqlite_statement_seconds_count{statement="INSERT INTO events') for line in lines)
@@ -0,0 +1,121 @@
+import time
+
+import pytest
+from telegram import Bot, ParseMode, Update
+
+from benchmarks import api_calls_per_action
+from benchmarks.fake_bot_api import FakeBotApiServer, make_callback_update, make_message_update
+from benchmarks.startup import FAKE_TOKEN
+from bot import buttons
+from bot.outbox import MessageSender, TokenBucket
+
+
+@pytest.fixture(scope='function')
+def server():
+    with FakeBotApiServer() as server:
+        yield server
+
+
+@pytest.fixture(scope='function')
+def bot(server):
+    return Bot(FAKE_TOKEN, base_url=server.base_url)
+
+
+def message_update(bot, user_id=1):
+    return Update.de_json(dict(make_message_update(user_id, 'text'), update_id=1), bot)
+
+
+def callback_update(bot, user_id=1):
+    return Update.de_json(dict(make_callback_update(user_id, 'data'), update_id=1), bot)
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0, capacity=1)
+
+
+def test_messages_are_merged(bot, server):
+    sender = MessageSender()
+    with sender.outbox(message_update(bot)) as outbox:
+        outbox.send('Мероприятие создано. Токен: `abc`', parse_mode=ParseMode.MARKDOWN)
+        outbox.send('Меню:', reply_markup=buttons.get_menu_keyboard())
+    calls = server.api.calls_of('sendMessage')
+    assert len(calls) == 1
+    assert calls[0].params['text'] == 'Мероприятие создано. Токен: `abc`\n\nМеню:'
+    assert calls[0].params['parse_mode'] == ParseMode.MARKDOWN
+    assert calls[0].params['reply_markup'] == buttons.get_menu_keyboard().to_dict()
+    assert sender.api_calls == 1
+
+
+def test_messages_that_would_change_are_not_merged(bot, server):
+    with MessageSender().outbox(message_update(bot)) as outbox:
+        outbox.send('Выбери:', reply_markup=buttons.get_cancel_button())
+        outbox.send('first')
+        outbox.send('*bold*', parse_mode=ParseMode.MARKDOWN)
+        outbox.send('snake_case')
+    assert [call.params['text'] for call in server.api.calls_of('sendMessage')] == [
+        'Выбери:',
+        'first\n\n*bold*',
+        'snake_case',
+    ]
+
+
+def test_edits_and_answers_are_combined(bot, server):
+    with MessageSender().outbox(callback_update(bot)) as outbox:
+        outbox.answer()
+        outbox.edit('Меню:')
+        outbox.edit(reply_markup=buttons.get_menu_keyboard())
+        outbox.answer('Готово')
+    assert [call.method for call in server.api.calls] == ['answerCallbackQuery', 'editMessageText']
+    assert server.api.calls[0].params['text'] == 'Готово'
+    assert server.api.calls[1].params['text'] == 'Меню:'
+    assert server.api.calls[1].params['reply_markup'] == buttons.get_menu_keyboard().to_dict()
+
+
+def test_without_coalescing_everything_is_sent_separately(bot, server):
+    with MessageSender(coalesce=False).outbox(callback_update(bot)) as outbox:
+        outbox.edit('Меню:')
+        outbox.edit(reply_markup=buttons.get_menu_keyboard())
+        outbox.answer()
+        outbox.send('a')
+        outbox.send('b')
+    assert [call.method for call in server.api.calls] == [
+        'editMessageText',
+        'editMessageReplyMarkup',
+        'answerCallbackQuery',
+        'sendMessage',
+        'sendMessage',
+    ]
+
+
+def test_retry_after(bot, server):
+    server.api.flood('sendMessage', times=2, retry_after=0.05)
+    sender = MessageSender()
+    with sender.outbox(message_update(bot)) as outbox:
+        outbox.send('hello')
+    assert len(server.api.calls_of('sendMessage')) == 3
+    assert sender.retries == 2
+
+
+def test_per_chat_rate_limit(bot, server):
+    sender = MessageSender(chat_rate=20, chat_burst=1)
+    start = time.monotonic()
+    for user_id in (1, 1, 1, 2):
+        with sender.outbox(message_update(bot, user_id)) as outbox:
+            outbox.send('hello')
+    # the second and the third message of chat 1 wait 0.05s each, chat 2 does not wait
+    assert time.monotonic() - start >= 0.09
+    assert 0.08 <= sender.throttled_seconds <= 0.1
+
+
+def test_api_calls_per_action(tmpdir):
+    separate = api_calls_per_action.run(str(tmpdir / 'separate.sqlite'), coalesce=False)
+    coalesced = api_calls_per_action.run(str(tmpdir / 'coalesced.sqlite'), coalesce=True)
+    assert coalesced['start'] == 1
+    assert coalesced['show_debts'] == 2
+    assert all(coalesced[action] < separate[action] for action in separate)
@@ -0,0 +1,110 @@
+import random
+
+import pytest
+
+from app.settlement import (
+    AutoSettlement,
+    ExactSettlement,
+    GreedySettlement,
+    HeapSettlement,
+    SettlementTimeout,
+)
+
+ENGINES = [GreedySettlement(), HeapSettlement(), ExactSettlement(), AutoSettlement()]
+
+
+def random_balances(rnd, size):
+    balances = {user_id: rnd.randint(-50, 50) for user_id in range(1, size)}
+    balances[size] = -sum(balances.values())
+    return balances
+
+
+def min_transfers_brute_force(values):
+    """
+    n - max number of zero-sum blocks over all set partitions
+    """
+    values = [value for value in values if value]
+
+    def max_blocks(rest):
+        if not rest:
+            return 0
+        first, others = rest[0], rest[1:]
+        best = 0
+        for mask in range(1 << len(others)):
+            block = [first] + [others[i] for i in range(len(others)) if mask >> i & 1]
+            if sum(block) == 0:
+                remaining = [others[i] for i in range(len(others)) if not mask >> i & 1]
+                best = max(best, 1 + max_blocks(remaining))
+        return best
+
+    return len(values) - max_blocks(values)
+
+
+def assert_settles(balances, transfers):
+    rest = dict(balances)
+    for debtor_id, lender_id, payment_sum in transfers:
+        assert payment_sum > 0
+        assert balances[debtor_id] < 0 < balances[lender_id]
+        rest[debtor_id] += payment_sum
+        rest[lender_id] -= payment_sum
+    assert all(balance == 0 for balance in rest.values())
+
+
+@pytest.mark.parametrize('engine', ENGINES, ids=lambda engine: engine.name)
+def test_engines_settle_random_balances(engine):
+    rnd = random.Random(42)
+    for _ in range(200):
+        balances = random_balances(rnd, rnd.randint(1, 10))
+        assert_settles(balances, engine.settle(balances))
+
+
+def test_exact_is_minimal():
+    rnd = random.Random(7)
+    for _ in range(200):
+        # small values produce many zero-sum subsets
+        balances = {user_id: rnd.randint(-5, 5) for user_id in range(1, rnd.randint(2, 8))}
+        balances[0] = -sum(balances.values())
+        exact = ExactSettlement().settle(balances)
+        assert len(exact) == min_transfers_brute_force(list(balances.values()))
+        assert len(exact) <= len(GreedySettlement().settle(balances))
+        assert len(exact) <= len(HeapSettlement().settle(balances))
+
+
+def test_exact_finds_cancelling_subset():
+    balances = {1: 7, 2: 3, 3: -5, 4: -3, 5: -2}
+    assert len(GreedySettlement().settle(balances)) == 4
+    assert len(ExactSettlement().settle(balances)) == 3
+
+
+def test_no_transfers_for_settled_balances():
+    for engine in ENGINES:
+        assert engine.settle({}) == []
+        assert engine.settle({1: 0, 2: 0}) == []
+
+
+def test_unbalanced_input_is_rejected():
+    for engine in ENGINES:
+        with pytest.raises(ValueError):
+            engine.settle({1: 10, 2: -5})
+
+
+def test_auto_falls_back_on_timeout():
+    balances = random_balances(random.Random(1), 16)
+    with pytest.raises(SettlementTimeout):
+        ExactSettlement(time_budget=0).settle(balances)
+
+    transfers = AutoSettlement(time_budget=0).settle(balances)
+    assert_settles(balances, transfers)
+    assert transfers == HeapSettlement().settle(balances)
+
+
+def test_auto_solves_twenty_participants_exactly():
+    rnd = random.Random(3)
+    improved = 0
+    for _ in range(5):
+        balances = random_balances(rnd, 20)
+        transfers = AutoSettlement().settle(balances)
+        assert_settles(balances, transfers)
+        assert len(transfers) == len(ExactSettlement().settle(balances))
+        improved += len(transfers) < len(HeapSettlement().settle(balances))
+    assert improved
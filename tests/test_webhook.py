@@ -0,0 +1,85 @@
+import queue
+
+import pytest
+from telegram import Bot
+
+from benchmarks import webhook as webhook_benchmark
+from benchmarks.fake_bot_api import FakeBotApiServer, make_message_update
+from benchmarks.startup import FAKE_TOKEN
+from bot.tgbot import TelegramBot
+from bot.webhook import WebhookServer
+
+SECRET = webhook_benchmark.SECRET
+
+
+@pytest.fixture(scope='function')
+def server():
+    with FakeBotApiServer() as server:
+        yield server
+
+
+@pytest.fixture(scope='function')
+def bot(tmpdir, server):
+    bot = TelegramBot(FAKE_TOKEN, db_name=str(tmpdir / 'db.sqlite'), base_url=server.base_url)
+    webhook = bot.start_webhook('https://example.com/hook', SECRET, listen='127.0.0.1', port=0)
+    host, port = webhook.server_address
+    bot.webhook_url = f'http://{host}:{port}/webhook'
+    yield bot
+    bot.stop_webhook()
+
+
+def test_webhook_registered_with_secret(bot, server):
+    set_webhook = server.api.calls_of('setWebhook')
+    assert len(set_webhook) == 1
+    assert set_webhook[0].params['url'] == 'https://example.com/hook'
+    assert set_webhook[0].params['secret_token'] == SECRET
+
+
+def test_recorded_updates_are_handled(bot, server):
+    updates = [
+        make_message_update(1, '/start', username='Car'),
+        make_message_update(1, '/start', username='Car'),
+    ]
+    for update_id, update in enumerate(updates, start=1):
+        assert webhook_benchmark.post_update(bot.webhook_url, dict(update, update_id=update_id)) == 200
+        assert server.api.wait_for_calls(update_id, 'sendMessage')
+
+    texts = [call.params['text'] for call in server.api.calls_of('sendMessage')]
+    assert texts == ['Привет, Car! Ты здесь впервые!\n\nМеню:', 'Привет, Car! Ты уже был(а) здесь!\n\nМеню:']
+
+
+def test_wrong_secret_and_path_are_rejected(bot, server):
+    update = dict(make_message_update(1, '/start'), update_id=1)
+    assert webhook_benchmark.post_update(bot.webhook_url, update, secret_token='wrong') == 403
+    assert webhook_benchmark.post_update(bot.webhook_url, update, secret_token='') == 403
+    assert webhook_benchmark.post_update(bot.webhook_url, update, secret_token='sécret') == 403
+    assert webhook_benchmark.post_update(bot.webhook_url + '/other', update) == 404
+    assert server.api.calls_of('sendMessage') == []
+
+
+def test_full_queue_answers_503():
+    update_queue = queue.Queue(maxsize=1)
+    webhook = WebhookServer(Bot(FAKE_TOKEN), update_queue, SECRET, listen='127.0.0.1', port=0, put_timeout=0.01)
+    webhook.start()
+    try:
+        host, port = webhook.server_address
+        url = f'http://{host}:{port}/webhook'
+        assert webhook_benchmark.post_update(url, dict(make_message_update(1, '/start'), update_id=1)) == 200
+        assert webhook_benchmark.post_update(url, dict(make_message_update(2, '/start'), update_id=2)) == 503
+        assert update_queue.get_nowait().update_id == 1
+    finally:
+        webhook.stop()
+
+
+def test_webhook_benchmark(tmpdir):
+    result = webhook_benchmark.run(str(tmpdir / 'bench.sqlite'), updates=50, senders=4)
+    assert result['accepted'] == 50
+    assert result['handled'] == 50
+    assert result['all_handled']
+    assert result['p99_latency'] >= result['p50_latency'] > 0
+
+
+def test_webhook_benchmark_with_chat_workers(tmpdir):
+    result = webhook_benchmark.run(str(tmpdir / 'bench.sqlite'), updates=50, senders=4, chat_workers=4)
+    assert result['handled'] == 50
+    assert result['all_handled']